@@ -0,0 +1,59 @@
+
+# _filter_parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = 'leftXORORANDrightNOTAND EQ EQEQ FILTER GT GTE ID LPAREN LT LTE NE NO NOT NUMBER OR PYTHON REGEXP RPAREN STRING XOR YESfil : expfil :exp : YESexp : NOexp : PYTHONexp : FILTER IDexp : LPAREN exp RPARENexp : NOT expexp : exp AND expexp : exp OR expexp : exp XOR exp\n        val : NUMBER\n            | STRING\n            | id\n        \n        eop : EQ\n            | EQEQ\n            | NE\n        \n        rop : LT\n            | LTE\n            | GT\n            | GTE\n        \n        op  : eop\n            | rop\n        \n        id  : ID\n        \n        re  : REGEXP\n        \n        exp : val op val\n        \n        exp : val eop re\n            | re eop val\n        \n        exp : ID\n        '
+    
+_lr_action_items = {'$end':([0,1,2,3,4,5,7,12,13,14,15,19,21,33,34,35,36,37,38,39,40,],[-2,0,-1,-3,-4,-5,-29,-12,-13,-14,-25,-6,-8,-9,-10,-11,-7,-26,-24,-27,-28,]),'YES':([0,8,9,16,17,18,],[3,3,3,3,3,3,]),'NO':([0,8,9,16,17,18,],[4,4,4,4,4,4,]),'PYTHON':([0,8,9,16,17,18,],[5,5,5,5,5,5,]),'FILTER':([0,8,9,16,17,18,],[6,6,6,6,6,6,]),'LPAREN':([0,8,9,16,17,18,],[8,8,8,8,8,8,]),'NOT':([0,8,9,16,17,18,],[9,9,9,9,9,9,]),'ID':([0,6,8,9,16,17,18,22,23,24,25,26,27,28,29,30,31,32,],[7,19,7,7,7,7,7,38,-22,-23,-15,-16,-17,-18,-19,-20,-21,38,]),'NUMBER':([0,8,9,16,17,18,22,23,24,25,26,27,28,29,30,31,32,],[12,12,12,12,12,12,12,-22,-23,-15,-16,-17,-18,-19,-20,-21,12,]),'STRING':([0,8,9,16,17,18,22,23,24,25,26,27,28,29,30,31,32,],[13,13,13,13,13,13,13,-22,-23,-15,-16,-17,-18,-19,-20,-21,13,]),'REGEXP':([0,8,9,16,17,18,23,25,26,27,],[15,15,15,15,15,15,15,-15,-16,-17,]),'AND':([2,3,4,5,7,12,13,14,15,19,20,21,33,34,35,36,37,38,39,40,],[16,-3,-4,-5,-29,-12,-13,-14,-25,-6,16,-8,-9,-10,-11,-7,-26,-24,-27,-28,]),'OR':([2,3,4,5,7,12,13,14,15,19,20,21,33,34,35,36,37,38,39,40,],[17,-3,-4,-5,-29,-12,-13,-14,-25,-6,17,-8,-9,-10,-11,-7,-26,-24,-27,-28,]),'XOR':([2,3,4,5,7,12,13,14,15,19,20,21,33,34,35,36,37,38,39,40,],[18,-3,-4,-5,-29,-12,-13,-14,-25,-6,18,-8,-9,-10,-11,-7,-26,-24,-27,-28,]),'RPAREN':([3,4,5,7,12,13,14,15,19,20,21,33,34,35,36,37,38,39,40,],[-3,-4,-5,-29,-12,-13,-14,-25,-6,36,-8,-9,-10,-11,-7,-26,-24,-27,-28,]),'EQ':([7,10,11,12,13,14,15,],[-24,25,25,-12,-13,-14,-25,]),'EQEQ':([7,10,11,12,13,14,15,],[-24,26,26,-12,-13,-14,-25,]),'NE':([7,10,11,12,13,14,15,],[-24,27,27,-12,-13,-14,-25,]),'LT':([7,10,12,13,14,],[-24,28,-12,-13,-14,]),'LTE':([7,10,12,13,14,],[-24,29,-12,-13,-14,]),'GT':([7,10,12,13,14,],[-24,30,-12,-13,-14,]),'GTE':([7,10,12,13,14,],[-24,31,-12,-13,-14,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'fil':([0,],[1,]),'exp':([0,8,9,16,17,18,],[2,20,21,33,34,35,]),'val':([0,8,9,16,17,18,22,32,],[10,10,10,10,10,10,37,40,]),'re':([0,8,9,16,17,18,23,],[11,11,11,11,11,11,39,]),'id':([0,8,9,16,17,18,22,32,],[14,14,14,14,14,14,14,14,]),'op':([10,],[22,]),'eop':([10,11,],[23,32,]),'rop':([10,],[24,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> fil","S'",1,None,None,None),
+  ('fil -> exp','fil',1,'p_fil_exp','filters.py',734),
+  ('fil -> <empty>','fil',0,'p_fil_empty','filters.py',738),
+  ('exp -> YES','exp',1,'p_exp_yes','filters.py',742),
+  ('exp -> NO','exp',1,'p_exp_no','filters.py',746),
+  ('exp -> PYTHON','exp',1,'p_exp_python','filters.py',750),
+  ('exp -> FILTER ID','exp',2,'p_exp_filter','filters.py',754),
+  ('exp -> LPAREN exp RPAREN','exp',3,'p_exp_parens','filters.py',758),
+  ('exp -> NOT exp','exp',2,'p_exp_not','filters.py',762),
+  ('exp -> exp AND exp','exp',3,'p_exp_and','filters.py',766),
+  ('exp -> exp OR exp','exp',3,'p_exp_or','filters.py',770),
+  ('exp -> exp XOR exp','exp',3,'p_exp_xor','filters.py',774),
+  ('val -> NUMBER','val',1,'p_val','filters.py',779),
+  ('val -> STRING','val',1,'p_val','filters.py',780),
+  ('val -> id','val',1,'p_val','filters.py',781),
+  ('eop -> EQ','eop',1,'p_eqop','filters.py',787),
+  ('eop -> EQEQ','eop',1,'p_eqop','filters.py',788),
+  ('eop -> NE','eop',1,'p_eqop','filters.py',789),
+  ('rop -> LT','rop',1,'p_relop','filters.py',795),
+  ('rop -> LTE','rop',1,'p_relop','filters.py',796),
+  ('rop -> GT','rop',1,'p_relop','filters.py',797),
+  ('rop -> GTE','rop',1,'p_relop','filters.py',798),
+  ('op -> eop','op',1,'p_op','filters.py',804),
+  ('op -> rop','op',1,'p_op','filters.py',805),
+  ('id -> ID','id',1,'p_id','filters.py',811),
+  ('re -> REGEXP','re',1,'p_re','filters.py',817),
+  ('exp -> val op val','exp',3,'p_exp_comparison','filters.py',824),
+  ('exp -> val eop re','exp',3,'p_exp_recompare','filters.py',842),
+  ('exp -> re eop val','exp',3,'p_exp_recompare','filters.py',843),
+  ('exp -> ID','exp',1,'p_truth','filters.py',858),
+]
@@ -46,6 +46,8 @@ import urllib.parse
 import base64
 import logging
 import socket
+import threading
+import time
 
 import aiohttp
 
@@ -79,19 +81,18 @@ class Rooster(util.HTTP_JSONmixin):
             hostname = socket.getfqdn()
         self.service = service + '@' + hostname
         self.principal = None
-        self.ctx = None
-        self.ccache = None
+        self.krb5 = Kerberos()
         self.tailid = 0
         self.log = logging.getLogger('Rooster.%x' % (id(self),))
         self.setup_client_session()
 
     @asyncio.coroutine
     def credentials(self):
-        return get_zephyr_creds()
+        return (yield from self.krb5.zephyr_creds())
 
     @asyncio.coroutine
     def auth(self, create_user=False):
-        self.principal, token = get_auth_token(self.service)
+        self.principal, token = yield from self.krb5.auth_token(self.service)
 
         result = yield from self._post_json(
             '/v1/auth',
@@ -179,10 +180,12 @@ class Rooster(util.HTTP_JSONmixin):
         return (yield from self._get('/v1/zephyrcreds'))
 
     @asyncio.coroutine
-    def renew_zephyrcreds(self):
+    def renew_zephyrcreds(self, credentials=None):
         yield from self.ensure_auth()
+        if credentials is None:
+            credentials = yield from self.credentials()
         return (yield from self._post_json(
-            '/v1/zephyrcreds', credentials=self.zephyr_creds()))
+            '/v1/zephyrcreds', credentials=credentials))
 
     @asyncio.coroutine
     def bytime(self, t):
@@ -205,7 +208,13 @@ class Rooster(util.HTTP_JSONmixin):
             ))
 
     @asyncio.coroutine
-    def newmessages(self, coro, startid=None, pingfrequency=5):
+    def newmessages(self, coro, startid=None, pingfrequency=5, window=64):
+        """Tail new messages, handing each batch to coro as a list.
+
+        The server only sends messages we've extended the tail for, so
+        keep window messages of credit outstanding and top it up in bulk
+        when it falls to half.
+        """
         # will coincidentally ensure_auth
         if startid is None:
             ms = yield from self.messages(None, 1, reverse=1, inclusive=0)
@@ -228,7 +237,8 @@ class Rooster(util.HTTP_JSONmixin):
                 })
 
             state = 'start'
-            msgcount = 1
+            msgcount = window
+            received = 0
             tailid = self.tailid
             self.tailid += 1
 
@@ -271,14 +281,16 @@ class Rooster(util.HTTP_JSONmixin):
                         self.log.debug('pong')
                         state = 'pong'
                     elif m['type'] == 'messages':
-                        msgcount += 1
-                        ws.write({
-                            'type': 'extend-tail',
-                            'id': tailid,
-                            'count': msgcount,
-                            })
-                        for msg in m['messages']:
-                            yield from coro(msg)
+                        received += len(m['messages'])
+                        if msgcount - received <= window // 2:
+                            msgcount = received + window
+                            ws.write({
+                                'type': 'extend-tail',
+                                'id': tailid,
+                                'count': msgcount,
+                                })
+                        if m['messages']:
+                            yield from coro(m['messages'])
                     else:
                         self.log.debug('unknown message type: %s', repr(m))
 
@@ -306,30 +318,80 @@ def trampoline(f, *args, **kwargs):
         raise ExileException(str(e), str(traceback.format_exc())) from None
 
 
-def get_auth_token(service):
-    context = krb5.Context()
-    ccache = context.cc_default()
-    principal = ccache.get_principal()
-    princ_str = principal.unparse_name()
+class Kerberos:
+    """Kerberos state for a Rooster, kept between calls.
 
-    client_name = gss.import_name(princ_str, gss.KRB5_NT_PRINCIPAL_NAME)
-    target_name = gss.import_name(service, gss.C_NT_HOSTBASED_SERVICE)
-    cred = gss.acquire_cred(client_name, initiate=True)
+    The krb5 context and ccache are opened once and reused, and zephyr
+    credentials are handed out again until they're about to expire.  The
+    krb5 and GSS calls block, so they're run in the default executor, one
+    at a time since the handles aren't thread safe.
+    """
 
-    gss_ctx = gss.create_initiator(
-        target_name, credential=cred, mechanism=gss.KRB5_MECHANISM)
-    token = gss_ctx.init_sec_context()
-    if not gss_ctx.is_established():
-        raise Exception('Should be single-token')
+    SLACK = 300  # seconds before they expire that creds count as stale
 
-    return princ_str.decode('utf-8'), base64.b64encode(token).decode('ascii')
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ctx = None
+        self.ccache = None
+        self.zephyr = None
 
+    @asyncio.coroutine
+    def run(self, f, *args):
+        loop = asyncio.get_event_loop()
+        return (yield from loop.run_in_executor(None, self.call, f, *args))
+
+    def call(self, f, *args):
+        with self.lock:
+            try:
+                return f(*args)
+            except krb5.Error:
+                # the ccache may have been destroyed or replaced out from
+                # under us, so have one more go with fresh handles
+                self.ctx = self.ccache = None
+                return f(*args)
+
+    def handles(self):
+        if self.ctx is None:
+            self.ctx = krb5.Context()
+            self.ccache = self.ctx.cc_default()
+        return self.ctx, self.ccache
+
+    def expires(self):
+        """When the cached zephyr credentials expire (0 if there aren't any)"""
+        return self.zephyr['endtime'] / 1000 if self.zephyr else 0
 
-def get_zephyr_creds():
-    # XXX hardcoded ATHENA.MIT.EDU
-    context = krb5.Context()
-    ccache = context.cc_default()
-    principal = ccache.get_principal()
-    zephyr = context.build_principal('ATHENA.MIT.EDU', ['zephyr', 'zephyr'])
-    creds = ccache.get_credentials(principal, zephyr)
-    return creds.to_dict()
+    @asyncio.coroutine
+    def zephyr_creds(self):
+        if time.time() >= self.expires() - self.SLACK:
+            self.zephyr = yield from self.run(self.get_zephyr_creds)
+        return self.zephyr
+
+    @asyncio.coroutine
+    def auth_token(self, service):
+        return (yield from self.run(self.get_auth_token, service))
+
+    def get_auth_token(self, service):
+        ctx, ccache = self.handles()
+        princ_str = ccache.get_principal().unparse_name()
+
+        client_name = gss.import_name(princ_str, gss.KRB5_NT_PRINCIPAL_NAME)
+        target_name = gss.import_name(service, gss.C_NT_HOSTBASED_SERVICE)
+        cred = gss.acquire_cred(client_name, initiate=True)
+
+        gss_ctx = gss.create_initiator(
+            target_name, credential=cred, mechanism=gss.KRB5_MECHANISM)
+        token = gss_ctx.init_sec_context()
+        if not gss_ctx.is_established():
+            raise Exception('Should be single-token')
+
+        return (
+            princ_str.decode('utf-8'),
+            base64.b64encode(token).decode('ascii'))
+
+    def get_zephyr_creds(self):
+        # XXX hardcoded ATHENA.MIT.EDU
+        ctx, ccache = self.handles()
+        principal = ccache.get_principal()
+        zephyr = ctx.build_principal('ATHENA.MIT.EDU', ['zephyr', 'zephyr'])
+        creds = ccache.get_credentials(principal, zephyr)
+        return creds.to_dict()
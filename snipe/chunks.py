@@ -154,25 +154,39 @@ class Chunk:
     def mark_re(self, regexp, mark):
         """Return a new chunk, calling mark(tags) on portions of the old
         chunk that match regexp.
+
+        This makes a single pass over the chunk, so it stays linear however
+        many matches there are.
         """
 
-        spans = [m.span() for m in re.finditer(regexp, str(self))]
-        new = []
-        prev = 0
-
-        # make start and end relative
-        for i, (start, end) in enumerate(spans):
-            spans[i] = (start - prev, end - start)
-            prev = end
-
-        chunk = self
-        for start, end in spans:
-            before, chunk = chunk.slice(start)
-            new.extend(before)
-            within, chunk = chunk.slice(end)
-            new.extend([(mark(tags), s) for (tags, s) in within])
-        new.extend(chunk)
-        return Chunk(new)
+        spans = [
+            m.span() for m in re.finditer(regexp, str(self))
+            if m.end() > m.start()]
+        new = Chunk()
+        off = 0
+        j = 0
+        for tags, text in self.contents:
+            end = off + len(text)
+            if not text:
+                new.append((tags, text))
+            pos = off
+            while pos < end:
+                while j < len(spans) and spans[j][1] <= pos:
+                    j += 1
+                if j < len(spans) and spans[j][0] <= pos:
+                    inside, stop = True, min(end, spans[j][1])
+                elif j < len(spans):
+                    inside, stop = False, min(end, spans[j][0])
+                else:
+                    inside, stop = False, end
+                # like slice(), only the first piece keeps the point tags
+                piecetags = tags if pos == off else tags - self.POINT_TAGS
+                if inside:
+                    piecetags = mark(piecetags)
+                new.append((piecetags, text[pos - off:stop - off]))
+                pos = stop
+            off = end
+        return new
 
     @staticmethod
     def tag_reverse(tags):
@@ -97,6 +97,7 @@ class Context:
         self.erasechar = None
 
         self.backends = None
+        self.backends_task = None
 
     def load(self, cli_conf={}):
         path = os.path.join(self.directory, 'config')
@@ -106,13 +107,15 @@ class Context:
 
         util.Configurable.set_overrides(cli_conf)
 
+        # the configured backends are added by start_backends, once the
+        # user has something to look at
         self.backends = messages.AggregatorBackend(
             self,
             backends=[
                 messages.StartupBackend(self),
                 messages.DateBackend(self),
                 messages.SinkBackend(self),
-                ] + self.loadbackends())
+                ])
 
         self.read_starks()
 
@@ -128,25 +131,64 @@ class Context:
 
         self.backends.start()
 
-    def loadbackends(self):
+    @asyncio.coroutine
+    def start_backends(self):
+        """Import, construct and start the configured backends, once the
+        user has something to look at.  The imports (which drag in aiohttp
+        and friends) happen one at a time with the loop getting a turn in
+        between; they stay on the loop thread because importing a backend
+        registers the Configurables everything else reads."""
+        try:
+            known = set(util.Configurable.registry)
+            modules = {}
+            for name in sorted(set(n for (_, n, _) in self.backend_specs())):
+                yield from asyncio.sleep(0)
+                try:
+                    modules[name] = importlib.import_module(name, __package__)
+                except Exception as e:
+                    modules[name] = e
+            backends = self.loadbackends(modules)
+            # act on the settings the backend modules just defined
+            util.Configurable.immanentize(
+                self, set(util.Configurable.registry) - known)
+            for backend in backends:
+                self.backends.add(backend)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.log.exception('starting backends')
+            self.message('error starting backends; see the log')
+
+    def backend_specs(self):
+        """Parse the backends setting into (spec, module, kwargs) triples."""
+        specs = []
+        for string in self.backend_spec.split(';'):
+            string = string.strip()
+            line = string.split()
+            if not line:
+                continue  # pragma: nocover # XXX should complain
+            kwargs = {}
+            for arg in line[1:]:
+                kv = arg.split('=')
+                if len(kv) != 2:
+                    self.log.error('invalid argument %s', kv)
+                    continue
+                kwargs[kv[0]] = kv[1]
+            specs.append((string, line[0], kwargs))
+        return specs
+
+    def loadbackends(self, modules={}):
+        """Construct the configured backends, importing any modules not
+        already in modules (which may hold exceptions from failed imports.)"""
         loaded = []
-        backends = self.backend_spec.split(';')
-        backends = [backend.strip() for backend in backends]
-        for string in backends:
+        for string, name, kwargs in self.backend_specs():
             try:
-                line = string.split()
-                if not line:
-                    continue  # pragma: nocover # XXX should complain
-                kwargs = {}
-                if len(line) > 1:
-                    for arg in line[1:]:
-                        kv = arg.split('=')
-                        if len(kv) != 2:
-                            self.log.error('invalid argument %s', kv)
-                            continue
-                        kwargs[kv[0]] = kv[1]
                 self.log.debug('loading backend %s', string)
-                module = importlib.import_module(line[0], __package__)
+                module = modules.get(name)
+                if isinstance(module, Exception):
+                    raise module
+                if module is None:
+                    module = importlib.import_module(name, __package__)
                 backend = getattr(module, module._backend)(self, **kwargs)
                 loaded.append(backend)
             except:
@@ -198,7 +240,10 @@ class Context:
 
     @asyncio.coroutine
     def shutdown(self):
+        if self.backends_task is not None and not self.backends_task.done():
+            self.backends_task.cancel()
         yield from self.backends.shutdown()
+        util.http_pool().close()
 
     def message(self, s):
         self.messagelog.append(s)
@@ -252,6 +297,11 @@ class SnipeLogHandler(logging.Handler):
         1024*1024,
         'number of log entries to keep in memory',
         coerce=int)
+    unformatted = util.Configurable(
+        'log.unformatted',
+        1024,
+        'number of the most recent log entries to keep unformatted',
+        coerce=int)
     filename = util.Configurable(
         'log.file',
         '/tmp/snipe.%d.log' % (os.getuid()),
@@ -274,6 +324,7 @@ class SnipeLogHandler(logging.Handler):
         super().__init__(level)
         self.context = None
         self.buffer = collections.deque(maxlen=self.size)
+        self.records = collections.deque()
         self.task = None
         self.setFormatter(logging.Formatter(
             '%(asctime)s.%(msecs)03d %(name)s %(filename)s:%(lineno)s:'
@@ -287,12 +338,21 @@ class SnipeLogHandler(logging.Handler):
         self.release()
 
     def emit(self, record):
-        s = self.format(record)
+        # Most of the log never gets looked at, so the newest records are
+        # kept as they are and only formatted when they age out or get
+        # written out.  (Their arguments are formatted as of then, and
+        # are kept alive until then, hence the separate, smaller limit.)
+        # Tracebacks are rendered now so the frames they refer to can go
+        # away.
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
         with self.the_lock():
             if self.buffer.maxlen != self.size:
-                self.buffer = collections.deque(
-                    self.buffer[-self.size:], maxlen=self.size)
-            self.buffer.append(s)
+                self.buffer = collections.deque(self.buffer, maxlen=self.size)
+            self.records.append(record)
+            while len(self.records) > self.unformatted:
+                self.buffer.append(self.format(self.records.popleft()))
             if self.writing and self.task is None:
                 self.task = asyncio.Task(self.writer())
 
@@ -304,7 +364,18 @@ class SnipeLogHandler(logging.Handler):
         with self.the_lock(), open(
                 self.filename, 'a', opener=self.opener) as fp:
             fp.writelines(s + '\n' for s in self.buffer)
+            fp.writelines(self.format(r) + '\n' for r in self.records)
             self.buffer.clear()
+            self.records.clear()
+
+    def format(self, record):
+        try:
+            return super().format(record)
+        except Exception as e:
+            # a bad format string or argument shouldn't cost us the rest
+            return '%s %s:%s: unformattable %r %r: %s' % (
+                record.name, record.filename, record.lineno,
+                record.msg, record.args, e)
 
     @asyncio.coroutine
     def writer(self):
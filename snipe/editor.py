@@ -32,11 +32,13 @@ snipe.editor
 ------------
 '''
 
+import collections
 import contextlib
 import functools
 import itertools
 import logging
 import re
+import time
 import unicodedata
 
 from . import chunks
@@ -146,9 +148,23 @@ class Buffer:
                 k += self.buf.size
             return self.buf.textrange(k, k+1)
 
-    def undo(self, which):
+    def undo(self):
         self.cache = {}
-        return self.buf.undo(which)
+        return self.buf.undo()
+
+    def redo(self):
+        self.cache = {}
+        return self.buf.redo()
+
+    def undo_boundary(self):
+        self.buf.undo_boundary()
+
+    def undo_usage(self):
+        return len(self.buf.undolog), self.buf.undo_size
+
+    def configure_undo(self, limit, compress):
+        self.buf.undo_limit = limit
+        self.buf.undo_compress = compress
 
     def replace(self, where, count, string, collapsible):
         self.cache = {}
@@ -158,6 +174,15 @@ class Buffer:
 class Viewer(window.Window, window.PagingMixIn):
     EOL = '\n'
 
+    undo_limit = util.Configurable(
+        'editor.undo_limit', gap.UndoableGapBuffer.UNDO_LIMIT,
+        'Approximate number of characters of undo history kept per buffer',
+        coerce=int)
+    undo_compress = util.Configurable(
+        'editor.undo_compress', gap.UndoableGapBuffer.UNDO_COMPRESS,
+        'Deleted text at least this long is compressed in the undo history',
+        coerce=int)
+
     def __init__(
             self,
             *args,
@@ -180,14 +205,15 @@ class Viewer(window.Window, window.PagingMixIn):
             self.keymap['Control-H'] = help.keymap
 
         self.log = logging.getLogger('Editor.%x' % (id(self),))
+        self.decorations = collections.OrderedDict()
 
         if not prototype:
+            self.buf.configure_undo(self.undo_limit, self.undo_compress)
             self.cursor = self.buf.mark(0)
             self.the_mark = None
             self.mark_ring = []
 
             self.yank_state = 1
-            self.undo_state = None
 
             self.goal_column = None
         else:
@@ -196,7 +222,6 @@ class Viewer(window.Window, window.PagingMixIn):
             self.mark_ring = [self.buf.mark(i) for i in prototype.mark_ring]
 
             self.yank_state = prototype.yank_state
-            self.undo_state = prototype.undo_state  # ?
 
             self.goal_column = prototype.goal_column
 
@@ -314,6 +339,8 @@ class Viewer(window.Window, window.PagingMixIn):
 
     SHOW_COMBINING = {'bg:blue', 'bold'}
     SHOW_CONTROL = {'bold'}
+    CONTROL_RE = re.compile('[\x00-\x08\x0b-\x1f\x7f]')
+    DECORATION_CACHE = 512
 
     def view(self, origin, direction='forward'):
         m = self.buf.mark(origin)
@@ -325,82 +352,14 @@ class Viewer(window.Window, window.PagingMixIn):
             with self.save_excursion(m):
                 p, s = self.extract_current_line()
 
-            chunk = chunks.Chunk([((), s)])
-
             l = len(s)
+            coff = None
             if ((p <= self.cursor.point < p + l)
                     or (s[-1:] != '\n'
                         and self.cursor.point == p + l == len(self.buf))):
                 coff = self.cursor.point - p
-                if ((coff < len(s) and unicodedata.combining(s[coff]))
-                        or ((coff < (len(s) - 1))
-                            and unicodedata.combining(s[coff + 1]))):
-                    # and self.hasfocus, however you spell that
-
-                    self.log.debug(
-                        'exploding from %s %s',
-                        util.unirepr(s[coff]), util.unirepr(s[coff:]))
-
-                    # run forward to see how many there are
-                    for explode_end in range(coff + 1, len(s)):
-                        if not unicodedata.combining(s[explode_end]):
-                            break
-                    else:
-                        explode_end = len(s)
-                    # and backward
-                    for explode_start in range(coff - 1, -1, -1):
-                        if not unicodedata.combining(s[explode_start]):
-                            explode_start += 1
-                            break
-                    else:
-                        explode_start = coff
-                    # adjust the cursor pointer for what we're about to do
-                    adj = coff - explode_start
-                    self.log.debug('coff = %d, adj = %d', coff, adj)
-                    coff = coff + adj
-                    # insert spaces in front of the combining code units
-                    exploded = ''.join(itertools.chain(*zip(
-                        ' ' * (explode_end - explode_start),
-                        s[explode_start:explode_end])))
-                    if (explode_start != 0
-                            and unicodedata.combining(s[explode_start])):
-                        # put the modified character in the visually
-                        # distinctive bit
-                        explode_start -= 1
-                        exploded = s[explode_start] + exploded
-                    else:
-                        # we added an extra space up there
-                        exploded = exploded[1:]
-                    chunk = chunks.Chunk([
-                        ((), s[:explode_start]),
-                        (self.SHOW_COMBINING, exploded),
-                        ((), s[explode_end:]),
-                        ])
-                    self.log.debug(
-                        'len(s) = %d, coff = %d, explode_start = %d,'
-                        ' explode_end = %d: %s %s %s ',
-                        len(s), coff, explode_start, explode_end,
-                        util.unirepr(chunk[0].text),
-                        util.unirepr(chunk[1].text),
-                        util.unirepr(chunk[2].text))
-                    s = s[:explode_start] + exploded + s[explode_end:]
-                chunk.at_add(coff, {'cursor', 'visible'})
-
-            for i, ch in reversed(list(enumerate(s))):
-                c = ord(ch)
-                if (ch != '\n' and ch != '\t' and c < ord(' ')) or c == 0o177:
-                    left, rest = chunk.slice(i)
-                    ((old, _),), right = rest.slice(1)
-                    uncontrol = [(
-                        self.SHOW_CONTROL | (set(old) & {'cursor', 'visible'}),
-                        '^' + chr((c + ord('@')) & 127))]
-                    chunk = left + uncontrol + right
-
-            if self.search_term is not None:
-                chunk = chunk.mark_re(
-                    re.escape(self.search_term), chunk.tag_reverse)
 
-            yield chunks.View(self.buf.mark(p), chunk)
+            yield chunks.View(self.buf.mark(p), self.decorate_line(s, coff))
 
             if direction == 'forward':
                 if p == len(self.buf) or s[-1:] != '\n':
@@ -411,6 +370,119 @@ class Viewer(window.Window, window.PagingMixIn):
                     break
                 m.point = p - 1
 
+    def decorate_line(self, s, coff):
+        """Return the chunk to display for the line s, with the cursor at
+        offset coff (or None if the cursor isn't on this line).
+
+        Results are cached on (s, coff, search term), so repainting a line
+        that hasn't changed doesn't redo any of the work.
+        """
+
+        key = (s, coff, self.search_term)
+        chunk = self.decorations.get(key)
+        if chunk is None:
+            chunk = self.decorate_cursor(s, coff)
+            chunk = self.decorate_control(chunk)
+            if self.search_term is not None:
+                chunk = chunk.mark_re(
+                    re.escape(self.search_term), chunk.tag_reverse)
+            self.decorations[key] = chunk
+            while len(self.decorations) > self.DECORATION_CACHE:
+                self.decorations.popitem(last=False)
+        else:
+            self.decorations.move_to_end(key)
+        # our callers are allowed to scribble on what we give them
+        return chunks.Chunk(chunk)
+
+    def decorate_cursor(self, s, coff):
+        """Mark the cursor position, exploding any combining characters
+        under it so that they're visible separately."""
+
+        chunk = chunks.Chunk([((), s)])
+        if coff is None:
+            return chunk
+
+        if ((coff < len(s) and unicodedata.combining(s[coff]))
+                or ((coff < (len(s) - 1))
+                    and unicodedata.combining(s[coff + 1]))):
+            # and self.hasfocus, however you spell that
+
+            self.log.debug(
+                'exploding from %s %s',
+                util.unirepr(s[coff]), util.unirepr(s[coff:]))
+
+            # run forward to see how many there are
+            for explode_end in range(coff + 1, len(s)):
+                if not unicodedata.combining(s[explode_end]):
+                    break
+            else:
+                explode_end = len(s)
+            # and backward
+            for explode_start in range(coff - 1, -1, -1):
+                if not unicodedata.combining(s[explode_start]):
+                    explode_start += 1
+                    break
+            else:
+                explode_start = coff
+            # adjust the cursor pointer for what we're about to do
+            adj = coff - explode_start
+            self.log.debug('coff = %d, adj = %d', coff, adj)
+            coff = coff + adj
+            # insert spaces in front of the combining code units
+            exploded = ''.join(itertools.chain(*zip(
+                ' ' * (explode_end - explode_start),
+                s[explode_start:explode_end])))
+            if (explode_start != 0
+                    and unicodedata.combining(s[explode_start])):
+                # put the modified character in the visually
+                # distinctive bit
+                explode_start -= 1
+                exploded = s[explode_start] + exploded
+            else:
+                # we added an extra space up there
+                exploded = exploded[1:]
+            chunk = chunks.Chunk([
+                ((), s[:explode_start]),
+                (self.SHOW_COMBINING, exploded),
+                ((), s[explode_end:]),
+                ])
+            self.log.debug(
+                'len(s) = %d, coff = %d, explode_start = %d,'
+                ' explode_end = %d: %s %s %s ',
+                len(s), coff, explode_start, explode_end,
+                util.unirepr(chunk[0].text),
+                util.unirepr(chunk[1].text),
+                util.unirepr(chunk[2].text))
+        return chunk.at_add(coff, {'cursor', 'visible'})
+
+    def decorate_control(self, chunk):
+        """Replace control characters with a visible ^X representation,
+        in one pass over the chunk."""
+
+        if not self.CONTROL_RE.search(str(chunk)):
+            return chunk
+
+        new = chunks.Chunk()
+        for tags, text in chunk:
+            prev = 0
+            for match in self.CONTROL_RE.finditer(text):
+                i = match.start()
+                if i > prev:
+                    new.append((
+                        tags if prev == 0 else tags - chunk.POINT_TAGS,
+                        text[prev:i]))
+                # only the first piece of a chunklet keeps the point tags
+                kept = tags & {'cursor', 'visible'} if i == 0 else set()
+                new.append((
+                    self.SHOW_CONTROL | kept,
+                    '^' + chr((ord(text[i]) + ord('@')) & 127)))
+                prev = i + 1
+            if prev == 0:
+                new.append((tags, text))
+            elif prev < len(text):
+                new.append((tags - chunk.POINT_TAGS, text[prev:]))
+        return new
+
     def character_at_point(self):
         return self.buf[self.cursor.point]
 
@@ -546,6 +618,7 @@ class Viewer(window.Window, window.PagingMixIn):
     end = end_of_buffer
 
     def input_char(self, k):
+        self.buf.undo_boundary()
         self.log.debug('before command %s %s', self.cursor, self.the_mark)
         super().input_char(k)
         self.log.debug('after command  %s %s', self.cursor, self.the_mark)
@@ -784,6 +857,8 @@ class PopViewer(Viewer):
 
 
 class Editor(Viewer):
+    INSERT_REDISPLAY = .1  # seconds between redisplays during insert_file
+
     default_fill_column = util.Configurable(
         'editor.fill_column', 72, 'Default fill column for auto-fill buffers',
         coerce=int)
@@ -821,6 +896,14 @@ class Editor(Viewer):
     def writable(self):
         return self._writable
 
+    def modeline(self):
+        left, right = super().modeline()
+        units, size = self.buf.undo_usage()
+        if units:
+            left = chunks.Chunk(
+                list(left) + [((), ' [undo %d/%s]' % (units, sizestr(size)))])
+        return left, right
+
     def replace(self, count, string, collapsible=False):
         if not self.writable():
             self.whine('window is readonly')
@@ -1023,14 +1106,27 @@ class Editor(Viewer):
         if not self.writable():
             self.whine('window is read-only')
             return
-        if self.last_command != 'undo':
-            self.undo_state = None
         for _ in range(count):
-            self.undo_state, where = self.buf.undo(self.undo_state)
-            self.cursor.point = where
-            if self.undo_state is None:
+            where = self.buf.undo()
+            if where is None:
                 self.whine('Nothing to undo')
                 break
+            self.cursor.point = where
+
+    @keymap.bind('Meta-_')
+    def redo(self, count: interactive.positive_integer_argument=1):
+        """Redo changes that were undone.  An integer argument is a repeat
+        count."""
+
+        if not self.writable():
+            self.whine('window is read-only')
+            return
+        for _ in range(count):
+            where = self.buf.redo()
+            if where is None:
+                self.whine('Nothing to redo')
+                break
+            self.cursor.point = where
 
     @keymap.bind('Control-T')
     def transpose_chars(self):
@@ -1081,8 +1177,27 @@ class Editor(Viewer):
         """Read a file name and then insert the contents in to the buffer."""
 
         filename = yield from self.read_filename('Insert File: ')
-        with open(filename) as fp:
-            self.insert(fp.read())
+        if not self.writable():
+            self.whine('window is readonly')
+            return
+        where = self.buf.mark(self.cursor)
+        last = time.time()
+
+        def inserter(data):
+            nonlocal last
+            if self.cursor == where:
+                # leave the cursor after it, as insert() would
+                self.insert(data, True)
+                where.point = self.cursor
+            else:
+                # the cursor's wandered off; keep inserting where we were
+                with self.save_excursion(where):
+                    self.insert(data, True)
+            if time.time() - last > self.INSERT_REDISPLAY:
+                last = time.time()
+                self.redisplay()
+
+        yield from util.read_file(filename, inserter)
 
     @keymap.bind('Control-X Control-Q')
     def toggle_writable(self):
@@ -1109,6 +1224,14 @@ class Editor(Viewer):
             return self.self_insert(key=unicodedata.lookup(s))
 
 
+def sizestr(n):
+    for suffix in ('', 'k', 'M'):
+        if n < 1024:
+            break
+        n //= 1024
+    return '%d%s' % (n, suffix)
+
+
 # wherein we work out and write down a bunch of compose key sequences for
 # various interesting non-ASCII things
 
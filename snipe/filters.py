@@ -37,6 +37,8 @@ import logging
 import operator
 import re
 import functools
+import tempfile
+import os
 
 import ply.lex
 import ply.yacc
@@ -149,10 +151,16 @@ class SnipeFilterError(util.SnipeException):
 
 class Filter(object):
     name = None
+    _log = None
 
-    def __init__(self):
-        self.log = logging.getLogger(
-            'filter.%s.%x' % (self.__class__.__name__, id(self),))
+    @property
+    def log(self):
+        # loggers live forever and filters are cheap and plentiful, so
+        # don't make one until a filter actually has something to say
+        if self._log is None:
+            self._log = logging.getLogger(
+                'filter.%s.%x' % (self.__class__.__name__, id(self),))
+        return self._log
 
     def __call__(self, m, state=None):
         raise NotImplementedError
@@ -615,6 +623,9 @@ class PlyShim:
 
 
 class Lexer(PlyShim):
+    # ply glues the token regexps together into one big one, unless it
+    # fails to compile (e.g. if two tokens use the same group name), in which
+    # case every token gets matched against each of the pieces in turn.
     def __init__(self):
         super().__init__()
         self.lexer = ply.lex.lex(module=self)
@@ -649,34 +660,34 @@ class Lexer(PlyShim):
         return t
 
     def t_STRING(self, t):
-        r'"(?P<content>([^\\\n"]|(\\.))*)"'
+        r'"(?P<string>([^\\\n"]|(\\.))*)"'
         # r'(?P<quote>[' "'" r'"])(?P<content>.*)(?P=quote)'
-        t.value = self.lexer.lexmatch.group('content')
+        t.value = self.lexer.lexmatch.group('string')
         t.value = '\\'.join(
             x.replace(r'\"', '"') for x in t.value.split('\\\\'))
         return t
 
     def t_REGEXP(self, t):
-        r'/(?P<content>(\\/|[^/])*)/(?P<flags>[a-zA-Z]*)'
+        r'/(?P<regexp>(\\/|[^/])*)/(?P<flags>[a-zA-Z]*)'
         t.value = (
-            self.lexer.lexmatch.group('content').replace(r'\/', '/'),
+            self.lexer.lexmatch.group('regexp').replace(r'\/', '/'),
             self.lexer.lexmatch.group('flags'),
             )
         return t
 
+    words = {
+        'and': 'AND',
+        'or': 'OR',
+        'xor': 'XOR',
+        'not': 'NOT',
+        'filter': 'FILTER',
+        'yes': 'YES',
+        'no': 'NO',
+        }
+
     def t_ID(self, t):
         r'[a-zA-Z_][a-zA-Z_0-9]*'
-        word = {
-            'and': 'AND',
-            'or': 'OR',
-            'xor': 'XOR',
-            'not': 'NOT',
-            'filter': 'FILTER',
-            'yes': 'YES',
-            'no': 'NO',
-            }
-
-        t.type = word.get(t.value, 'ID')
+        t.type = self.words.get(t.value, 'ID')
         return t
 
     t_EQ = '='
@@ -690,8 +701,8 @@ class Lexer(PlyShim):
     t_RPAREN = r'\)'
 
     def t_PYTHON(self, t):
-        r'\$(?P<quote>[' "'" r'"])(?P<content>.*)(?P=quote)'
-        t.value = self.lexer.lexmatch.group('content')
+        r'\$(?P<quote>[' "'" r'"])(?P<python>.*)(?P=quote)'
+        t.value = self.lexer.lexmatch.group('python')
         return t
 
     t_ignore = '\n\t '
@@ -712,10 +723,18 @@ class Lexer(PlyShim):
 
 
 class Parser(PlyShim):
-    def __init__(self, debug=False):
+    # The LALR tables are generated once (``make parsetab``) and shipped
+    # with snipe; ply checks them against the grammar's signature and only
+    # rebuilds them (slowly) if someone forgot to regenerate them.
+    TABMODULE = 'snipe._filter_parsetab'
+    # if they do get rebuilt with debug on, keep the dump out of the tree
+    DEBUGFILE = os.path.join(tempfile.gettempdir(), 'snipe.parser.out')
+
+    def __init__(self, debug=False, write_tables=False):
         super().__init__()
         self.parser = ply.yacc.yacc(
-            module=self, write_tables=False, debug=debug)
+            module=self, tabmodule=self.TABMODULE, debugfile=self.DEBUGFILE,
+            write_tables=write_tables, debug=debug)
 
     tokens = Lexer.tokens
 
@@ -857,12 +876,15 @@ class Parser(PlyShim):
         self._errors.append(p)
 
 
-parser = Parser()
+parser = None  # building the tables is slow, so wait until we need them
 lexer = Lexer()
 
 
 @functools.lru_cache(maxsize=None)
 def makefilter(s):
+    global parser
+    if parser is None:
+        parser = Parser()
     lexer.reset_errors()
     parser.reset_errors()
     result = parser.parser.parse(s, lexer=lexer.lexer)
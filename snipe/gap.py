@@ -37,9 +37,30 @@ Data structure for efficiently storing a mutable string that grows and shrinks.
 '''
 
 
+import array
+import collections
 import logging
+import re
+import sys
 import weakref
-import array
+import zlib
+
+
+_ENDIAN = '-le' if sys.byteorder == 'little' else '-be'
+_WIDE = 'I' if array.array('I').itemsize == 4 else 'L'
+
+#: array typecodes we store text in, narrowest first, with the codec that
+#: turns the raw array contents into a str and back.  Like PEP 393 strings,
+#: a buffer starts narrow and is widened when something won't fit.
+STORAGE = [
+    ('B', 'latin-1'),
+    ('H', 'utf-16' + _ENDIAN),
+    (_WIDE, 'utf-32' + _ENDIAN),
+    ]
+
+#: Surrogates, paired or not, can't be stored as utf-16: two lone halves
+#: that end up next to each other would decode as a single character.
+_SURROGATES = re.compile('[\ud800-\udfff]')
 
 
 class GapBuffer:
@@ -51,6 +72,7 @@ class GapBuffer:
             '%s.%x' % ('GapBuffer', id(self),))
         self.chunksize = chunksize or self.CHUNKSIZE
         self.marks = weakref.WeakSet()
+        self.width = 0  # index into STORAGE
         self.buf = self._array(self.chunksize)
         self.gapstart = 0
         self.gapend = len(self.buf)
@@ -66,7 +88,40 @@ class GapBuffer:
             )
 
     def _array(self, size):
-        return array.array('u', u' ' * size)
+        return array.array(STORAGE[self.width][0], [ord(' ')]) * size
+
+    def _decode(self, arr):
+        return arr.tobytes().decode(STORAGE[self.width][1], 'surrogatepass')
+
+    def _encode(self, string):
+        """Return string as an array of our current width, widening the
+        buffer first if it doesn't fit."""
+
+        width = self.width
+        while True:
+            typecode, codec = STORAGE[width]
+            try:
+                data = string.encode(codec, 'surrogatepass')
+            except UnicodeEncodeError:
+                data = b''
+            # utf-16 "succeeds" on astral characters by using surrogate pairs
+            if len(data) == len(string) * array.array(typecode).itemsize \
+                    and not (typecode == 'H' and _SURROGATES.search(string)):
+                break
+            width += 1
+        if width != self.width:
+            self.widen(width)
+        result = array.array(typecode)
+        result.frombytes(data)
+        return result
+
+    def widen(self, width):
+        """Switch the underlying storage to a wider representation."""
+        self.log.debug(
+            'widening from %s to %s',
+            STORAGE[self.width][0], STORAGE[width][0])
+        self.buf = array.array(STORAGE[width][0], self.buf)
+        self.width = width
 
     @property
     def size(self):
@@ -75,17 +130,17 @@ class GapBuffer:
     @property
     def text(self):
         return (
-            self.buf[:self.gapstart].tounicode()
-            + self.buf[self.gapend:].tounicode())
+            self._decode(self.buf[:self.gapstart])
+            + self._decode(self.buf[self.gapend:]))
 
     def textrange(self, beg, end):
         beg = self.pointtopos(beg)
         end = self.pointtopos(end)
         l = []
         if beg <= self.gapstart:
-            l.append(self.buf[beg:min(self.gapstart, end)].tounicode())
+            l.append(self._decode(self.buf[beg:min(self.gapstart, end)]))
         if end > self.gapstart:
-            l.append(self.buf[max(self.gapend, beg):end].tounicode())
+            l.append(self._decode(self.buf[max(self.gapend, beg):end]))
         return ''.join(l)
 
     @property
@@ -155,10 +210,11 @@ class GapBuffer:
         else:
             where = self.pointtopos(where)
         length = len(string)
+        encoded = self._encode(string)
         self.movegap(where, length - size)
         self.gapend += size
         newstart = self.gapstart + length
-        self.buf[self.gapstart:newstart] = array.array('u', string)
+        self.buf[self.gapstart:newstart] = encoded
         self.gapstart = newstart
         return length
 
@@ -169,42 +225,117 @@ class GapBuffer:
 
 
 class UndoableGapBuffer(GapBuffer):
-    def __init__(self, *args, **kw):
-        self.undolog = []
+    """GapBuffer that remembers how to reverse changes made to it.
+
+    Changes are collected into undo units; :meth:`undo_boundary` starts a new
+    unit, so a unit is typically everything one command did.  Deleted text
+    longer than ``undo_compress`` characters is kept zlib-compressed, and the
+    oldest units are thrown away once the log is bigger than ``undo_limit``.
+    Undone units go on a redo log that is discarded by any fresh change.
+    """
+
+    UNDO_LIMIT = 1 << 20
+    UNDO_COMPRESS = 4096
+
+    def __init__(self, *args, undo_limit=None, undo_compress=None, **kw):
+        self.undolog = collections.deque()
+        self.redolog = []
+        self.undo_limit = undo_limit or self.UNDO_LIMIT
+        self.undo_compress = undo_compress or self.UNDO_COMPRESS
+        self.undo_size = 0
+        self._boundary = True
         super().__init__(*args, **kw)
 
+    def undo_boundary(self):
+        """Make the next change start a new undo unit."""
+        self._boundary = True
+
+    def _record(self, where, size, string):
+        if len(string) >= self.undo_compress:
+            string = zlib.compress(string.encode('utf-8', 'surrogatepass'))
+        return (where, size, string)
+
+    @staticmethod
+    def _recordsize(record):
+        return len(record[2]) + 1
+
+    @staticmethod
+    def _recordtext(record):
+        string = record[2]
+        if isinstance(string, bytes):
+            string = zlib.decompress(string).decode('utf-8', 'surrogatepass')
+        return string
+
+    def _inverse(self, where, size, string):
+        where = int(where)
+        return self._record(
+            where, len(string), self.textrange(where, where + size))
+
+    def _push(self, unit, record):
+        unit.append(record)
+        self.undo_size += self._recordsize(record)
+
+    def _trim(self):
+        while self.undo_size > self.undo_limit and len(self.undolog) > 1:
+            unit = self.undolog.popleft()
+            self.undo_size -= sum(self._recordsize(r) for r in unit)
+            self.log.debug('evicted undo unit of %d records', len(unit))
+
     def replace(self, where, size, string, collapsible=False):
         self.log.debug(
             'collapsible %s %d %d %s', collapsible, where, size, repr(string))
-        if self.undolog:
-            self.log.debug('self.undolog[-1] %s', repr(self.undolog[-1]))
-        if (collapsible and self.undolog
-                and where == self.undolog[-1][0] + self.undolog[-1][1]
-                and string != '' and self.undolog[-1][2] == ''):
+        self.redolog = []
+        last = self.undolog[-1][-1] if self.undolog else None
+        if (collapsible and last is not None
+                and int(where) == last[0] + last[1]
+                and string != '' and last[2] == ''):
             # XXX only "collapses" inserts
-            self.log.debug('collapse %s', repr(self.undolog[-1]))
-            self.undolog[-1] = (
-                self.undolog[-1][0],
-                len(string) + self.undolog[-1][1], '',
-                )
+            self.log.debug('collapse %s', repr(last))
+            self.undolog[-1][-1] = (last[0], len(string) + last[1], '')
         else:
-            self.undolog.append((
-                int(where),
-                len(string),
-                self.textrange(where, int(where) + size),
-                ))
+            if self._boundary or not self.undolog:
+                self.undolog.append([])
+            self._push(self.undolog[-1], self._inverse(where, size, string))
+            self._trim()
+        self._boundary = False
         return super().replace(where, size, string)
 
-    def undo(self, which):
+    def _apply(self, unit):
+        inverse = []
+        where = None
+        for record in reversed(unit):
+            where, size, _ = record
+            string = self._recordtext(record)
+            inverse.append(self._inverse(where, size, string))
+            super().replace(where, size, string)
+            where += len(string)
+        return inverse, where
+
+    def undo(self):
+        """Reverse the most recent undo unit, returning where the last
+        reversed change ended, or None if there is nothing to undo."""
+
         if not self.undolog:
             return None
-        if which is not None:
-            off = which
-        else:
-            off = len(self.undolog) - 1
-        where, size, string = self.undolog[off]
-        self.replace(where, size, string)
-        return (off - 1) % len(self.undolog), where + len(string)
+        unit = self.undolog.pop()
+        self.undo_size -= sum(self._recordsize(r) for r in unit)
+        inverse, where = self._apply(unit)
+        self.redolog.append(inverse)
+        self._boundary = True
+        return where
+
+    def redo(self):
+        """Reapply the most recently undone unit, returning where the last
+        change ended, or None if there is nothing to redo."""
+
+        if not self.redolog:
+            return None
+        inverse, where = self._apply(self.redolog.pop())
+        self.undolog.append(inverse)
+        self.undo_size += sum(self._recordsize(r) for r in inverse)
+        self._trim()
+        self._boundary = True
+        return where
 
 
 class GapMark:
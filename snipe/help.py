@@ -34,21 +34,27 @@ snipe.help
 '''
 
 import bisect
+import contextlib
+import hashlib
 import inspect
-import sys
+import json
 import logging
+import os
+import re
+import sys
 
-import docutils.core
-import docutils.nodes
+import docutils
 
 from . import chunks
 from . import editor
 from . import interactive
 from . import keymap
-from . import text
 from . import util
 
 
+ADORNMENT = re.compile(r'^([!-/:-@\[-`{-~])\1+\s*$')
+
+
 @keymap.bind('?', 'Control-H')
 def halp(window: interactive.window):
     if util.Configurable.get(window, 'cheatsheet') and \
@@ -107,6 +113,7 @@ class HelpBrowser(editor.PopViewer):
     """Commit assorted sins against docutils in order to present a help browser
     """
     pages = {}
+    sources = {}
     toc = []
     toclines = []
     base_module = None
@@ -133,7 +140,7 @@ class HelpBrowser(editor.PopViewer):
         super().__init__(*args, **kw)
         self.log = logging.getLogger(
             '%s.%x' % (self.__class__.__name__, id(self),))
-        if not self.pages:
+        if not self.toc:
             self.load_pages()
 
         self.load(self.toc[0])
@@ -142,6 +149,9 @@ class HelpBrowser(editor.PopViewer):
         return 'Help: ' + self._title
 
     def load_pages(self):
+        """Find the help texts, and work out the table of contents from their
+        section titles without rendering anything."""
+
         inpages = {}
         for name, module in sys.modules.items():
             split = name.split('.')
@@ -158,49 +168,185 @@ class HelpBrowser(editor.PopViewer):
                     self.log.debug('found help: %s.%s', name, attr)
                     inpages[pagename] = (getattr(module, attr), module)
 
+        self.sources.clear()
+        self.sources.update(inpages)
         self.toc[:] = sorted(inpages.keys(), key=lambda x: inpages[x])
 
         self.toclines[:] = []
-        for label in reversed(self.toc):
-            # go through them backwards so we can put the table of contents
-            # on the first page
-            text_, module = inpages[label]
-            flags, text_ = text_.split('\n', 1)
-            HelpBrowser.base_module = module
-            _, pub = docutils.core.publish_programmatically(
-                docutils.io.StringInput, text_, None, docutils.io.NullOutput,
-                None, None, None, 'standalone', None, 'restructuredtext', None,
-                'null', None, None, {}, None, None)
-
-            renderer = text.RSTRenderer()
-            renderer.process(pub.writer.document)
-
-            self.pages[label] = (
-                renderer.output,
-                renderer.flat(),
-                renderer.targets,
-                renderer.links,
-                pub.writer.document.get('title', 'Help Browser'),
-                )
-            self.toclines[:0] = self.gettoclines(pub.writer.document, label)
+        for label in self.toc:
+            flags, text_ = inpages[label][0].split('\n', 1)
+            self.toclines.extend(self.gettoclines(text_, label))
 
     @staticmethod
-    def gettoclines(doc, label):
-        def tocify(node):
-            if isinstance(node, docutils.nodes.title):
-                return node.astext()
-
-            return list(filter(None, (tocify(x) for x in node.children)))
-
+    def scantitles(text_):
+        """Return the section titles in some reStructuredText as a nested
+        list, [title, [subtitle, ...], ...], the way docutils would arrange
+        them."""
+
+        lines = text_.splitlines() + ['']
+        root = [None]
+        stack = [(root, None)]  # (section, adornment style)
+        styles = []
+        body = {id(root): False}
+
+        def adornment(line):
+            return bool(line) and ADORNMENT.match(line) is not None
+
+        i = 0
+        while i < len(lines) - 1:
+            line = lines[i]
+            title = style = None
+            if (adornment(line) and i + 2 < len(lines)
+                    and lines[i + 2].rstrip() == line.rstrip()
+                    and lines[i + 1].strip()):
+                title, style, step = lines[i + 1].strip(), (line[0], True), 3
+            elif (line.strip() and not line[0].isspace()
+                    and not adornment(line) and adornment(lines[i + 1])
+                    and (len(lines[i + 1].rstrip()) >= len(line.rstrip())
+                         or len(lines[i + 1].rstrip()) >= 4)):
+                title, style, step = line.strip(), (lines[i + 1][0], False), 2
+            if title is None:
+                if line.strip():
+                    body[id(stack[-1][0])] = True
+                i += 1
+                continue
+            if style not in styles:
+                styles.append(style)
+            level = styles.index(style) + 1
+            del stack[level:]
+            section = [title]
+            body[id(section)] = False
+            stack[-1][0].append(section)
+            stack.append((section, style))
+            i += step
+
+        # docutils promotes a lone leading section to the document title, and
+        # a lone leading subsection of that to a subtitle
+        sections = root[1:]
+        if len(sections) == 1 and not body[id(root)]:
+            doc = sections[0]
+            if len(doc) == 2 and not body[id(doc)]:
+                return doc[:1] + doc[1][1:]
+            return doc
+        return root
+
+    @classmethod
+    def gettoclines(cls, text_, label):
         def lines(toc, offset=0):
             out = [
                 '| %s* `%s <%s#%s>`_' % (
-                    ' ' * offset, toc[0], label, toc[0]), '']
+                    ' ' * offset, toc[0] or label, label, toc[0]), '']
             for entry in toc[1:]:
                 out += lines(entry, offset+2)
             return out
 
-        return lines(tocify(doc))
+        return lines(cls.scantitles(text_))
+
+    def render(self, label):
+        """Render a page, or get it from the on-disk cache."""
+
+        if label in self.pages:
+            return self.pages[label]
+
+        text_, module = self.sources[label]
+        flags, text_ = text_.split('\n', 1)
+        key = self.cachekey(label, text_, module)
+        page = self.cache_read(label, key)
+        if page is None:
+            with util.stopwatch('rendering ' + label, self.log):
+                # the rest of docutils is expensive to import, so wait
+                # until we need it
+                import docutils.core
+                from . import rst
+
+                HelpBrowser.base_module = module
+                _, pub = docutils.core.publish_programmatically(
+                    docutils.io.StringInput, text_, None,
+                    docutils.io.NullOutput, None, None, None, 'standalone',
+                    None, 'restructuredtext', None, 'null', None, None, {},
+                    None, None)
+
+                renderer = rst.RSTRenderer()
+                renderer.process(pub.writer.document)
+
+            page = (
+                renderer.output,
+                renderer.flat(),
+                renderer.targets,
+                renderer.links,
+                pub.writer.document.get('title', 'Help Browser'),
+                )
+            self.cache_write(label, key, page)
+        self.pages[label] = page
+        return page
+
+    def cachekey(self, label, text_, module):
+        digest = hashlib.sha1()
+        for s in (
+                label, text_, '\n'.join(self.toclines),
+                docutils.__version__):
+            digest.update(s.encode('utf-8'))
+        with contextlib.suppress(OSError, TypeError):
+            with open(inspect.getsourcefile(module), 'rb') as fp:
+                digest.update(fp.read())
+        return digest.hexdigest()
+
+    @staticmethod
+    def cache_name(label):
+        return hashlib.sha1(label.encode('utf-8')).hexdigest()
+
+    def cache_path(self, label):
+        # one file per page, which says which version of it it has
+        if self.context is None:
+            return None
+        return os.path.join(
+            self.context.directory, 'helpcache', self.cache_name(label))
+
+    def cache_read(self, label, key):
+        path = self.cache_path(label)
+        if path is None:
+            return None
+        try:
+            with open(path) as fp:
+                key_, output, flat, targets, links, title_ = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if key_ != key:
+            return None
+        self.log.debug('help cache hit %s', path)
+        return (
+            [chunks.View(off, chunks.Chunk(
+                (set(tags), s) for (tags, s) in chunk))
+             for (off, chunk) in output],
+            flat,
+            targets,
+            [tuple(link) for link in links],
+            title_,
+            )
+
+    def cache_write(self, label, key, page):
+        path = self.cache_path(label)
+        if path is None:
+            return
+        output, flat, targets, links, title_ = page
+        try:
+            self.context.ensure_directory()
+            directory = os.path.dirname(path)
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            with util.safe_write(path) as fp:
+                json.dump([
+                    key,
+                    [(off, [(sorted(tags), s) for (tags, s) in chunk])
+                     for (off, chunk) in output],
+                    flat, targets, links, title_], fp)
+            # and clear out anything that isn't a page we have any more
+            current = {self.cache_name(other) for other in self.sources}
+            for name in os.listdir(directory):
+                if name not in current:
+                    with contextlib.suppress(OSError):
+                        os.unlink(os.path.join(directory, name))
+        except OSError:
+            self.log.exception('writing help cache %s', path)
 
     def load(self, name):
         anchor = ''
@@ -209,8 +355,7 @@ class HelpBrowser(editor.PopViewer):
         self.cursor.point = 0
         self.log.debug('loading: %s', name)
         self.chunks, flat, self.refs, self.links, self._title = \
-            self.pages[name]
-        print(self.chunks)
+            self.render(name)
         self.log.debug('refs: %s', repr(self.refs))
         self.log.debug('links: %s', repr(self.links))
         self.replace(len(self.buf), flat)
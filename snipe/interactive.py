@@ -148,13 +148,19 @@ class FileCompleter(Completer):
 
     @staticmethod
     def listdir(directory):
+        # scandir gets the file types from the directory read itself, so this
+        # is one pass over the directory instead of a stat() per file
         if not directory:
             directory = os.curdir
-        files = os.listdir(directory)
-        for n, filename in enumerate(files):
-            if os.path.isdir(filename):
-                files[n] += os.path.sep
-        return files
+        if not hasattr(os, 'scandir'):  # before 3.5
+            return [
+                name + (
+                    os.path.sep
+                    if os.path.isdir(os.path.join(directory, name)) else '')
+                for name in os.listdir(directory)]
+        return [
+            entry.name + (os.path.sep if entry.is_dir() else '')
+            for entry in os.scandir(directory)]
 
     def matches(self, value=''):
         directory, filename = os.path.split(value)
@@ -36,6 +36,8 @@ Backend for talking to `IRCCloud <https://irccloud.com>`.
 
 import asyncio
 import aiohttp
+import bisect
+import collections
 import time
 import urllib.parse
 import itertools
@@ -67,6 +69,19 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
         coerce=float,
         )
 
+    INCLUDE_CHUNK = 65536
+    SEND_RETRIES = 8  # times to wait for a connection to send a line on
+    SEND_BACKOFF = 30  # most seconds to wait between them
+    SEND_TIMEOUT = 30  # seconds to wait for the server to answer a line
+
+    flood_burst = util.Configurable(
+        'irccloud.flood_burst',
+        4,
+        'how many lines to send at once before slowing down to one line'
+        ' every irccloud.floodpause seconds',
+        coerce=int,
+        )
+
     backfill_length = util.Configurable(
         'irccloud.backfill_length', 24 * 3600,
         'only backfill this far at a time (seconds)',
@@ -87,6 +102,11 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
         self.new_task = None
         self.header = {}
         self.since_id = 0
+        self.websocket = None
+        self.replies = {}  # _reqid -> future for the server's answer
+        self.outgoing = {}  # cid -> deque of (to, msg) waiting to be sent
+        self.drainers = {}  # cid -> task draining that queue
+        self.buckets = {}  # cid -> util.TokenBucket
         self.setup_client_session()
 
     def start(self):
@@ -99,13 +119,28 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
 
     @asyncio.coroutine
     def say(self, cid, to, msg):
-        self.websocket.write(dict(
-            _method='say',
-            _reqid=self.reqid,
-            cid=cid,
-            to=to,
-            msg=msg,
-        ))
+        """Send a line and return the server's answer to it, or None if
+        it couldn't be sent at all (so it's safe to try again)."""
+        if self.websocket is None or self.websocket.closed:
+            return None
+        reqid = self.reqid
+        reply = self.replies[reqid] = asyncio.Future()
+        try:
+            try:
+                self.websocket.write(dict(
+                    _method='say',
+                    _reqid=reqid,
+                    cid=cid,
+                    to=to,
+                    msg=msg,
+                ))
+            except Exception:
+                # the write doesn't get as far as the network if it fails
+                self.log.exception('writing to the websocket')
+                return None
+            return (yield from asyncio.wait_for(reply, self.SEND_TIMEOUT))
+        finally:
+            del self.replies[reqid]
 
     @asyncio.coroutine
     def connect(self):
@@ -170,7 +205,7 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
             self.since_id = self.last_eid
         with util.JSONWebSocket(self.log) as self.websocket:
             yield from self.websocket.connect(
-                IRCCLOUD_API,
+                url,
                 {
                     'Origin': IRCCLOUD_API,
                     'Cookie': 'session=%s' % (self.session,),
@@ -194,7 +229,11 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
                     raise
 
     @asyncio.coroutine
-    def process_message(self, msglist, m):
+    def process_message(self, msglist, m, batch=False):
+        """Process an incoming event, filing any resulting message in
+        msglist in order.  If batch is true, the message is just appended
+        and the caller is responsible for sorting msglist and calling
+        track() when it's done."""
         if m is None:
             return
 
@@ -249,17 +288,41 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
                 if 'have_eid' not in buf or m['eid'] < buf['have_eid']:
                     buf['have_eid'] = m['eid']
             msg = IRCCloudMessage(self, m)
-            msglist.append(msg)
-            if len(msglist) > 1 and msglist[-1] < msglist[-2]:
-                msglist.sort()
-            # really this should come from the current channel membership
-            self._destinations.add(msg.reply())
-            self._destinations.add(msg.followup())
-            self._senders.add(msg.reply())
+            if batch:
+                msglist.append(msg)
+            else:
+                if not msglist or not msg < msglist[-1]:
+                    msglist.append(msg)
+                else:
+                    bisect.insort_right(msglist, msg)
+                self.track([msg])
             return msg
 
+    def track(self, msgs):
+        """Note the addresses in some new messages for completion."""
+        # really this should come from the current channel membership
+        replies = [msg.reply() for msg in msgs]
+        self._destinations.update(replies)
+        self._destinations.update(msg.followup() for msg in msgs)
+        self._senders.update(replies)
+
+    def merge(self, included):
+        """Merge a sorted batch of messages into the message list, only
+        touching the part of the list they overlap."""
+        if not included:
+            return
+        i = bisect.bisect_left(self.messages, included[0])
+        self.messages[i:] = messages.merge([self.messages[i:], included])
+        self.drop_cache()
+        self.redisplay(included[0], included[-1])
+
     @asyncio.coroutine
     def incoming(self, m):
+        if m.get('_reqid') in self.replies:
+            reply = self.replies[m['_reqid']]
+            if not reply.done():
+                reply.set_result(m)
+            return
         msg = yield from self.process_message(self.messages, m)
         if msg is not None:
             self.drop_cache()
@@ -268,21 +331,33 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
     @asyncio.coroutine
     def include(self, url):
         self.log.debug('including %s', url)
-        oob_data = yield from self._request(
-            'GET',
+        response = yield from self._clientsession.get(
             urllib.parse.urljoin(IRCCLOUD_API, url),
             headers={'Cookie': 'session=%s' % self.session},
             compress='gzip',
             )
+        # Decode the (potentially huge) backlog in a worker thread as it
+        # arrives and process it a chunk at a time, so as not to freeze
+        # everything else while we do it.
+        loop = asyncio.get_event_loop()
+        decoder = util.JSONArrayDecoder()
         included = []
-        for m in oob_data:
-            yield from self.process_message(included, m)
+        try:
+            while True:
+                data = yield from response.content.read(self.INCLUDE_CHUNK)
+                batch = yield from loop.run_in_executor(
+                    None, decoder.feed, data)
+                for m in batch:
+                    yield from self.process_message(included, m, batch=True)
+                if not data:
+                    break
+                yield from asyncio.sleep(0)
+        finally:
+            response.release()
+        self.log.debug('included %d messages from %s', len(included), url)
         included.sort()
-
-        if included:
-            self.messages = list(messages.merge([self.messages, included]))
-            self.drop_cache()
-            self.redisplay(included[0], included[-1])
+        self.track(included)
+        self.merge(included)
 
     @asyncio.coroutine
     def send(self, paramstr, body):
@@ -315,14 +390,78 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
             prefix = '/msg ' + dest + ' '
             dest = '*'
 
-        lines = body.splitlines()
-        if len(lines) == 1:
-            yield from self.say(cid, dest, prefix + lines[0])
-        else:
-            for line in lines:
-                if line:
-                    yield from self.say(cid, dest, prefix + line)
-                yield from asyncio.sleep(self.floodpause)
+        self.outgoing.setdefault(cid, collections.deque()).extend(
+            (dest, prefix + line) for line in body.splitlines() if line)
+        self.reap_tasks()
+        if cid not in self.drainers or self.drainers[cid].done():
+            self.drainers[cid] = asyncio.Task(self.drain(cid))
+            self.tasks.append(self.drainers[cid])
+
+    @asyncio.coroutine
+    def drain(self, cid):
+        """Send the lines queued for a connection, no faster than the
+        server's flood limits allow."""
+        queue = self.outgoing[cid]
+        if cid not in self.buckets:
+            self.buckets[cid] = util.TokenBucket(
+                1 / max(self.floodpause, .001), self.flood_burst)
+        bucket = self.buckets[cid]
+        attempts = 0
+        while queue:
+            to, msg = queue[0]
+            yield from bucket.take()
+            try:
+                reply = yield from self.say(cid, to, msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # It went out but we never heard what became of it, so
+                # rather than maybe say it twice, or the rest out of
+                # order without it, give up on all of it.
+                self.log.exception('sending to %s on %s', to, cid)
+                self.unsent(cid)
+                return
+            if reply is None:
+                # nothing went out; wait (for a reconnect) and try again
+                if attempts >= self.SEND_RETRIES:
+                    self.unsent(cid)
+                    return
+                yield from asyncio.sleep(min(
+                    self.floodpause * 2**attempts, self.SEND_BACKOFF))
+                attempts += 1
+                continue
+            attempts = 0
+            queue.popleft()
+            if not reply.get('success', True):
+                self.complain('could not send to %s: %s: %s' % (
+                    to, msg, reply.get('message', 'failed')))
+
+    def unsent(self, cid):
+        """Drop the lines still queued for a connection, and say so."""
+        queue = self.outgoing.get(cid)
+        if not queue:
+            return
+        lines = ['%s: %s' % (to, msg) for (to, msg) in queue]
+        queue.clear()
+        self.complain('could not send:\n' + '\n'.join(lines))
+
+    def complain(self, text):
+        self.log.warning('%s', text)
+        self.messages.append(messages.SnipeErrorMessage(self, text))
+        self.drop_cache()
+        self.redisplay(self.messages[-1], self.messages[-1])
+
+    @asyncio.coroutine
+    def shutdown(self):
+        yield from super().shutdown()
+        for cid in list(self.outgoing):
+            self.unsent(cid)
+
+    def progress(self):
+        pending = sum(len(queue) for queue in self.outgoing.values())
+        if pending:
+            return '%s: %d lines to send' % (self.name, pending)
+        return None
 
     @keymap.bind('I C')
     def dump_connections(self, window: interactive.window):
@@ -403,7 +542,7 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
                     if m['bid'] == -1:
                         self.log.error('? %s', repr(m))
                         continue
-                    yield from self.process_message(included, m)
+                    yield from self.process_message(included, m, batch=True)
 
                 if len(included) == 0:
                     self.log.debug(
@@ -413,6 +552,7 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
                     break
 
                 included.sort()
+                self.track(included)
                 self.log.debug('processed %d messages', len(included))
 
                 clip = None
@@ -430,12 +570,9 @@ class IRCCloud(messages.SnipeBackend, util.HTTP_JSONmixin):
                 if included:
                     self.log.debug('merging %d messages', len(included))
                     l = len(self.messages)
-                    self.messages = list(messages.merge(
-                        [self.messages, included]))
+                    self.merge(included)
                     self.log.debug(
                         'len(self.messages): %d -> %d', l, len(self.messages))
-                    self.drop_cache()
-                    self.redisplay(included[0], included[-1])
 
             except asyncio.CancelledError:
                 return
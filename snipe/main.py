@@ -67,6 +67,8 @@ def main():
             loop.run_until_complete(context_.start(ui))
             loop.add_reader(0, ui.readable)
             ui.redisplay()
+            # now that there's something on the screen
+            context_.backends_task = asyncio.Task(context_.start_backends())
             log.warning('starting event loop')
             loop.run_forever()
         log.warning('left main loop')
@@ -38,6 +38,7 @@ UI for looking at messages.
 import bisect
 import codecs
 import datetime
+import logging
 import pprint
 import re
 import time
@@ -146,15 +147,15 @@ class Messager(window.Window, window.PagingMixIn):
         return True
 
     def walk(self, origin, direction, backfill_to=None, search=False):
-        self.log.debug(
-            'walk(%s, forward=%s, backfill_to=%s, search=%s)',
-            repr(origin), repr(direction),
-            util.timestr(backfill_to), repr(search))
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(
+                'walk(%r, forward=%r, backfill_to=%s, search=%r)',
+                origin, direction, util.timestr(backfill_to), search)
         return self.fe.context.backends.walk(
             origin, direction, self.filter, backfill_to, search)
 
     def view(self, origin, direction='forward'):
-        self.log.debug('view(%s, %s)', repr(origin), repr(direction))
+        self.log.debug('view(%r, %r)', origin, direction)
 
         for x in self.walk(
                 origin, direction == 'forward'):
@@ -220,10 +221,11 @@ class Messager(window.Window, window.PagingMixIn):
                 # if it doesn't pass the filter it can't cause
                 # a redisplay
                 return
-            self.log.debug('head=%s, sill=%s', repr(head), repr(sill))
-            self.log.debug('m1=%s, m2=%s', repr(m1), repr(m2))
-            self.log.debug('max(head, m1)=%s', repr(max(head, m1)))
-            self.log.debug('min(sill, m2)=%s', repr(min(sill, m2)))
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug('head=%r, sill=%r', head, sill)
+                self.log.debug('m1=%r, m2=%r', m1, m2)
+                self.log.debug('max(head, m1)=%r', max(head, m1))
+                self.log.debug('min(sill, m2)=%r', min(sill, m2))
             if max(head, m1) <= min(sill, m2):
                 self.log.debug('True!')
                 return True
@@ -275,6 +277,9 @@ class Messager(window.Window, window.PagingMixIn):
         t += '%02d:%02d' % (then.hour, then.minute)
 
         left = chunks.Chunk([({'dim'}, t), ((), ' ' + str(self.filter))])
+        progress = self.context.backends.progress()
+        if progress:
+            left += [({'dim'}, ' [' + progress + ']')]
 
         return left, right
 
@@ -872,8 +877,11 @@ class Messager(window.Window, window.PagingMixIn):
         filename = yield from self.read_filename('destination file: ')
         start = min(self.the_mark or self.cursor, self.cursor)
         end = max(self.the_mark or self.cursor, self.cursor)
-        with open(filename, 'w') as output:
+
+        def region():
             for m in self.walk(start, True, search=True):
-                output.write(str(m))
+                yield str(m)
                 if m >= end:
                     break
+
+        yield from util.write_file(filename, region())
@@ -39,8 +39,10 @@ import bisect
 import contextlib
 import datetime
 import functools
+import json
 import logging
 import math
+import os
 import time
 
 from . import chunks
@@ -299,6 +301,7 @@ class SnipeBackend:
     #  (not all backends will export this, it can be None)
     messages = ()
     principal = None
+    RESUME_INTERVAL = 10  # seconds between saves of the resume cursors
 
     indent = util.Configurable(
         'message.indent_body_string', '',
@@ -318,6 +321,8 @@ class SnipeBackend:
         self.tasks = []
         self._destinations = set()
         self._senders = set()
+        self.resume = None  # where to pick up from, once loaded
+        self.resume_task = None
 
     def start(self):
         """Actually connect to whatever we're connecting to and start
@@ -353,9 +358,10 @@ class SnipeBackend:
         redisplay, for date headers and such that want to bypass filters on
         display.
         """
-        self.log.debug(
-            'walk(%s, %s, [filter], %s, %s)',
-            repr(start), forward, util.timestr(backfill_to), search)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(
+                'walk(%r, %s, [filter], %s, %s)',
+                start, forward, util.timestr(backfill_to), search)
         # I have some concerns that that this depends on the
         # self.messages list being stable over the life of the
         # iterator.  This doesn't seem to be a a problem as of when I
@@ -440,6 +446,58 @@ class SnipeBackend:
     def backfill(self, mfilter, target=None):
         pass
 
+    def progress(self):
+        """Return a short description of any background work in progress
+        (e.g. backfill) for the modeline, or None."""
+        return None
+
+    def resume_path(self):
+        return os.path.join(
+            self.context.directory, 'resume', self.name + '.json')
+
+    def resume_load(self):
+        """Load the cursors a previous session left saying how far it got,
+        and start keeping them up to date.  Backends that can pick up where
+        they left off call this from start()."""
+        self.resume = {}
+        try:
+            with open(self.resume_path(), 'rb') as fp:
+                self.resume = util.json_loads(fp.read())
+        except (OSError, ValueError) as e:
+            self.log.debug('no resume cursors: %s', e)
+        return self.resume
+
+    def resume_set(self, key, value):
+        """Note a cursor, to be saved shortly."""
+        if self.resume is None or self.resume.get(key) == value:
+            return
+        self.resume[key] = value
+        if self.resume_task is None:
+            self.resume_task = asyncio.Task(self.resume_writer())
+
+    @asyncio.coroutine
+    def resume_writer(self):
+        yield from asyncio.sleep(self.RESUME_INTERVAL)
+        self.resume_task = None
+        yield from self.resume_save()
+
+    @asyncio.coroutine
+    def resume_save(self):
+        path = self.resume_path()
+        data = json.dumps(self.resume)
+        loop = asyncio.get_event_loop()
+
+        def write():
+            self.context.ensure_directory()
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            with util.safe_write(path) as fp:
+                fp.write(data)
+
+        try:
+            yield from loop.run_in_executor(None, write)
+        except OSError:
+            self.log.exception('writing resume cursors %s', path)
+
     @asyncio.coroutine
     def shutdown(self):
         tasks = list(reversed(self.tasks))
@@ -451,6 +509,10 @@ class SnipeBackend:
             except:
                 self.log.exception('while shutting down')
         self.tasks = []
+        if self.resume_task is not None:
+            self.resume_task.cancel()
+            self.resume_task = None
+            yield from self.resume_save()
 
     def reap_tasks(self):
         """Remove any tasks that have completed.
@@ -567,15 +629,18 @@ class DateBackend(SnipeBackend):
             self, start, forward=True, mfilter=None, backfill_to=None,
             search=False):
         # Note that this ignores mfilter
-        self.log.debug(
-            'walk(%s, %s, [filter], %s, %s)',
-            repr(start), forward, util.timestr(backfill_to), search)
+        debug = self.log.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.log.debug(
+                'walk(%r, %s, [filter], %s, %s)',
+                start, forward, util.timestr(backfill_to), search)
 
         self.backfill(mfilter, backfill_to)
 
-        self.log.debug(
-            'self.starting_at = %s',
-            util.timestr(self.starting_at.timestamp()))
+        if debug:
+            self.log.debug(
+                'self.starting_at = %s',
+                util.timestr(self.starting_at.timestamp()))
 
         if search:
             return
@@ -598,7 +663,8 @@ class DateBackend(SnipeBackend):
             else:
                 start = datetime.datetime.fromtimestamp(start)
 
-        self.log.debug('start = %s', util.timestr(start.timestamp()))
+        if debug:
+            self.log.debug('start = %s', util.timestr(start.timestamp()))
 
         if forward:
             t = start
@@ -613,11 +679,14 @@ class DateBackend(SnipeBackend):
             t = datetime.datetime.combine(d, datetime.time())
             delta = datetime.timedelta(days=-1)
 
-        self.log.debug(
-            't = %s, delta = %s', util.timestr(t.timestamp()), repr(delta))
+        if debug:
+            self.log.debug(
+                't = %s, delta = %r', util.timestr(t.timestamp()), delta)
 
         while now > t >= self.starting_at:
-            self.log.debug('date header at %s', util.timestr(t.timestamp()))
+            if debug:
+                self.log.debug(
+                    'date header at %s', util.timestr(t.timestamp()))
             yield InfoMessage(
                 self,
                 t.strftime('%A, %B %d, %Y\n\n'),
@@ -628,6 +697,31 @@ class DateBackend(SnipeBackend):
         self.log.debug('leaving walk')
 
 
+NUDGE = .00001
+
+
+def order_after(msgs, previous=None, nudge=NUDGE):
+    """Make the times of a chronological batch of new messages strictly
+    increasing, and later than previous (the last message we already had,
+    if any), adjusting only the new messages."""
+    last = previous.time if previous is not None else None
+    for m in msgs:
+        if last is not None and m.time <= last:
+            m.time = last + nudge
+        last = m.time
+
+
+def order_before(msgs, following=None, nudge=NUDGE):
+    """Make the times of a chronological batch of backfilled messages
+    strictly increasing, and earlier than following (the first message we
+    already had, if any), adjusting only the backfilled messages."""
+    nxt = following.time if following is not None else None
+    for m in reversed(msgs):
+        if nxt is not None and m.time >= nxt:
+            m.time = nxt - nudge
+        nxt = m.time
+
+
 def merge(iterables, key=lambda x: x):
     # get the first item from all the iterables
     d = {}
@@ -654,8 +748,14 @@ def merge(iterables, key=lambda x: x):
 
 
 def logiter(log, x):
+    if not log.isEnabledFor(logging.DEBUG):
+        return x
+    return _logiter(log, x)
+
+
+def _logiter(log, x):
     for n, y in enumerate(x):
-        log.debug('%s[%d]: %s', repr(x), n, repr(y))
+        log.debug('%r[%d]: %r', x, n, y)
         yield y
 
 
@@ -685,9 +785,10 @@ class AggregatorBackend(SnipeBackend):
     def walk(
             self, start, forward=True, filter=None, backfill_to=None,
             search=False):
-        self.log.debug(
-            'walk(%s, forward=%s, [filter], backfill_to=%s, search=%s',
-            repr(start), forward, util.timestr(backfill_to), search)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(
+                'walk(%r, forward=%s, [filter], backfill_to=%s, search=%s',
+                start, forward, util.timestr(backfill_to), search)
         # what happens when someone calls .add for an
         # in-progress iteration?
         if hasattr(start, 'backend'):
@@ -736,6 +837,10 @@ class AggregatorBackend(SnipeBackend):
     def count(self):
         return sum(backend.count() for backend in self.backends)
 
+    def progress(self):
+        return '; '.join(
+            p for p in (backend.progress() for backend in self.backends) if p)
+
     def destinations(self):
         return set().union(
             *(backend.destinations() for backend in self.backends))
@@ -121,6 +121,7 @@ class REPL(editor.Editor):
             self.cursor.point += self.replace(len(save), input)
         with self.save_excursion():
             self.end_of_buffer()
+            self.buf.undo_boundary()
             self.insert('\n')
             self.redisplay()
             self.undo()
@@ -35,6 +35,8 @@ Backend for talking to `roost <https://github.com/roost-im>`_
 
 
 import asyncio
+import collections
+import hashlib
 import itertools
 import time
 import shlex
@@ -99,22 +101,69 @@ class Roost(messages.SnipeBackend):
         'roost.format.message', 'format',
         'How to display the message body' + FORMAT_DOC,
         oneof=FORMAT_TYPES)
+    BACKFILL_MIN = 128
+    BACKFILL_MAX = 4096
+    BACKFILL_FAST = .5  # seconds; faster than this, ask for more
+    BACKFILL_SLOW = 2  # seconds; slower than this, ask for less
+    ZEPHYRCREDS_CHECK = 3600  # seconds between looks for fresher creds
+    ZEPHYRCREDS_MIN = 60  # but don't look more often than this
+
+    tail_window = util.Configurable(
+        'roost.tail_window', 64,
+        'How many new messages the server may send before we ask for more',
+        coerce=int)
+    zcrypt_concurrency = util.Configurable(
+        'roost.zcrypt_concurrency', 4,
+        'How many zcrypt processes to run at once', coerce=int)
 
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
         self.messages = []
         self.r = _rooster.Rooster(self.url, self.service_name)
-        self.chunksize = 128
+        self.zcrypt = Zcrypt(self.log, self.zcrypt_concurrency)
+        self.chunksize = self.BACKFILL_MIN
         self.loaded = False
         self.backfilling = False
         self.connected = False
+        self.zephyrcreds_task = None
         self._destinations = set()
         self._zephyr_subs = os.path.join(
             self.context.home_directory, '.zephyr.subs')
 
     def start(self):
+        self.resume_load()
         self.new_task = asyncio.Task(self.new_messages())
         self.tasks.append(self.new_task)
+        if self.zephyrcreds_task is None or self.zephyrcreds_task.done():
+            self.zephyrcreds_task = asyncio.Task(self.renew_zephyrcreds())
+            self.tasks.append(self.zephyrcreds_task)
+
+    @asyncio.coroutine
+    def renew_zephyrcreds(self):
+        """Keep the server's copy of our zephyr credentials fresh.
+
+        Whenever the ccache has zephyr tickets that outlast the ones we
+        last gave the server, hand them over, rather than waiting for
+        the server's to run out.
+        """
+        sent = 0
+        while True:
+            wait = self.ZEPHYRCREDS_CHECK
+            try:
+                creds = yield from self.r.credentials()
+                endtime = creds['endtime'] / 1000
+                if endtime > sent:
+                    self.log.debug('renewing zephyr creds until %s', endtime)
+                    yield from self.r.renew_zephyrcreds(creds)
+                    sent = endtime
+                # look again around when the cache will go and get new ones
+                wait = min(
+                    wait, endtime - _rooster.Kerberos.SLACK - time.time())
+            except asyncio.CancelledError:
+                return
+            except Exception:
+                self.log.exception('renewing zephyr creds')
+            yield from asyncio.sleep(max(wait, self.ZEPHYRCREDS_MIN))
 
     @asyncio.coroutine
     def new_messages(self):
@@ -124,14 +173,16 @@ class Roost(messages.SnipeBackend):
                 if start is not None:
                     break
             else:
-                start = None
+                # pick up after the last message we saw last time, if any
+                start = (self.resume or {}).get('id')
 
             errmsg = None
             activity = 'getting new messages from %s' % self.url
             try:
                 self.connected = True  # XXX kinda racy?
                 self.log.debug(activity)
-                yield from self.r.newmessages(self.new_message, start)
+                yield from self.r.newmessages(
+                    self.new_messages_batch, start, window=self.tail_window)
             except _rooster.RoosterReconnectException as e:
                 msg = '%s: %s' % (self.name, str(e))
                 self.log.exception(msg)
@@ -232,34 +283,14 @@ class Roost(messages.SnipeBackend):
         if '-R' in flags:
             body = codecs.encode(body, 'rot13')
 
-        for recipient in recipients:
-            if '-x' in flags:
-                flags['-O'] = 'crypt'
-                cmd = ['zcrypt', '-E', '-c', flags.get('-c', 'MESSAGE')]
-                proc = yield from asyncio.create_subprocess_exec(
-                    *cmd,
-                    **dict(
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        )
-                    )
-                stdout, stderr = yield from proc.communicate(body.encode())
-                stdout = stdout.decode(errors='replace')
-                stderr = stderr.decode(errors='replace')
-                if proc.returncode:
-                    self.log.error(
-                        'roost: %s returned %d',
-                        ' '.join(cmd), proc.returncode)
-                if stderr:
-                    self.log.error(
-                        'roost: %s send %s to stderr',
-                        ' '.join(cmd), repr(stderr))
-                    raise Exception('zcrypt: ' + stderr)
-                if proc.returncode:
-                    raise Exception('zcrypt returned %d' % (proc.returncode))
-                body = stdout
+        if '-x' in flags:
+            # the key only depends on the class, so one encryption does for
+            # every recipient
+            flags['-O'] = 'crypt'
+            body = yield from self.zcrypt.encrypt(
+                flags.get('-c', 'MESSAGE'), body)
 
+        for recipient in recipients:
             message = {
                 'class': flags.get('-c', 'MESSAGE'),
                 'instance': flags.get('-i', 'PERSONAL'),
@@ -275,50 +306,34 @@ class Roost(messages.SnipeBackend):
             self.log.info('sent to %s: %s', recipient, repr(result))
 
     @asyncio.coroutine
-    def new_message(self, m):
-        msg = yield from self.construct_and_maybe_decrypt(m)
-        self.add_message(msg)
+    def new_messages_batch(self, ms):
+        # decryption happens concurrently, but gather keeps the order
+        msgs = yield from asyncio.gather(*[
+            self.construct_and_maybe_decrypt(m) for m in ms])
+        self.add_messages(msgs)
+        if ms and 'id' in ms[-1]:
+            self.resume_set('id', ms[-1]['id'])
 
     def add_message(self, msg):
-        if self.messages and msg.time <= self.messages[-1].time:
-            msg.time = self.messages[-1].time + .00001
-        self.messages.append(msg)
+        self.add_messages([msg])
+
+    def add_messages(self, msgs):
+        if not msgs:
+            return
+        messages.order_after(
+            msgs, self.messages[-1] if self.messages else None)
+        self.messages.extend(msgs)
         self.drop_cache()
-        self.redisplay(msg, msg)
+        self.redisplay(msgs[0], msgs[-1])
 
     @asyncio.coroutine
     def construct_and_maybe_decrypt(self, m):
         msg = RoostMessage(self, m)
-        try:
-            if msg.data.get('opcode') == 'crypt':
-                cmd = ['zcrypt', '-D', '-c', msg.data['class']]
-                proc = yield from asyncio.create_subprocess_exec(
-                    *cmd,
-                    **dict(
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        )
-                    )
-                stdout, stderr = yield from proc.communicate(msg.body.encode())
-                stdout = stdout.decode(errors='replace')
-                stderr = stderr.decode(errors='replace')
-                if proc.returncode:
-                    self.log.error(
-                        'roost: %s returned %d',
-                        ' '.join(cmd),
-                        proc.returncode)
-                if stderr:
-                    self.log.error(
-                        'roost: %s send %s to stderr',
-                        ' '.join(cmd), repr(stderr))
-                if not (proc.returncode or stderr):
-                    sigil = '**END**\n'
-                    if stdout.endswith(sigil):
-                        stdout = stdout[:-len(sigil)]
-                    msg.transform('zcrypt', stdout)
-        except:
-            self.log.exception('zcrypt, decrypting')
+        if msg.data.get('opcode') == 'crypt':
+            plaintext = yield from self.zcrypt.decrypt(
+                msg.data['class'], msg.body)
+            if plaintext is not None:
+                msg.transform('zcrypt', plaintext)
 
         self._destinations.add(msg.followup())
         self._destinations.add(msg.reply())
@@ -346,20 +361,43 @@ class Roost(messages.SnipeBackend):
         self.log.debug('triggering backfill, target=%s', util.timestr(target))
 
         msgid = None
+        inclusive = False
         if self.messages:
             msgid = self.messages[0].data.get('id')
             if origin is None:
                 origin = filledpoint
+        elif self.resume and self.resume.get('id') is not None:
+            # the tail is picking up after this one, so work back from it
+            msgid = self.resume['id']
+            inclusive = True
 
         self.reap_tasks()
         self.tasks.append(
             asyncio.Task(self.error_message(
                 'backfilling',
-                self.do_backfill, msgid, mfilter, target, count, origin)))
+                self.do_backfill, msgid, mfilter, target, count, origin,
+                inclusive)))
 
     @asyncio.coroutine
-    def do_backfill(self, start, mfilter, target, count, origin):
-        # yield from asyncio.sleep(.0001)
+    def fetch_page(self, start, count, inclusive=False):
+        """Fetch a page of older messages, also returning how long it took."""
+        t0 = time.time()
+        chunk = yield from self.r.messages(start, count, inclusive=inclusive)
+        return chunk, time.time() - t0
+
+    def adjust_chunksize(self, latency):
+        """Grow the backfill page size while the server is answering quickly,
+        and back off when it isn't."""
+        if latency < self.BACKFILL_FAST:
+            self.chunksize = min(self.chunksize * 2, self.BACKFILL_MAX)
+        elif latency > self.BACKFILL_SLOW:
+            self.chunksize = max(self.chunksize // 2, self.BACKFILL_MIN)
+        self.log.debug(
+            'backfill latency %fs, chunksize now %d', latency, self.chunksize)
+
+    @asyncio.coroutine
+    def do_backfill(
+            self, start, mfilter, target, count, origin, inclusive=False):
         self.log.debug(
             'do_backfill(start=%s, [filter], %s, %s, origin=%s)',
             repr(start),
@@ -374,9 +412,11 @@ class Roost(messages.SnipeBackend):
             else:
                 self.log.debug('entering guard')
                 self.backfilling = True
-                yield False
-                self.backfilling = False
-                self.log.debug('leaving guard')
+                try:
+                    yield False
+                finally:
+                    self.backfilling = False
+                    self.log.debug('leaving guard')
 
         with backfillguard() as already:
             if already:
@@ -391,41 +431,56 @@ class Roost(messages.SnipeBackend):
                 self.log.debug('no more messages to backfill')
                 return
             self.log.debug('backfilling')
-            chunk = yield from self.r.messages(start, self.chunksize)
-
-            if chunk['isDone']:
-                self.log.info('IT IS DONE.')
-                self.loaded = True
-            ms = []
-            for m in chunk['messages']:
-                cm = yield from self.construct_and_maybe_decrypt(m)
-                ms.append(cm)
-            count += len([m for m in ms if mfilter(m)])
-            # Make sure ordering is stable
-            # XXX really assuming messages are millisecond unique si dumb
-            anchor = []
-            if self.messages and ms:
-                anchor = [(self.messages[0], ms[0])]
-            for (nextmsg, prevmsg) in itertools.chain(anchor, zip(ms, ms[1:])):
-                # walking backwards through time
-                if nextmsg.time == prevmsg.time:
-                    prevmsg.time = nextmsg.time - .00001
-            ms.reverse()
-            self.messages = ms + self.messages
-            self.drop_cache()
-            self.log.warning(
-                '%d messages, total %d, earliest %s',
-                count,
-                len(self.messages),
-                util.timestr(self.messages[0].time))
-
-            # and (maybe) circle around
-            yield from asyncio.sleep(.1)
-            self.backfill(mfilter, target, count=count, origin=origin)
-
-            self.redisplay(ms[0], ms[-1])
+
+            # Keep the next request in flight while we process the current
+            # page, until we get back to the target time or run out.
+            fetch = asyncio.Task(
+                self.fetch_page(start, self.chunksize, inclusive))
+            try:
+                while fetch is not None:
+                    chunk, latency = yield from fetch
+                    fetch = None
+                    self.adjust_chunksize(latency)
+
+                    if chunk['isDone']:
+                        self.log.info('IT IS DONE.')
+                        self.loaded = True
+                    page = chunk['messages']
+                    # as in backfill(), stop if we've lost the connection
+                    if (self.connected and not self.loaded and page
+                            and page[-1]['receiveTime'] / 1000 > target):
+                        fetch = asyncio.Task(
+                            self.fetch_page(page[-1]['id'], self.chunksize))
+
+                    count += yield from self.process_backfill(page, mfilter)
+                    yield from asyncio.sleep(0)
+            finally:
+                if fetch is not None:
+                    fetch.cancel()
+
             self.log.debug('done backfilling')
 
+    @asyncio.coroutine
+    def process_backfill(self, page, mfilter):
+        """Construct, decrypt and file a page of backfilled messages (which
+        arrive newest first); returns how many of them match mfilter."""
+
+        # decryption happens concurrently, but gather keeps the order
+        ms = yield from asyncio.gather(*[
+            self.construct_and_maybe_decrypt(m) for m in page])
+        ms = list(ms)
+        if not ms:
+            return 0
+        ms.reverse()
+        messages.order_before(ms, self.messages[0] if self.messages else None)
+        self.messages[:0] = ms
+        self.drop_cache()
+        self.log.debug(
+            '%d messages, total %d, earliest %s',
+            len(ms), len(self.messages), util.timestr(self.messages[0].time))
+        self.redisplay(ms[0], ms[-1])
+        return len([m for m in ms if mfilter(m)])
+
     @keymap.bind('R S')
     def dump_subscriptions(self, window: interactive.window):
         subs = yield from self.r.subscriptions()
@@ -527,6 +582,81 @@ class Roost(messages.SnipeBackend):
         self.new_task = None
 
 
+class Zcrypt:
+    """Run zcrypt, no more than concurrency processes at a time, remembering
+    what we've decrypted so we never decrypt the same thing twice."""
+
+    CACHESIZE = 8192
+
+    def __init__(self, log, concurrency=4, program='zcrypt'):
+        self.log = log
+        self.program = program
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.cache = collections.OrderedDict()
+
+    @asyncio.coroutine
+    def run(self, flag, class_, text):
+        cmd = [self.program, flag, '-c', class_]
+        yield from self.semaphore.acquire()
+        try:
+            proc = yield from asyncio.create_subprocess_exec(
+                *cmd,
+                **dict(
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    )
+                )
+            stdout, stderr = yield from proc.communicate(text.encode())
+        finally:
+            self.semaphore.release()
+        stdout = stdout.decode(errors='replace')
+        stderr = stderr.decode(errors='replace')
+        if proc.returncode:
+            self.log.error(
+                'roost: %s returned %d', ' '.join(cmd), proc.returncode)
+        if stderr:
+            self.log.error(
+                'roost: %s send %s to stderr', ' '.join(cmd), repr(stderr))
+        return proc.returncode, stdout, stderr
+
+    @asyncio.coroutine
+    def encrypt(self, class_, body):
+        returncode, stdout, stderr = yield from self.run('-E', class_, body)
+        if stderr:
+            raise Exception('zcrypt: ' + stderr)
+        if returncode:
+            raise Exception('zcrypt returned %d' % (returncode))
+        return stdout
+
+    @asyncio.coroutine
+    def decrypt(self, class_, ciphertext):
+        """Return the decryption of ciphertext, or None if that didn't
+        work."""
+
+        key = (class_, hashlib.sha1(ciphertext.encode()).digest())
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        try:
+            returncode, stdout, stderr = yield from self.run(
+                '-D', class_, ciphertext)
+        except Exception:
+            self.log.exception('zcrypt, decrypting')
+            return None
+        if returncode or stderr:
+            return None
+
+        sigil = '**END**\n'
+        if stdout.endswith(sigil):
+            stdout = stdout[:-len(sigil)]
+        self.cache[key] = stdout
+        while len(self.cache) > self.CACHESIZE:
+            self.cache.popitem(last=False)
+        return stdout
+
+
 class RoostMessage(messages.SnipeMessage):
     def __init__(self, backend, m):
         super().__init__(backend, m['message'], m['receiveTime'] / 1000)
@@ -0,0 +1,211 @@
+# -*- encoding: utf-8 -*-
+# Copyright © 2016 the Snipe contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following
+# disclaimer in the documentation and/or other materials provided
+# with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+'''
+snipe.rst
+---------
+Rendering reStructuredText (i.e. the help) with docutils, which is
+expensive to import and so only imported when help is wanted.
+'''
+
+import sys
+
+import docutils.nodes
+import docutils.parsers.rst
+import docutils.parsers.rst.directives
+
+from . import text
+from . import util
+
+
+class RSTRenderer(text.Renderer):
+    def process(self, node):
+        tagset = 0
+
+        if isinstance(node, docutils.nodes.Text):
+            self.log.debug('text: %s', repr(node.astext()))
+            self.add(node.astext())
+            return
+        elif isinstance(node, docutils.nodes.comment):
+            self.log.debug('comment: %s', repr(node.astext()))
+            return
+
+        self.log.debug('entering: %s', repr(node))
+
+        if isinstance(node, docutils.nodes.title):
+            self.targets[''.join(node.astext().split())] = self.offset
+
+        if (not isinstance(node, docutils.nodes.Inline)
+                and not isinstance(node, docutils.nodes.line)
+                and not isinstance(node, docutils.nodes.line_block)):
+            self.linebreak()
+
+        if isinstance(node, docutils.nodes.section):
+            self.section_level += 1
+
+        if isinstance(node, docutils.nodes.title):
+            self.add('*' * self.section_level)
+            if self.section_level:
+                self.add(' ')
+
+        if isinstance(node, docutils.nodes.line):
+            self.add(' '*node.indent)
+
+        if (isinstance(node, docutils.nodes.Titular)
+                or isinstance(node, docutils.nodes.emphasis)
+                or isinstance(node, docutils.nodes.literal)
+                or isinstance(node, docutils.nodes.literal_block)):
+            tagset += self.tagpush('bold')
+
+        if isinstance(node, docutils.nodes.literal_block):
+            self.linebreak()
+
+        if (isinstance(node, docutils.nodes.literal_block)
+                or isinstance(node, docutils.nodes.line)):
+            fill, self.fill = self.fill, False
+
+        if isinstance(node, docutils.nodes.reference):
+            tagset += self.tagpush('fg:#6666ff', 'underline')
+            link_start = self.offset
+
+        for x in node.children:
+            self.process(x)
+
+        if (isinstance(node, docutils.nodes.literal_block)
+                or isinstance(node, docutils.nodes.line)):
+            self.fill = fill
+
+        self.tagpop(tagset)
+
+        if isinstance(node, docutils.nodes.reference):
+            self.links.append(
+                (link_start, self.offset - link_start, node['refuri']))
+
+        if isinstance(node, docutils.nodes.section):
+            self.section_level -= 1
+
+        if (not isinstance(node, docutils.nodes.Inline)
+                and not isinstance(node, docutils.nodes.line_block)):
+            self.linebreak()
+            if (not isinstance(node, docutils.nodes.term)
+                    and not isinstance(node, docutils.nodes.line)):
+                self.space()
+
+        self.log.debug('leaving: %s', repr(node))
+
+
+class Interrogator(docutils.parsers.rst.Directive):
+    required_arguments = 1
+    optional_arguments = 0
+    has_content = True
+
+    def run(self):
+        import traceback
+        from . import help
+        try:
+            name = self.arguments[0]
+            if '.' not in name:
+                obj = getattr(help.HelpBrowser.base_module, self.arguments[0])
+            else:
+                module, name = name.rsplit('.', 1)
+                obj = getattr(sys.modules[module], name)
+
+            self.state_machine.insert_input(self.process(obj), '<code>')
+            return []
+        except Exception as e:  # pragma: nocover
+            text = str(e)
+            text = traceback.format_exc()
+            return [docutils.nodes.Text(text + '\n')]
+
+    def process(self, _):
+        raise NotImplementedError  # pragma: nocover
+
+
+class InterrogateKeymap(Interrogator):
+    def process(self, obj):
+        text = ''
+        for attr in dir(obj):
+            prop = getattr(obj, attr)
+            if not hasattr(prop, 'snipe_seqs'):
+                continue
+            if not (hasattr(prop, '__doc__') and prop.__doc__):
+                continue
+            if not getattr(prop, '__qualname__', '').startswith(
+                    obj.__name__ + '.'):
+                continue
+            text += '\n%s *%s*\n' % (
+                ' '.join('``%s``' % (s,) for s in prop.snipe_seqs), attr)
+            # XXX if this faceplants on any of the relevant docstrings,
+            # It's a bug in the docstring, really
+            # Strip the leading indentation off of all but the first
+            # line of the docstring
+            l = prop.__doc__.splitlines()
+            if len(l) > 1:
+                s = l[1].lstrip(' ')
+                off = len(l[1]) - len(s)
+                l[1:] = [s[off:] for s in l[1:]]
+            # reindent and append
+            text += ''.join('  ' + s + '\n' for s in l)
+            text += '\n'
+        return text.splitlines()
+
+
+docutils.parsers.rst.directives.register_directive(
+    'interrogate_keymap', InterrogateKeymap)
+
+
+class InterrogateConfig(Interrogator):
+    def process(self, obj):
+        lines = ['']
+        for name in dir(obj):
+            attr = getattr(obj, name)
+            if isinstance(attr, util.Configurable):
+                lines.append('``%s``' % (attr.key,))
+                lines.append('  %s' % (attr.doc,))
+                lines.append('')
+        return lines
+
+
+docutils.parsers.rst.directives.register_directive(
+    'interrogate_config', InterrogateConfig)
+
+
+class Toc(docutils.parsers.rst.Directive):
+    required_arguments = 0
+    optional_arguments = 0
+    has_content = True
+
+    def run(self):
+        from . import help
+        self.state_machine.insert_input(help.HelpBrowser.toclines, '<toc>')
+        return []
+
+
+docutils.parsers.rst.directives.register_directive(
+    'toc', Toc)
@@ -34,10 +34,13 @@ Backend for talking to `Slack <https://slack.com>`.
 '''
 
 
+import bisect
 import time
+import os
 import re
 import urllib.parse
 import pprint
+import collections
 import contextlib
 import itertools
 
@@ -118,6 +121,21 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
         )
     # XXX should really do updates & redisplays pin_ messages
 
+    RATELIMIT_RETRIES = 5
+    RATELIMIT_WAIT = 1  # seconds, if we're not told otherwise
+    PRIORITY_SCAN = 1024  # recent messages to look at for current channels
+    CATCH_UP = 1000  # most messages to catch up on per channel at startup
+    JSON_THREAD_THRESHOLD = util.JSON_THREAD_THRESHOLD
+    HISTORY = {
+        'channel': 'channels.history',
+        'im': 'im.history',
+        'group': 'groups.history',
+        }
+
+    backfill_concurrency = util.Configurable(
+        'slack.backfill_concurrency', 4,
+        'How many channel histories to fetch at once', coerce=int)
+
     def __init__(self, context, slackname=None, **kw):
         super().__init__(context, **kw)
         if slackname is None and self.name != self.__class__.name:
@@ -126,15 +144,29 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
         if self.name == self.__class__.name:
             self.name = Slack.name + '.' + slackname
         self.backfilling = False
+        self.data = None
+        self.users = {}
+        self.emoji = {}
         self.dests = {}
+        self.dests_by_name = {}  # name -> dest to send to
+        self.users_by_name = {}  # name -> user dest
+        self.ims_by_user = {}  # user id -> im dest
+        self.displaynames = {}  # id -> str(dest)
+        self._destinations = None
+        self._senders = None
         self.connected = False
         self.messages = []
+        self.messages_by_ts = {}  # (channel, ts) -> SlackMessage
         self.nextid = itertools.count().__next__
         self.unacked = {}
         self.used_emoji = []
+        self.ratelimits = {}
+        self.backfill_total = 0
+        self.backfill_done = 0
         self.setup_client_session()
 
     def start(self):
+        self.resume_load()
         self.tasks.append(asyncio.Task(self.connect(self.slackname)))
 
     @asyncio.coroutine
@@ -151,24 +183,22 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
 
             self.url = 'https://' + SLACKDOMAIN + SLACKAPI
 
-            self.log.debug('about to rtm.start')
-
-            yield from self.emoji_update()
-
-            self.data = yield from self.method('rtm.start')
-            if not self.check_ok(self.data, 'connecting to %s', slackname):
-                return
+            if (yield from self.metadata_load()):
+                # we know enough to get going, so just get the websocket url
+                # and catch up with everything else in the background
+                self.log.debug('about to rtm.connect')
+                self.data = yield from self.method('rtm.connect')
+                if not self.check_ok(
+                        self.data, 'connecting to %s', slackname):
+                    return
+                self.tasks.append(asyncio.Task(self.metadata_refresh()))
+            else:
+                self.log.debug('about to rtm.start')
+                if not (yield from self.metadata_refresh()):
+                    return
 
             url = self.data['url']
 
-            self.users = {u['id']: u for u in self.data['users']}
-            self.users.update({b['id']: b for b in self.data['bots']})
-
-            self.dests = dict(sum((
-                [(x['id'], SlackDest(self, t, x)) for x in self.data[t + 's']]
-                for t in ['user', 'bot', 'im', 'group', 'channel']
-                ), []))
-
             # Slack's websocket servers want a literal '=' in the request and
             # not a %3D.  I don't know why, and don't really care, but this is
             # how I trick yarl & http into obliging.
@@ -191,6 +221,7 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
                 yield from self.websocket.connect(url)
 
                 self.connected = True
+                self.tasks.append(asyncio.Task(self.catch_up()))
 
                 while True:
                     m = yield from self.websocket.read()
@@ -205,17 +236,144 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
         except:
             self.log.exception('connecting to slack')
 
+    def load_metadata(self, data):
+        """Absorb the users and destinations from an rtm.start response,
+        keeping what we already know about destinations we've seen.
+        Destinations it doesn't mention any more are kept, for the sake of
+        old messages, but are no longer indexed or offered."""
+        self.users = {u['id']: u for u in data['users']}
+        self.users.update({b['id']: b for b in data['bots']})
+
+        for dest in self.dests.values():
+            dest.gone = True
+        for t in ['user', 'bot', 'im', 'group', 'channel']:
+            for x in data[t + 's']:
+                dest = self.dests.get(x['id'])
+                if dest is not None and dest.type == t:
+                    dest.update(x)
+                    dest.gone = False
+                else:
+                    self.dests[x['id']] = SlackDest(self, t, x)
+        self.reindex()
+
+    @asyncio.coroutine
+    def metadata_refresh(self):
+        """Fetch (and cache) the workspace metadata."""
+        data, raw = yield from self.method_raw('rtm.start')
+        if not self.check_ok(data, 'connecting to %s', self.slackname):
+            return False
+        self.data = data
+        self.load_metadata(data)
+        yield from self.metadata_write('rtm', raw)
+        yield from self.emoji_update()
+        return True
+
+    def metadata_path(self, which):
+        return os.path.join(
+            self.context.directory, 'slackcache',
+            '%s.%s.json' % (self.slackname, which))
+
+    @asyncio.coroutine
+    def metadata_load(self):
+        """Load the cached workspace metadata, if there is any."""
+        loop = asyncio.get_event_loop()
+
+        def load(which):
+            with open(self.metadata_path(which), 'rb') as fp:
+                return util.json_loads(fp.read())
+
+        try:
+            data = yield from loop.run_in_executor(None, load, 'rtm')
+            emoji = yield from loop.run_in_executor(None, load, 'emoji')
+        except (OSError, ValueError) as e:
+            self.log.debug('no usable metadata cache: %s', e)
+            return False
+        self.emoji = emoji
+        self.load_metadata(data)
+        return True
+
+    @asyncio.coroutine
+    def metadata_write(self, which, raw):
+        path = self.metadata_path(which)
+        loop = asyncio.get_event_loop()
+
+        def write():
+            self.context.ensure_directory()
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            with util.safe_write(path) as fp:
+                fp.write(raw.decode())
+
+        try:
+            yield from loop.run_in_executor(None, write)
+        except (OSError, UnicodeError):
+            self.log.exception('writing metadata cache %s', path)
+
+    def reindex(self):
+        """Rebuild all the destination indexes from scratch."""
+        self.dests_by_name = {}
+        self.users_by_name = {}
+        self.ims_by_user = {}
+        for dest in self.dests.values():
+            dest.indexed = []
+            self.index_dest(dest)
+
+    def unindex_dest(self, dest):
+        for (index, key) in dest.indexed:
+            if index.get(key) is dest:
+                del index[key]
+        dest.indexed = []
+
+    def index_dest(self, dest):
+        """(Re)index one destination, after it's been added or changed."""
+        self.unindex_dest(dest)
+
+        if not dest.live:
+            entries = []
+        elif dest.type == 'user':
+            entries = [(self.users_by_name, dest.data.get('name'))]
+        elif dest.type == 'im':
+            user = dest.data.get('user')
+            entries = [
+                (self.dests_by_name, self.users.get(user, {}).get('name')),
+                (self.ims_by_user, user),
+                ]
+        else:
+            entries = [(self.dests_by_name, dest.data.get('name'))]
+        for (index, key) in entries:
+            # the first one wins, as it did when we searched linearly
+            if key is not None and key not in index:
+                index[key] = dest
+                dest.indexed.append((index, key))
+
+        self.displaynames.pop(dest.data.get('id'), None)
+        self._destinations = None
+        self._senders = None
+
+    def displayname(self, identifier):
+        name = self.displaynames.get(identifier)
+        if name is None:
+            dest = self.dests.get(identifier)
+            if dest is None:
+                return identifier
+            name = self.displaynames[identifier] = str(dest)
+        return name
+
     def destinations(self):
-        return set(
-            self.name + '; ' + str(x)
-            for x in self.dests.values()
-            if x.type != 'im')
+        if self._destinations is None:
+            self._destinations = set(
+                self.name + '; ' + self.displayname(x)
+                for x in self.dests
+                if self.dests[x].type != 'im' and self.dests[x].live)
+        return self._destinations
 
     def senders(self):
-        return set(
-            self.name + '; ' + str(x)
-            for x in self.dests.values()
-            if x.type in ('user', 'bot'))
+        if self._senders is None:
+            self._senders = set(
+                self.name + '; ' + self.displayname(x)
+                for x in self.dests
+                if self.dests[x].type in ('user', 'bot')
+                and self.dests[x].live)
+        return self._senders
 
     @asyncio.coroutine
     def incoming(self, m):
@@ -224,17 +382,10 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
             self.drop_cache()
             self.redisplay(msg, msg)
 
-    def find_message(self, when, m):
-        try:
-            msg = next(self.walk(when))
-        except StopIteration:
+    def find_message(self, channel, ts, m):
+        msg = self.messages_by_ts.get((channel, ts))
+        if msg is None:
             self.log.debug('%s for unknown message %s', m['type'], repr(m))
-            return None
-        if msg.time != when:
-            self.log.debug(
-                '%s found message %s for message %s',
-                m['type'], msg, repr(m))
-            return None
         return msg
 
     @asyncio.coroutine
@@ -262,17 +413,19 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
             yield from self.emoji_update()
             return
         elif t == 'message' and m.get('subtype') == 'message_changed':
-            msg = self.find_message(float(m['message']['ts']), m)
+            msg = self.find_message(m.get('channel'), m['message']['ts'], m)
             if msg is None:
                 return
             data = dict(m['message'])
             data['_old'] = msg.data
             data['_new'] = m
-            msg.data['channel'] = m.get('channel')
+            data['channel'] = m.get('channel')
             msg.data = data
-            return msg
+            self.redisplay(msg, msg)
+            return
         elif t in ('reaction_removed', 'reaction_added'):
-            msg = self.find_message(float(m['item']['ts']), m)
+            msg = self.find_message(
+                m['item'].get('channel'), m['item']['ts'], m)
             if msg is None:
                 return
             for i, reaction in enumerate(msg.data.get('reactions', [])):
@@ -295,41 +448,65 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
                 else:
                     if m['user'] in reaction['users']:
                         reaction['users'].remove(m['user'])
-            return msg
+            self.redisplay(msg, msg)
+            return
         elif t == 'team_join':
             u = m['user']
             self.users[u['id']] = u
-            self.dests[u['id']] = SlackDest(self, 'user', u)
+            self.add_dest('user', u)
             return
         elif t == 'user_change':
             u = m['user']
             self.users[u['id']] = u
+            if u['id'] in self.dests:
+                self.dests[u['id']].update(u)
+                self.index_dest(self.dests[u['id']])
+            if u['id'] in self.ims_by_user:
+                self.index_dest(self.ims_by_user[u['id']])
             return
         elif t == 'channel_created':
-            c = m['channel']
-            self.dests[c['id']] = SlackDest(self, 'channel', c)
+            self.add_dest('channel', m['channel'])
             return
         elif t in ('channel_rename', 'group_rename'):
             c = m['channel']
             self.dests[c['id']].update(c)
+            self.index_dest(self.dests[c['id']])
+            return
         elif t == 'group_joined':
-            c = m['channel']
-            self.dests[c['id']] = SlackDest(self, 'group', c)
+            self.add_dest('group', m['channel'])
             return
         elif t == 'im_created':
-            c = m['channel']
-            self.dests[c['id']] = SlackDest(self, 'im', c)
+            self.add_dest('im', m['channel'])
             return
         msg = SlackMessage(self, m)
         if messagelist and msg.time <= messagelist[-1].time:
             msg.time = messagelist[-1].time + .000001
         messagelist.append(msg)
+        if 'ts' in m and 'channel' in m:
+            self.messages_by_ts[(m['channel'], m['ts'])] = msg
+            seen = (self.resume or {}).get(m['channel'])
+            if seen is None or float(seen) < float(m['ts']):
+                self.resume_set(m['channel'], m['ts'])
+        dest = self.dests.get(m.get('channel'))
+        if dest is not None and (
+                dest.active is None or dest.active < msg.time):
+            dest.active = msg.time
         return msg
 
+    def add_dest(self, type_, data):
+        if data['id'] in self.dests:
+            self.unindex_dest(self.dests[data['id']])
+        dest = self.dests[data['id']] = SlackDest(self, type_, data)
+        self.index_dest(dest)
+        return dest
+
     @asyncio.coroutine
     def emoji_update(self):
         self.log.debug('attempting to retrieve emoji')
-        self.emoji = yield from self.method('emoji.list')
+        emoji, raw = yield from self.method_raw('emoji.list')
+        if emoji.get('ok'):
+            self.emoji = emoji
+            yield from self.metadata_write('emoji', raw)
 
     @keymap.bind('S U')
     def dump_users(self, window: interactive.window):
@@ -350,9 +527,11 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
         else:
             self.log.debug('entering guard')
             self.backfilling = True
-            yield False
-            self.backfilling = False
-            self.log.debug('leaving guard')
+            try:
+                yield False
+            finally:
+                self.backfilling = False
+                self.log.debug('leaving guard')
 
     def backfill(self, mfilter, target=None):
         if not self.connected:
@@ -368,15 +547,58 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
                 return
 
             self.reap_tasks()
-            backfillers = [
-                asyncio.Task(self.do_backfill_dest(dest, mfilter, target))
-                for dest in self.dests
-                if (self.dests[dest].type in ('im', 'group') or (
+            queue = collections.deque(sorted(
+                (
+                    dest for dest in self.dests
+                    if (self.dests[dest].type in ('im', 'group') or (
                         self.dests[dest].type == 'channel'
                         and self.dests[dest].data['is_member']))
-                and not self.dests[dest].loaded]
+                    and not self.dests[dest].loaded),
+                key=self.backfill_priority(mfilter)))
+            self.backfill_total, self.backfill_done = len(queue), 0
+
+            @asyncio.coroutine
+            def backfiller():
+                while queue:
+                    dest = queue.popleft()
+                    try:
+                        yield from self.do_backfill_dest(dest, mfilter, target)
+                    except Exception:
+                        self.log.exception('backfilling %s', dest)
+                    self.backfill_done += 1
+
+            backfillers = [
+                asyncio.Task(backfiller())
+                for i in range(min(self.backfill_concurrency, len(queue)))]
             self.tasks += backfillers
-            yield from asyncio.gather(*backfillers, return_exceptions=True)
+            try:
+                yield from asyncio.gather(*backfillers, return_exceptions=True)
+            finally:
+                self.backfill_total = self.backfill_done = 0
+
+    def backfill_priority(self, mfilter):
+        """Return a sort key for destinations to backfill: the ones that
+        are showing in the window doing the asking first, then the ones
+        with the most recent activity."""
+        current = set()
+        if mfilter is not None:
+            current = set(
+                m.data.get('channel')
+                for m in self.messages[-self.PRIORITY_SCAN:]
+                if isinstance(m, SlackMessage) and mfilter(m))
+
+        def key(dest):
+            active = self.dests[dest].active
+            return (
+                dest not in current,
+                -active if active is not None else float('inf'))
+        return key
+
+    def progress(self):
+        if self.backfill_total:
+            return '%s backfill %d/%d' % (
+                self.name, self.backfill_done, self.backfill_total)
+        return None
 
     @asyncio.coroutine
     def do_backfill_dest(self, dest, mfilter, target):
@@ -399,11 +621,7 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
         d.loaded = True
 
         data = yield from self.method(
-            {
-                'channel': 'channels.history',
-                'im': 'im.history',
-                'group': 'groups.history',
-            }[d.type],
+            self.HISTORY[d.type],
             channel=dest,
             **({'latest': d.oldest} if d.oldest is not None else {}))
 
@@ -413,8 +631,12 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
         messagelist = []
         for m in reversed(data['messages']):
             m['channel'] = dest
+            if (dest, m.get('ts')) in self.messages_by_ts:
+                continue  # catch_up got here first
             try:
                 msg = yield from self.process_message(messagelist, m)
+                if msg is None:
+                    continue
                 if d.oldest is None or d.oldest > msg.time:
                     d.oldest = msg.time
             except:
@@ -426,32 +648,70 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
         if messagelist:
             self.redisplay(messagelist[0], messagelist[-1])
 
+    @asyncio.coroutine
+    def catch_up(self):
+        """Fetch what was said in each channel since the last message we saw
+        there in a previous session, up to the CATCH_UP newest messages;
+        backfill works back from there."""
+        for dest, ts in list((self.resume or {}).items()):
+            d = self.dests.get(dest)
+            if d is None or d.type not in self.HISTORY or (
+                    d.type == 'channel' and not d.data.get('is_member')):
+                continue
+            history = []
+            latest = {}
+            while True:
+                data = yield from self.method(
+                    self.HISTORY[d.type], channel=dest, oldest=ts,
+                    inclusive=1, **latest)
+                if not self.check_ok(data, 'catching up on %s', dest):
+                    break
+                # pages come newest first, and so do the messages on them
+                history[:0] = reversed(data['messages'])
+                if len(history) >= self.CATCH_UP:
+                    history = history[-self.CATCH_UP:]
+                    break
+                if not data.get('has_more') or not data['messages']:
+                    break
+                latest = {'latest': data['messages'][-1]['ts']}
+            messagelist = []
+            for m in history:
+                m['channel'] = dest
+                if (dest, m.get('ts')) in self.messages_by_ts:
+                    continue
+                try:
+                    msg = yield from self.process_message(messagelist, m)
+                except Exception:
+                    self.log.exception(
+                        'processing message: %s', pprint.pformat(m))
+                    continue
+                if msg is not None and (
+                        d.oldest is None or d.oldest > msg.time):
+                    d.oldest = msg.time
+            if messagelist:
+                self.log.debug(
+                    '%s: caught up %d messages', dest, len(messagelist))
+                # these are (mostly) newer than anything we have
+                i = bisect.bisect_left(self.messages, messagelist[0])
+                self.messages[i:] = messages.merge(
+                    [self.messages[i:], messagelist])
+                self.drop_cache()
+                self.redisplay(messagelist[0], messagelist[-1])
+
     @asyncio.coroutine
     def send(self, inrecipient, body):
         inrecipient = inrecipient.strip()
         recipient = inrecipient.lstrip('+#@')
 
-        user = None
-        for d in self.dests.values():
-            if d.type == 'user' and d.data['name'] == recipient:
-                self.log.debug('stashing user %s', repr(d))
-                user = d
-            elif 'name' in d.data:
-                if d.data['name'] == recipient:
-                    recipient = d.data['id']
-                    break
-            elif 'user' in d.data:
-                self.log.debug('1: %s', pprint.pformat(d))
-                self.log.debug(
-                    '2: %s', pprint.pformat(self.users[d.data['user']]))
-                if self.users[d.data['user']]['name'] == recipient:
-                    recipient = d.data['id']
-                    break
+        dest = self.dests_by_name.get(recipient)
+        if dest is not None:
+            recipient = dest.data['id']
         else:
+            user = self.users_by_name.get(recipient)
             if user is None:
                 raise util.SnipeException('cannot find recipient')
             # we need to open a dm session
-            self.log.debug('opening dm session with %s', repr(d))
+            self.log.debug('opening dm session with %s', repr(user))
             response = yield from self.method('im.open', user=user.data['id'])
 
             if not self.check_ok(response, 'opening DM session'):
@@ -474,9 +734,50 @@ class Slack(messages.SnipeBackend, util.HTTP_JSONmixin):
 
     @asyncio.coroutine
     def method(self, method, **kwargs):
+        result, raw = yield from self.method_raw(method, **kwargs)
+        return result
+
+    @asyncio.coroutine
+    def method_raw(self, method, **kwargs):
+        """Call a method, returning the decoded result and the raw body."""
         msg = dict(kwargs)
         msg['token'] = self.token
-        return (yield from self._post(method, **msg))
+        raw = None
+        for attempt in range(self.RATELIMIT_RETRIES):
+            delay = self.ratelimits.get(method, 0) - time.time()
+            if delay > 0:
+                self.log.debug('%s: rate limited for %fs', method, delay)
+                yield from asyncio.sleep(delay)
+            self.log.debug('method(%s, **%s)', method, repr(kwargs))
+            response = yield from self._clientsession.post(
+                urllib.parse.urljoin(self.url, method), data=msg)
+            retry_after = response.headers.get('Retry-After')
+            try:
+                if response.status == 429:
+                    result = {'ok': False, 'error': 'ratelimited'}
+                else:
+                    raw = yield from response.read()
+                    result = yield from self.decode(raw)
+            finally:
+                response.release()
+            if result.get('error') != 'ratelimited':
+                return result, raw
+            try:
+                wait = float(retry_after)
+            except (TypeError, ValueError):
+                wait = self.RATELIMIT_WAIT
+            self.ratelimits[method] = time.time() + wait
+        return result, raw
+
+    @asyncio.coroutine
+    def decode(self, raw):
+        """Decode a JSON response, in a worker thread if it's big."""
+        try:
+            return (
+                yield from util.json_decode(raw, self.JSON_THREAD_THRESHOLD))
+        except (UnicodeError, ValueError) as e:
+            self.log.error('json %s: %s', e.__class__.__name__, repr(raw))
+            raise util.JSONDecodeError(repr(raw)) from e
 
     def check_ok(self, response, context, *args):
         # maybe should be doing this with exceptions
@@ -502,10 +803,26 @@ class SlackDest:
 
         self.oldest = None
         self.loaded = False
+        self.indexed = []  # (index, key) entries in the backend's indexes
+        self.gone = False  # missing from the latest metadata refresh
+        self.active = None  # time of the most recent message we know of
+        latest = data.get('latest')
+        if isinstance(latest, dict) and 'ts' in latest:
+            self.active = float(latest['ts'])
 
     def update(self, data):
         self.data.update(data)
 
+    @property
+    def live(self):
+        """Whether it still exists, as far as we know."""
+        if self.gone or self.data.get('deleted'):
+            return False
+        if self.type == 'im':
+            user = self.backend.users.get(self.data.get('user'), {})
+            return not user.get('deleted')
+        return True
+
     def __repr__(self):
         return self.__class__.__name__ + '(\n    ' \
           + repr(self.type) + ',\n    ' \
@@ -536,7 +853,7 @@ class SlackAddress(messages.SnipeAddress):
         return self.backend.name + '; ' + self.short()
 
     def short(self):
-        return str(self.backend.dests.get(self.id, self.id))
+        return self.backend.displayname(self.id)
 
 
 class SlackMessage(messages.SnipeMessage):
@@ -600,7 +917,7 @@ class SlackMessage(messages.SnipeMessage):
             self.unhandled = True
 
     def displayname(self, s):
-        return str(self.backend.dests.get(s, s))
+        return self.backend.displayname(s)
 
     def slackmarkup(self, text, tags):
         chunk = chunks.Chunk()
@@ -34,19 +34,11 @@ Text processing stuff.
 '''
 
 
+import collections
 import logging
 import re
-import sys
-import xml.dom.minidom
-
-import docutils.io
-import docutils.parsers.rst
-import docutils.parsers.rst.directives
-import docutils.nodes
-import markdown
-import markdown.extensions
-import markdown.extensions.codehilite
-import markdown.extensions.fenced_code
+import threading
+import xml.etree.ElementTree
 
 from . import chunks
 from . import util
@@ -55,7 +47,7 @@ from . import util
 WHITESPACE = re.compile(r'(\s+)')
 
 
-class RSTRenderer:
+class Renderer:
     loglevel = util.Level(
         'log.help.renderer', 'Renderer',
         doc='logevel for Help text renderer')
@@ -212,175 +204,10 @@ class RSTRenderer:
         if count:
             del self.tagstack[-count:]
 
-    def process(self, node):
-        tagset = 0
-
-        if isinstance(node, docutils.nodes.Text):
-            self.log.debug('text: %s', repr(node.astext()))
-            self.add(node.astext())
-            return
-        elif isinstance(node, docutils.nodes.comment):
-            self.log.debug('comment: %s', repr(node.astext()))
-            return
-
-        self.log.debug('entering: %s', repr(node))
-
-        if isinstance(node, docutils.nodes.title):
-            self.targets[''.join(node.astext().split())] = self.offset
-
-        if (not isinstance(node, docutils.nodes.Inline)
-                and not isinstance(node, docutils.nodes.line)
-                and not isinstance(node, docutils.nodes.line_block)):
-            self.linebreak()
-
-        if isinstance(node, docutils.nodes.section):
-            self.section_level += 1
-
-        if isinstance(node, docutils.nodes.title):
-            self.add('*' * self.section_level)
-            if self.section_level:
-                self.add(' ')
-
-        if isinstance(node, docutils.nodes.line):
-            self.add(' '*node.indent)
-
-        if (isinstance(node, docutils.nodes.Titular)
-                or isinstance(node, docutils.nodes.emphasis)
-                or isinstance(node, docutils.nodes.literal)
-                or isinstance(node, docutils.nodes.literal_block)):
-            tagset += self.tagpush('bold')
-
-        if isinstance(node, docutils.nodes.literal_block):
-            self.linebreak()
-
-        if (isinstance(node, docutils.nodes.literal_block)
-                or isinstance(node, docutils.nodes.line)):
-            fill, self.fill = self.fill, False
-
-        if isinstance(node, docutils.nodes.reference):
-            tagset += self.tagpush('fg:#6666ff', 'underline')
-            link_start = self.offset
-
-        for x in node.children:
-            self.process(x)
-
-        if (isinstance(node, docutils.nodes.literal_block)
-                or isinstance(node, docutils.nodes.line)):
-            self.fill = fill
-
-        self.tagpop(tagset)
-
-        if isinstance(node, docutils.nodes.reference):
-            self.links.append(
-                (link_start, self.offset - link_start, node['refuri']))
-
-        if isinstance(node, docutils.nodes.section):
-            self.section_level -= 1
-
-        if (not isinstance(node, docutils.nodes.Inline)
-                and not isinstance(node, docutils.nodes.line_block)):
-            self.linebreak()
-            if (not isinstance(node, docutils.nodes.term)
-                    and not isinstance(node, docutils.nodes.line)):
-                self.space()
-
-        self.log.debug('leaving: %s', repr(node))
-
     def flat(self):
         return ''.join(str(x.chunk) for x in self.output)
 
 
-class Interrogator(docutils.parsers.rst.Directive):
-    required_arguments = 1
-    optional_arguments = 0
-    has_content = True
-
-    def run(self):
-        import traceback
-        from . import help
-        try:
-            name = self.arguments[0]
-            if '.' not in name:
-                obj = getattr(help.HelpBrowser.base_module, self.arguments[0])
-            else:
-                module, name = name.rsplit('.', 1)
-                obj = getattr(sys.modules[module], name)
-
-            self.state_machine.insert_input(self.process(obj), '<code>')
-            return []
-        except Exception as e:  # pragma: nocover
-            text = str(e)
-            text = traceback.format_exc()
-            return [docutils.nodes.Text(text + '\n')]
-
-    def process(self, _):
-        raise NotImplementedError  # pragma: nocover
-
-
-class InterrogateKeymap(Interrogator):
-    def process(self, obj):
-        text = ''
-        for attr in dir(obj):
-            prop = getattr(obj, attr)
-            if not hasattr(prop, 'snipe_seqs'):
-                continue
-            if not (hasattr(prop, '__doc__') and prop.__doc__):
-                continue
-            if not getattr(prop, '__qualname__', '').startswith(
-                    obj.__name__ + '.'):
-                continue
-            text += '\n%s *%s*\n' % (
-                ' '.join('``%s``' % (s,) for s in prop.snipe_seqs), attr)
-            # XXX if this faceplants on any of the relevant docstrings,
-            # It's a bug in the docstring, really
-            # Strip the leading indentation off of all but the first
-            # line of the docstring
-            l = prop.__doc__.splitlines()
-            if len(l) > 1:
-                s = l[1].lstrip(' ')
-                off = len(l[1]) - len(s)
-                l[1:] = [s[off:] for s in l[1:]]
-            # reindent and append
-            text += ''.join('  ' + s + '\n' for s in l)
-            text += '\n'
-        return text.splitlines()
-
-
-docutils.parsers.rst.directives.register_directive(
-    'interrogate_keymap', InterrogateKeymap)
-
-
-class InterrogateConfig(Interrogator):
-    def process(self, obj):
-        lines = ['']
-        for name in dir(obj):
-            attr = getattr(obj, name)
-            if isinstance(attr, util.Configurable):
-                lines.append('``%s``' % (attr.key,))
-                lines.append('  %s' % (attr.doc,))
-                lines.append('')
-        return lines
-
-
-docutils.parsers.rst.directives.register_directive(
-    'interrogate_config', InterrogateConfig)
-
-
-class Toc(docutils.parsers.rst.Directive):
-    required_arguments = 0
-    optional_arguments = 0
-    has_content = True
-
-    def run(self):
-        from . import help
-        self.state_machine.insert_input(help.HelpBrowser.toclines, '<toc>')
-        return []
-
-
-docutils.parsers.rst.directives.register_directive(
-    'toc', Toc)
-
-
 IGNORED_TAGS = {'html', 'body'}
 INDENT_TAGS = {'blockquote'}
 BLOCK_TAGS = {
@@ -396,51 +223,52 @@ HANDLED_TAGS = (
     )
 
 
-class XHTMLRenderer(RSTRenderer):
+class XHTMLRenderer(Renderer):
     def process(self, node):
+        """Render an ElementTree element (and its children, but not its
+        tail.)"""
         self.log.debug('entering %s %s', repr(node), self.tagstack)
         tagdepth = 0
-        if node.nodeType == node.ELEMENT_NODE:
-            tag = node.tagName
-            if tag not in HANDLED_TAGS:
-                td = self.tagpush('bold')
-                self.add('<' + node.tagName + '>')
-                self.tagpop(td)
-            if tag in BLOCK_TAGS:
-                self.log.debug('block tag open linebreak')
-                self.linebreak()
-            if tag in LITERAL_TAGS:
-                self.fill = False
-            if tag in BOLD_TAGS:
-                tagdepth += self.tagpush('bold')
-            if tag in GREY_TAGS:  # PRE > GREY
-                tagdepth += self.tagpush('bg:#3d3d3d', span=self.fill)
-            if tag in ANCHOR_TAGS:
-                tagdepth += self.tagpush('fg:#6666ff', 'underline', span=True)
-            if tag in INDENT_TAGS:
-                self.indent += ' '
-
-        for child in node.childNodes:
+        tag = node.tag
+        if tag not in HANDLED_TAGS:
+            td = self.tagpush('bold')
+            self.add('<' + tag + '>')
+            self.tagpop(td)
+        if tag in BLOCK_TAGS:
+            self.log.debug('block tag open linebreak')
+            self.linebreak()
+        if tag in LITERAL_TAGS:
+            self.fill = False
+        if tag in BOLD_TAGS:
+            tagdepth += self.tagpush('bold')
+        if tag in GREY_TAGS:  # PRE > GREY
+            tagdepth += self.tagpush('bg:#3d3d3d', span=self.fill)
+        if tag in ANCHOR_TAGS:
+            tagdepth += self.tagpush('fg:#6666ff', 'underline', span=True)
+        if tag in INDENT_TAGS:
+            self.indent += ' '
+
+        if node.text:
+            self.add(node.text)
+        for child in node:
             self.log.debug('> child %s %s', repr(child), self.tagstack)
-            if child.nodeType == node.TEXT_NODE:
-                self.add(child.data)
-            else:
-                self.process(child)
+            self.process(child)
+            if child.tail:
+                self.add(child.tail)
             self.log.debug('< child %s %s', repr(child), self.tagstack)
 
-        if node.nodeType == node.ELEMENT_NODE:
-            if tag not in HANDLED_TAGS:
-                td = self.tagpush('bold')
-                self.add('</' + node.tagName + '>')
-                self.tagpop(td)
-            if tag in BLOCK_TAGS:
-                self.log.debug('block tag close linebreak')
-                self.linebreak()
-            if tag in LITERAL_TAGS:
-                self.fill = True
+        if tag not in HANDLED_TAGS:
+            td = self.tagpush('bold')
+            self.add('</' + tag + '>')
+            self.tagpop(td)
+        if tag in BLOCK_TAGS:
+            self.log.debug('block tag close linebreak')
+            self.linebreak()
+        if tag in LITERAL_TAGS:
+            self.fill = True
 
-            if tag in INDENT_TAGS:
-                self.indent = self.indent[:-1]
+        if tag in INDENT_TAGS:
+            self.indent = self.indent[:-1]
 
         self.log.debug('leaving - tagdepth %d %s', tagdepth, self.tagstack)
         self.tagpop(tagdepth)
@@ -448,10 +276,10 @@ class XHTMLRenderer(RSTRenderer):
 
 
 def xhtml_to_chunk(xhtml):
-    dom = xml.dom.minidom.parseString(
+    root = xml.etree.ElementTree.fromstring(
         '<html><body>' + xhtml + '</body></html>')
     renderer = XHTMLRenderer()
-    renderer.process(dom.documentElement)
+    renderer.process(root)
     out = chunks.Chunk()
     for mark, chunk in renderer.output:
         out.extend(chunk)
@@ -461,17 +289,47 @@ def xhtml_to_chunk(xhtml):
     return out
 
 
+_markdown = threading.local()
+
+
 def markdown_to_xhtml(s):
-    return markdown.markdown(
-        s, safe_mode='escape', extensions=[
-            SnipeFencedCodeExtension(),
-            'markdown.extensions.nl2br',
-            # 'markdown.extensions.tables',
-            ])
+    # Setting up a Markdown instance is expensive, but they're not
+    # reentrant (and QuoteHack recurses) so keep a stack of idle ones around
+    # for each thread.
+    idle = getattr(_markdown, 'idle', None)
+    if idle is None:
+        idle = _markdown.idle = []
+    if idle:
+        md = idle.pop()
+    else:
+        import markdown
+        md = markdown.Markdown(
+            safe_mode='escape', extensions=[
+                fenced_code_extension(),
+                'markdown.extensions.nl2br',
+                # 'markdown.extensions.tables',
+                ])
+    try:
+        md.reset()
+        return md.convert(s)
+    finally:
+        idle.append(md)
+
+
+MARKDOWN_CACHE = 1024
+_rendered = collections.OrderedDict()
 
 
 def markdown_to_chunk(s):
-    return xhtml_to_chunk(markdown_to_xhtml(s))
+    """Render markdown, remembering the results for recently seen text."""
+    chunk = _rendered.get(s)
+    if chunk is None:
+        chunk = _rendered[s] = xhtml_to_chunk(markdown_to_xhtml(s))
+        while len(_rendered) > MARKDOWN_CACHE:
+            _rendered.popitem(last=False)
+    else:
+        _rendered.move_to_end(s)
+    return chunks.Chunk(chunk)
 
 
 class QuoteHack:
@@ -485,14 +343,28 @@ class QuoteHack:
             '<blockquote>\n' + markdown_to_xhtml(content) + '\n</blockquote>')
 
 
-class SnipeFBP(markdown.extensions.fenced_code.FencedBlockPreprocessor):
-    CODE_WRAP = QuoteHack()
+_fenced_code = None
+
+
+def fenced_code_extension():
+    # markdown is only imported the first time something needs rendering,
+    # so the extension classes can't be defined until then
+    global _fenced_code
+    if _fenced_code is None:
+        import markdown
+        import markdown.extensions.fenced_code
+
+        class SnipeFBP(
+                markdown.extensions.fenced_code.FencedBlockPreprocessor):
+            CODE_WRAP = QuoteHack()
 
+        class SnipeFencedCodeExtension(markdown.Extension):
+            def extendMarkdown(self, md, md_globals):
+                md.registerExtension(self)
+                md.preprocessors.add(
+                    'fenced_code_block',
+                    SnipeFBP(md),
+                    ">normalize_whitespace")
 
-class SnipeFencedCodeExtension(markdown.Extension):
-    def extendMarkdown(self, md, md_globals):
-        md.registerExtension(self)
-        md.preprocessors.add(
-            'fenced_code_block',
-            SnipeFBP(md),
-            ">normalize_whitespace")
+        _fenced_code = SnipeFencedCodeExtension
+    return _fenced_code()
@@ -206,10 +206,10 @@ class TTYRenderer:
 
     def redisplay_calculate(self):
         self.log.debug(
-            'in redisplay_calculate: w=%d, h=%d, frame=%s',
+            'in redisplay_calculate: w=%d, h=%d, frame=%r',
             self.width,
             self.height,
-            repr(self.head),
+            self.head,
             )
 
         if self.window.cursor != self.old_cursor:
@@ -306,9 +306,9 @@ class TTYRenderer:
                 ((a ^ curses.A_REVERSE) | actbold, t) for (a, t) in output[y]]
 
         self.log.debug(
-            'redisplay_calculate exiting, cursor=%s, visible=%s',
-            repr(cursor),
-            repr(visible),
+            'redisplay_calculate exiting, cursor=%r, visible=%r',
+            cursor,
+            visible,
             )
         return (
             visible is not None and visible < self.height,
@@ -318,10 +318,10 @@ class TTYRenderer:
 
     def redisplay_internal(self):
         self.log.debug(
-            'in redisplay_internal: w=%d, h=%d, frame=%s',
+            'in redisplay_internal: w=%d, h=%d, frame=%r',
             self.width,
             self.height,
-            repr(self.head),
+            self.head,
             )
 
         if self.window.cursor != self.old_cursor:
@@ -331,14 +331,15 @@ class TTYRenderer:
         self.w.erase()
 
         visible, self.cursorpos, self.sill, output = self.redisplay_calculate()
-        import pprint
-        self.log.debug(
-            'redisplay_internal: %s, %s, %s %d\n%s',
-            visible,
-            self.cursorpos,
-            self.sill,
-            len(output),
-            pprint.pformat(output))
+        if self.log.isEnabledFor(logging.DEBUG):
+            import pprint
+            self.log.debug(
+                'redisplay_internal: %s, %s, %s %d\n%s',
+                visible,
+                self.cursorpos,
+                self.sill,
+                len(output),
+                pprint.pformat(output))
         for y, line in enumerate(output):
             self.move(y, 0)
             x = 0
@@ -351,8 +352,8 @@ class TTYRenderer:
                     self.w.addstr(y, x, text, attr)
                 except curses.error:
                     self.log.debug(
-                        'addstr(%d, %d, %s, %d) errored.  *yawn*',
-                        y, x, repr(text), attr)
+                        'addstr(%d, %d, %r, %d) errored.  *yawn*',
+                        y, x, text, attr)
                 x += util.glyphwidth(text)
             else:
                 if line != '\n':
@@ -360,9 +361,9 @@ class TTYRenderer:
             self.bkgdset(0)
 
         self.log.debug(
-            'redisplay_internal exiting, cursor=%s, visible=%s',
-            repr(self.cursorpos),
-            repr(visible),
+            'redisplay_internal exiting, cursor=%r, visible=%r',
+            self.cursorpos,
+            visible,
             )
         return visible
 
@@ -393,12 +394,13 @@ class TTYRenderer:
 
     def makefunc(name):
         def _(self, *args):
-            import inspect
-            self.curses_log.debug(
-                '%d:%s%s',
-                inspect.currentframe().f_back.f_lineno,
-                name,
-                repr(args))
+            if self.curses_log.isEnabledFor(logging.DEBUG):
+                import inspect
+                self.curses_log.debug(
+                    '%d:%s%s',
+                    inspect.currentframe().f_back.f_lineno,
+                    name,
+                    repr(args))
             try:
                 return getattr(self.w, name)(*args)
             except Exception:
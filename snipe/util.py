@@ -36,6 +36,8 @@ Assorted utility functions.
 
 
 import asyncio
+import codecs
+import collections
 import contextlib
 import ctypes
 import datetime
@@ -45,14 +47,13 @@ import functools
 import logging
 import math
 import os
+import re
 import sys
 import time
 import unicodedata
 import unittest.mock as mock
 import urllib.parse
 
-import aiohttp
-
 
 class SnipeException(Exception):
     pass
@@ -60,6 +61,7 @@ class SnipeException(Exception):
 
 class Configurable:
     registry = {}
+    overrides = {}  # for keys whose modules haven't been imported yet
 
     def __init__(
             self, key,
@@ -78,6 +80,8 @@ class Configurable:
         self.override = None
         self.doc = doc
         self.registry[key] = self
+        if key in self.overrides:
+            self.set_override(self.overrides.pop(key))
 
     def __get__(self, instance, owner):
         if not instance:
@@ -122,9 +126,11 @@ class Configurable:
         return str(value)
 
     @classmethod
-    def immanentize(self, context):
-        for configurable in self.registry.values():
-            configurable.action(context, configurable.__get__(context, self))
+    def immanentize(self, context, keys=None):
+        for key, configurable in list(self.registry.items()):
+            if keys is None or key in keys:
+                configurable.action(
+                    context, configurable.__get__(context, self))
 
     @classmethod
     def set(self, instance, key, value):
@@ -139,7 +145,10 @@ class Configurable:
     @classmethod
     def set_overrides(self, overrides):
         for k, v in overrides.items():
-            self.registry[k].set_override(v)
+            if k in self.registry:
+                self.registry[k].set_override(v)
+            else:
+                self.overrides[k] = v
 
 
 def coerce_bool(x):
@@ -190,6 +199,7 @@ for userspace_name, program_name in [
         ('log.backend.startup', 'StartupBackend'),
         ('log.filter', 'filter'),
         ('log.websocket', 'WebSocket'),
+        ('log.zcode', 'zcode'),
         ]:
     Level(
         userspace_name,
@@ -243,8 +253,12 @@ Welcome to snipe.
   snipe is free/open source software.  Type ? L for relevant lawyerese.
 '''
 
-USER_AGENT = 'snipe 0 (development) (python %s) (aiohttp %s)' % (
-    sys.version.split('\n')[0].strip(), aiohttp.__version__)
+
+def user_agent():
+    # aiohttp is only imported once something wants to talk HTTP
+    import aiohttp
+    return 'snipe 0 (development) (python %s) (aiohttp %s)' % (
+        sys.version.split('\n')[0].strip(), aiohttp.__version__)
 
 
 def coro_cleanup(f):
@@ -320,22 +334,300 @@ class JSONDecodeError(SnipeException):
         return str(self.data)
 
 
+def _json_stdlib_loads(data):
+    # the stdlib only takes bytes from 3.6 on
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _json_codec():
+    # prefer a faster implementation if one is installed; these all take
+    # str or bytes and raise ValueError subclasses on bad input
+    for name in ('orjson', 'ujson'):
+        try:
+            return name, importlib.import_module(name).loads
+        except ImportError:
+            pass
+    return 'json', _json_stdlib_loads
+
+
+JSON_CODEC, json_loads = _json_codec()
+JSON_THREAD_THRESHOLD = 65536  # decode documents bigger than this off-loop
+json_stats = {'loop': 0, 'thread': 0, 'bytes': 0}
+
+
+@asyncio.coroutine
+def json_decode(data, threshold=None):
+    """Decode a JSON document (str or bytes), in the default executor if it's
+    bigger than threshold (default JSON_THREAD_THRESHOLD)."""
+
+    if threshold is None:
+        threshold = JSON_THREAD_THRESHOLD
+    json_stats['bytes'] += len(data)
+    if len(data) > threshold:
+        json_stats['thread'] += 1
+        loop = asyncio.get_event_loop()
+        return (yield from loop.run_in_executor(None, json_loads, data))
+    json_stats['loop'] += 1
+    return json_loads(data)
+
+
+def json_report():
+    return 'json codec %s, off-loop above %d bytes: %d on loop, ' \
+        '%d in threads, %d bytes\n' % (
+            JSON_CODEC, JSON_THREAD_THRESHOLD,
+            json_stats['loop'], json_stats['thread'], json_stats['bytes'])
+
+
+class JSONArrayDecoder:
+    """Incrementally decode a (utf-8 encoded) JSON array, handing back its
+    elements as they become complete.  Feed it an empty string at the end.
+
+    Elements are only decoded once their end has been seen, so a big one
+    that arrives in many pieces is scanned just once, and a number split
+    across pieces isn't mistaken for a shorter one."""
+
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+    IN_STRING = re.compile(r'["\\]')
+    OUTSIDE = re.compile(r'["\[\]{},\s]')
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.incremental = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.state = 'start'
+        self.reset_scan()
+
+    def reset_scan(self):
+        self.scanned = None  # how far into buf the element has been scanned
+        self.depth = 0
+        self.instring = False
+
+    def scan(self, buf, pos):
+        """Return where the element starting at pos ends, or None if that
+        hasn't arrived yet."""
+        i = pos if self.scanned is None else self.scanned
+        while True:
+            if self.instring:
+                m = self.IN_STRING.search(buf, i)
+                if m is None:
+                    i = len(buf)
+                    break
+                i = m.end()
+                if m.group() == '\\':
+                    if i == len(buf):
+                        i -= 1  # the escaped character hasn't arrived
+                        break
+                    i += 1
+                    continue
+                self.instring = False
+                if self.depth == 0:
+                    return i
+                continue
+            m = self.OUTSIDE.search(buf, i)
+            if m is None:
+                i = len(buf)
+                break
+            c = m.group()
+            if c == '"':
+                self.instring = True
+            elif c in '[{':
+                self.depth += 1
+            elif c in ']}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    return m.end()
+            elif self.depth == 0:
+                # the end of a number or a bare word, or a stray ] or ,
+                return m.start()
+            i = m.end()
+        self.scanned = i
+        return None
+
+    def feed(self, data):
+        final = not data
+        buf = self.buf + self.incremental.decode(data, final)
+        pos = 0
+        items = []
+        while True:
+            pos = self.WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if self.state == 'start':
+                if buf[pos] != '[':
+                    raise JSONDecodeError(buf[pos:pos + 80])
+                pos += 1
+                self.state = 'first'
+            elif self.state == 'first' and buf[pos] == ']':
+                pos += 1
+                self.state = 'done'
+            elif self.state in ('first', 'element'):
+                end = self.scan(buf, pos)
+                if end is None:
+                    if not final:
+                        # wait for the rest of it, remembering how far we got
+                        self.scanned -= pos
+                        break
+                    end = len(buf)
+                self.reset_scan()
+                try:
+                    item, decoded = self.decoder.raw_decode(buf, pos)
+                except ValueError as e:
+                    raise JSONDecodeError(buf[pos:pos + 80]) from e
+                if decoded != end:
+                    raise JSONDecodeError(buf[pos:pos + 80])
+                items.append(item)
+                pos = end
+                self.state = 'separator'
+            elif self.state == 'separator' and buf[pos] in ',]':
+                self.state = 'element' if buf[pos] == ',' else 'done'
+                pos += 1
+            else:
+                raise JSONDecodeError(buf[pos:pos + 80])
+        self.buf = buf[pos:]
+        if final and self.state != 'done':
+            raise JSONDecodeError('truncated JSON array')
+        return items
+
+
+class HTTPPool:
+    """One keep-alive connection pool shared by everything that talks
+    HTTP, so that connections (and their TLS state) outlive any particular
+    backend or websocket.  Limits the number of connections per host and
+    keeps per-host request and latency counters.
+
+    Since everything shares it, it doesn't keep cookies; anything that
+    needs one (irccloud's session) sends it explicitly."""
+
+    PER_HOST = 8
+    KEEPALIVE = 60
+
+    def __init__(self, per_host=PER_HOST, keepalive=KEEPALIVE):
+        self.per_host = per_host
+        self.keepalive = keepalive
+        self._session = None
+        self.stats = collections.defaultdict(lambda: {
+            'requests': 0,
+            'errors': 0,
+            'websockets': 0,
+            'active': 0,
+            'time': 0.0,
+            'max': 0.0,
+            })
+
+    @property
+    def session(self):
+        # created on first use so that it happens with the loop running
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                cookie_jar=aiohttp.DummyCookieJar(),
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=self.per_host,
+                    keepalive_timeout=self.keepalive))
+        return self._session
+
+    @staticmethod
+    def host(url):
+        return urllib.parse.urlsplit(str(url)).netloc
+
+    @asyncio.coroutine
+    def request(self, method, url, **kw):
+        """Make a request, counting it against the host.  The caller is
+        responsible for releasing the response."""
+
+        stats = self.stats[self.host(url)]
+        stats['active'] += 1
+        start = time.monotonic()
+        try:
+            return (yield from self.session.request(method, url, **kw))
+        except Exception:
+            stats['errors'] += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            stats['active'] -= 1
+            stats['requests'] += 1
+            stats['time'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+
+    @asyncio.coroutine
+    def ws_connect(self, url, **kw):
+        self.stats[self.host(url)]['websockets'] += 1
+        return (yield from self.session.ws_connect(url, **kw))
+
+    def report(self):
+        lines = ['%-32s %8s %6s %4s %4s %8s %8s' % (
+            'host', 'requests', 'errors', 'ws', 'act', 'avg ms', 'max ms')]
+        for host, stats in sorted(self.stats.items()):
+            lines.append('%-32s %8d %6d %4d %4d %8.1f %8.1f' % (
+                host,
+                stats['requests'],
+                stats['errors'],
+                stats['websockets'],
+                stats['active'],
+                1000 * stats['time'] / max(1, stats['requests']),
+                1000 * stats['max'],
+                ))
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+_http_pool = None
+
+
+def http_pool():
+    global _http_pool
+    if _http_pool is None:
+        _http_pool = HTTPPool()
+    return _http_pool
+
+
+class HTTPClient:
+    """A borrower's handle on an HTTPPool, supplying its default headers
+    (and other request arguments, e.g. auth) to every request."""
+
+    def __init__(self, pool, headers=None, **kw):
+        self.pool = pool
+        self.headers = headers if headers is not None else {}
+        self.defaults = kw
+
+    def request(self, method, url, **kw):
+        headers = dict(self.headers)
+        headers.update(kw.pop('headers', None) or {})
+        for key, value in self.defaults.items():
+            kw.setdefault(key, value)
+        return self.pool.request(method, url, headers=headers, **kw)
+
+    def get(self, url, **kw):
+        return self.request('GET', url, **kw)
+
+    def post(self, url, **kw):
+        return self.request('POST', url, **kw)
+
+    def patch(self, url, **kw):
+        return self.request('PATCH', url, **kw)
+
+
 class HTTP_JSONmixin:
     # object must have a .log attribute
     def setup_client_session(self, headers=None, **kw):
         if headers is None:
             headers = {}
-        headers['User-Agent'] = USER_AGENT
-        if getattr(self, '_clientsession', None) is not None:
-            self._clientsession.close()
-        self._clientsession = aiohttp.ClientSession(headers=headers, **kw)
+        headers['User-Agent'] = user_agent()
+        self._clientsession = HTTPClient(http_pool(), headers, **kw)
 
     @asyncio.coroutine
     def _result(self, response):
         try:
-            result = yield from response.json()
-        except (UnicodeError, ValueError) as e:
             data = yield from response.read()
+            result = yield from json_decode(data)
+        except (UnicodeError, ValueError) as e:
             self.log.error(
                 'json %s from %s on %s',
                 e.__class__.__name__, response.url, repr(data))
@@ -386,17 +678,11 @@ class HTTP_JSONmixin:
         response = yield from self._clientsession.request(method, url, **kw)
         return (yield from self._result(response))
 
-    @asyncio.coroutine
-    def shutdown(self):
-        yield from super().shutdown()
-        self._clientsession.close()
-
 
 class JSONWebSocket:
     def __init__(self, log):
         self.resp = None
         self.log = log
-        self.session = aiohttp.ClientSession()
 
     def __enter__(self):
         return self
@@ -408,25 +694,29 @@ class JSONWebSocket:
                 self.log.error('closing internal response object')
                 self.resp._response.close()
             self.resp = None
-        self.session.close()
         return False
 
     @asyncio.coroutine
     def connect(self, url, headers=None):
         if headers is None:
             headers = {}
-        headers['User-Agent'] = USER_AGENT
+        headers['User-Agent'] = user_agent()
         self.log.debug('connecting to %s', url)
-        self.resp = yield from self.session.ws_connect(url, headers=headers)
+        self.resp = yield from http_pool().ws_connect(url, headers=headers)
 
         return self.resp
 
+    @property
+    def closed(self):
+        return self.resp is None or self.resp.closed
+
     def write(self, data):
         return self.resp.send_json(data)
 
     @asyncio.coroutine
     def read(self):
-        return (yield from self.resp.receive_json())
+        data = yield from self.resp.receive_str()
+        return (yield from json_decode(data))
 
 
 @contextlib.contextmanager
@@ -451,6 +741,80 @@ def safe_write(path, mode=0o600):
     os.rename(tmp, path)
 
 
+class TokenBucket:
+    """Rate limiter that allows bursts of up to burst events, refilling at
+    rate events per second."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.stamp = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    @asyncio.coroutine
+    def take(self):
+        """Wait until a token is available, and take it."""
+        self.refill()
+        while self.tokens < 1:
+            yield from asyncio.sleep((1 - self.tokens) / self.rate)
+            self.refill()
+        self.tokens -= 1
+
+
+FILE_CHUNK = 65536
+
+
+@asyncio.coroutine
+def read_file(filename, callback, chunksize=FILE_CHUNK):
+    """Read a text file a chunk at a time in the default executor, calling
+    callback(chunk) on the event loop as each one arrives, so that big
+    files don't lock up everything else."""
+
+    loop = asyncio.get_event_loop()
+    fp = yield from loop.run_in_executor(None, open, filename)
+    try:
+        while True:
+            data = yield from loop.run_in_executor(None, fp.read, chunksize)
+            if not data:
+                break
+            callback(data)
+    finally:
+        fp.close()
+
+
+@asyncio.coroutine
+def write_file(filename, iterable, chunksize=FILE_CHUNK):
+    """Write the strings from iterable to a file, batching them up and doing
+    the writes in the default executor.  The iterable is consumed on the
+    event loop."""
+
+    loop = asyncio.get_event_loop()
+    fp = yield from loop.run_in_executor(
+        None, functools.partial(open, filename, 'w'))
+    try:
+        batch = []
+        size = 0
+        for string in iterable:
+            batch.append(string)
+            size += len(string)
+            if size >= chunksize:
+                yield from loop.run_in_executor(
+                    None, fp.write, ''.join(batch))
+                batch = []
+                size = 0
+        if batch:
+            yield from loop.run_in_executor(None, fp.write, ''.join(batch))
+    finally:
+        yield from loop.run_in_executor(None, fp.close)
+
+
 def eval_output(string, environment=None, mode='single'):
     import code
     import io
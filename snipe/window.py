@@ -452,6 +452,13 @@ class Window:
 
         self.fe.switch_window(1)
 
+    @keymap.bind('Control-X H')
+    def show_http_stats(self):
+        """Show per-host request counts and latencies for the shared HTTP
+        connection pool, and which JSON codec is decoding the responses."""
+
+        self.show(util.http_pool().report() + '\n' + util.json_report())
+
     @keymap.bind('Control-X e')  # XXX
     def split_to_editor(self):
         """Split to a new editor window."""
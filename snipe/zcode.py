@@ -76,8 +76,10 @@ def tree(s):
     saved = ''
     out = ['', '']
     cur = out
+    debug = log.isEnabledFor(logging.DEBUG)  # this is per character
     for c in list(s) + ['']:
-        log.debug('processing %s in state %s', repr(c), state)
+        if debug:
+            log.debug('processing %r in state %s', c, state)
         for action in machine[state][c]:
             if action[0] == '>':
                 state = action[1:]
@@ -107,7 +109,8 @@ def tree(s):
             else:
                 raise AssertionError(
                     'unknown action in state table')  # pragma: nocover
-            log.debug(' %s %s %s %s', action, out, repr(saved), cur)
+            if debug:
+                log.debug(' %s %s %r %s', action, out, saved, cur)
     return out
 
 
@@ -102,6 +102,11 @@ class Zulip(messages.SnipeBackend, util.HTTP_JSONmixin):
         'log.zulip', 'Zulip',
         doc='loglevel for zulip backend')
 
+    NUDGE = .0001  # to keep message times unique
+    RETRY = 5  # seconds to wait after an error talking to the server
+    CATCH_UP = 1024  # messages per request when catching up
+    NEWEST = 'newest'  # anchor for the most recent messages
+
     def __init__(self, context, url='https://chat.zulip.org', **kw):
         super().__init__(context, **kw)
         self.url = url.rstrip('/') + '/api/v1/'
@@ -121,77 +126,183 @@ class Zulip(messages.SnipeBackend, util.HTTP_JSONmixin):
             auth=aiohttp.BasicAuth(self.user, self.token))
 
     def start(self):
+        self.resume_load()
         self.tasks.append(asyncio.Task(self.connect()))
         self.tasks.append(asyncio.Task(self.presence_beacon()))
 
     @util.coro_cleanup
     def connect(self):
+        poll = None
         try:
             self.params = None
             while True:
-                if self.params is None:
-                    self.log.debug('registering')
-                    params = yield from self._post('register')
-
-                    # TODO check for an error, backoff, etc.
-                    self.params = params
-
-                    queue_id = params['queue_id']
-                    last_event_id = params['last_event_id']
-
-                    self._senders |= set(
-                        '; '.join((self.name, x['email']))
-                        for x in params['realm_users'])
-
-                    self._destinations |= self._senders
-                    self._destinations |= set(
-                        '; '.join((self.name, x['name'], ''))
-                        for x in params['streams'])
-                    self.connected.set()
-
-                self.log.debug(
-                    'getting events, queue_id=%s, last_event_id=%s',
-                    queue_id, last_event_id)
-
-                result = yield from self._get(
-                    'events', queue_id=queue_id, last_event_id=last_event_id)
-
-                # TODO check for error and maybe invalidate params?
-
-                msgs = []
-
-                for event in result['events']:
-                    try:
-                        msg, last_event_id = (
-                            yield from self.process_event(
-                                event, last_event_id))
-                    except:
-                        self.log.exception(
-                            'processing event: %s', pprint.pformat(event))
-                    if msg is not None:
-                        msgs.append(msg)
-
-                if msgs:
-                    self.messages.extend(msgs)
-                    self.drop_cache()
-                    # make sure that the message list remains
-                    # monotonically increasing by comparing the new
-                    # messages (and the last old message) pairwise.
-                    self.readjust(self.messages[-len(msgs) - 1:])
-                    self.redisplay(msgs[0], msgs[-1])
+                try:
+                    if self.params is None:
+                        self.log.debug('registering')
+                        params = yield from self._post('register')
+
+                        # TODO check for an error, backoff, etc.
+                        self.params = params
+
+                        queue_id = params['queue_id']
+                        last_event_id = params['last_event_id']
+
+                        self._senders |= set(
+                            '; '.join((self.name, x['email']))
+                            for x in params['realm_users'])
+
+                        self._destinations |= self._senders
+                        self._destinations |= set(
+                            '; '.join((self.name, x['name'], ''))
+                            for x in params['streams'])
+                        self.connected.set()
+
+                        # pick up whatever arrived while we didn't have a queue
+                        # (in this session or since the last one)
+                        yield from self.catch_up()
+
+                    if poll is None:
+                        poll = asyncio.Task(
+                            self.get_events(queue_id, last_event_id))
+                    result = yield from poll
+                    poll = None
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.log.exception('talking to zulip')
+                    if poll is None:
+                        # didn't get as far as the poll; register again
+                        self.params = None
+                    elif poll.done():
+                        poll = None
+                    yield from asyncio.sleep(self.RETRY)
+                    continue
+
+                if result.get('result') != 'success':
+                    if result.get('code') == 'BAD_EVENT_QUEUE_ID':
+                        self.log.info('event queue %s went away', queue_id)
+                        self.params = None
+                    else:
+                        self.log.error(
+                            'getting events: %s', pprint.pformat(result))
+                        yield from asyncio.sleep(self.RETRY)
+                    continue
+
+                events = result['events']
+                last_event_id = max(
+                    [last_event_id] + [event['id'] for event in events])
+
+                # get the next long poll going before we deal with these
+                poll = asyncio.Task(self.get_events(queue_id, last_event_id))
+
+                yield from self.ingest(events)
         except asyncio.CancelledError:
             pass
         finally:
+            if poll is not None:
+                poll.cancel()
             self.connected.clear()
 
         self.log.debug('connect ends')
 
+    @asyncio.coroutine
+    def get_events(self, queue_id, last_event_id):
+        self.log.debug(
+            'getting events, queue_id=%s, last_event_id=%s',
+            queue_id, last_event_id)
+        return (yield from self._get(
+            'events', queue_id=queue_id, last_event_id=last_event_id))
+
+    @asyncio.coroutine
+    def ingest(self, events):
+        msgs = []
+        last_event_id = -1
+        for event in events:
+            try:
+                msg, last_event_id = (
+                    yield from self.process_event(event, last_event_id))
+            except:
+                self.log.exception(
+                    'processing event: %s', pprint.pformat(event))
+                continue
+            if msg is not None:
+                msgs.append(msg)
+        self.add_messages(msgs)
+
+    def add_messages(self, msgs):
+        if msgs:
+            messages.order_after(
+                msgs, self.messages[-1] if self.messages else None,
+                self.NUDGE)
+            self.messages.extend(msgs)
+            self.drop_cache()
+            self.redisplay(msgs[0], msgs[-1])
+            self.resume_set('id', msgs[-1].data['id'])
+
+    @asyncio.coroutine
+    def catch_up(self):
+        """Fetch messages newer than the last one we have, or than the last
+        one we saw last time.
+
+        What's in memory has to stay contiguous, so that pages forward
+        until it has everything.  With nothing in memory, if more than a
+        page was missed, it just starts from the newest page and leaves
+        the rest to backfill."""
+        if self.messages:
+            anchor = self.messages[-1].data['id']
+        elif self.backfilling:
+            return  # already fetching the newest messages
+        else:
+            anchor = (self.resume or {}).get('id')
+        if anchor is None:
+            return
+        empty = not self.messages
+        if empty:
+            # don't let backfill start from the top at the same time
+            self.backfilling = True
+        try:
+            while True:
+                result = yield from self._get(
+                    'messages', num_before=0, num_after=self.CATCH_UP,
+                    anchor=anchor, apply_markdown='false')
+                if result.get('result') != 'success':
+                    self.log.error('catching up: %s', pprint.pformat(result))
+                    return
+                msgs = result['messages']
+                # (the anchor comes back too, if it's still there)
+                done = result.get('found_newest', len(
+                    [m for m in msgs if m['id'] > anchor]) < self.CATCH_UP)
+                if empty and not done:
+                    self.log.info(
+                        'more than %d messages since %s; starting from the'
+                        ' newest', self.CATCH_UP, anchor)
+                    result = yield from self._get(
+                        'messages', num_before=self.CATCH_UP, num_after=0,
+                        anchor=self.NEWEST, apply_markdown='false')
+                    if result.get('result') != 'success':
+                        self.log.error(
+                            'catching up: %s', pprint.pformat(result))
+                        return
+                    msgs, done = result['messages'], True
+                self.add_messages([
+                    ZulipMessage(self, m) for m in msgs
+                    if m['id'] not in self.messages_by_id])
+                if done or not msgs:
+                    return
+                anchor = msgs[-1]['id']
+        finally:
+            if empty:
+                self.backfilling = False
+
     @asyncio.coroutine
     def process_event(self, event, last_event_id):
         type_ = event.get('type')
         msg = None
         if type_ == 'message':
-            msg = ZulipMessage(self, event['message'])
+            if event['message']['id'] in self.messages_by_id:
+                self.log.debug('duplicate message %s', event['message']['id'])
+            else:
+                msg = ZulipMessage(self, event['message'])
         elif type_ == 'update_message':
             self.log.debug('update_message event: %s', pprint.pformat(event))
             for mid in event.get('message_ids', [event['message_id']]):
@@ -223,12 +334,6 @@ class Zulip(messages.SnipeBackend, util.HTTP_JSONmixin):
                 pass
             yield from asyncio.sleep(60)
 
-    @staticmethod
-    def readjust(msgs):
-        for a, b in zip(msgs[:-1], msgs[1:]):
-            if b.time <= a.time:
-                b.time = a.time + .0001
-
     def backfill(self, mfilter, target=None):
         self.log.debug(
             'backfill(mfilter=%s, target=%s)',
@@ -246,24 +351,23 @@ class Zulip(messages.SnipeBackend, util.HTTP_JSONmixin):
             if self.messages:
                 anchor = self.messages[0].data['id']
             else:
-                anchor = 1000000000  # XXX
+                anchor = self.NEWEST
             result = yield from self._get(
                 'messages', num_before=1024, num_after=0, anchor=anchor,
                 apply_markdown='false')
             if result.get('result') != 'success':
                 self.log.error('backfilling: %s', pprint.pformat(result))
                 return
-            msgs = [ZulipMessage(self, m) for m in result['messages']]
-            self.log.debug('got %d: %s', len(msgs),  pprint.pformat(msgs[-1]))
-            if msgs and self.messages:
-                self.log.debug('had %s', pprint.pformat(self.messages[0]))
-                if msgs[-1].data['id'] == self.messages[0].data['id']:
-                    del msgs[-1]
-                if not msgs:
-                    self.log.debug('loaded')
-                    self.loaded = True
-            self.messages = msgs + self.messages
-            self.readjust(self.messages)
+            msgs = [
+                ZulipMessage(self, m) for m in result['messages']
+                if m['id'] not in self.messages_by_id]
+            self.log.debug('got %d', len(msgs))
+            if not msgs and self.messages:
+                self.log.debug('loaded')
+                self.loaded = True
+            messages.order_before(
+                msgs, self.messages[0] if self.messages else None, self.NUDGE)
+            self.messages[:0] = msgs
             self.drop_cache()
         except asyncio.CancelledError:
             pass
@@ -439,12 +543,10 @@ class ZulipMessage(messages.SnipeMessage):
 
         @classmethod
         def format(self, msg, tags=set()):
-            if '_html' not in msg.data:
+            if '_rendered' not in msg.data:
                 body = msg.data.get('content', '')
                 body = body.replace('\r\n', '\n')  # conform to local custom
-                msg.data['_html'] = text.markdown_to_xhtml(body)
-            if '_rendered' not in msg.data:
-                msg.data['_rendered'] = text.xhtml_to_chunk(msg.data['_html'])
+                msg.data['_rendered'] = text.markdown_to_chunk(body)
             # XXX what if there is color in the rendered data
             return chunks.Chunk(
                 (tags | set(x), y) for (x, y) in msg.data['_rendered'])
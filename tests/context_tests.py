@@ -33,6 +33,7 @@ Unit tests for context code
 '''
 
 import os
+import asyncio
 import logging
 import sys
 import unittest
@@ -60,11 +61,63 @@ class TestContext(unittest.TestCase):
                 os.path.exists(os.path.join(tmp_path, '.snipe', 'config')))
 
             d = context.Context(home=tmp_path)
+            d.load()
             with self.assertLogs('Snipe', logging.ERROR):
-                d.load()
+                d.loadbackends()
 
             self.assertEqual(c.backend_spec, d.backend_spec)
 
+            # backends are added (and their modules imported) later
+            d.backend_spec = '.zulip; .smeerp'
+            self.assertEqual(len(d.backends.backends), 4)
+            with self.assertLogs('Snipe', logging.ERROR):
+                asyncio.get_event_loop().run_until_complete(
+                    d.start_backends())
+            self.assertEqual(
+                [b.name for b in d.backends.backends[4:]], ['zulip'])
+
+
+class TestSnipeLogHandler(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            handler = context.SnipeLogHandler(logging.DEBUG)
+            handler.context = context.Context(home=tmp_path)
+            handler.filename = os.path.join(tmp_path, 'log')
+            handler.unformatted = 3
+            log = logging.getLogger('TestSnipeLogHandler')
+            log.propagate = False
+            log.setLevel(logging.DEBUG)
+            log.addHandler(handler)
+            try:
+                x = ['before']
+                log.debug('x is %s', x)
+                log.debug('y')
+                try:
+                    raise ValueError('oops')
+                except ValueError:
+                    log.exception('caught')
+                log.debug('%d', 'not a number')
+                x[0] = 'after'
+            finally:
+                log.removeHandler(handler)
+
+            # the newest are kept as records, formatted only when they
+            # age out or are written out
+            self.assertEqual(len(handler.buffer), 1)
+            self.assertIn("x is ['before']", handler.buffer[0])
+            self.assertEqual(len(handler.records), 3)
+            self.assertIsInstance(handler.records[0], logging.LogRecord)
+            self.assertIsNone(handler.records[1].exc_info)
+
+            handler.dump()
+            self.assertFalse(handler.buffer)
+            self.assertFalse(handler.records)
+            with open(handler.filename) as fp:
+                text = fp.read()
+            self.assertIn("x is ['before']", text)
+            self.assertIn('ValueError: oops', text)
+            self.assertIn("unformattable '%d' ('not a number',)", text)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -35,10 +35,14 @@ Unit tests for the Editor object
 
 
 import array
+import asyncio
 import itertools
+import os
 import random
 import sys
+import tempfile
 import unittest
+import unittest.mock
 
 import mocks
 
@@ -228,6 +232,42 @@ class TestEditor(unittest.TestCase):
                 ((), 'hi'),
             ])])
 
+    def test_view_many_control(self):
+        e = snipe.editor.Editor(None)
+        e.insert('\033[1ma\033[0m' * 3)
+        e.cursor.point = 5
+        self.assertEqual(
+            [(int(m), l.tagsets()) for (m, l) in e.view(0, 'forward')],
+            [(0, [
+                (e.SHOW_CONTROL, '^['),
+                ((), '[1ma'),
+                (e.SHOW_CONTROL | {'cursor', 'visible'}, '^['),
+                ((), '[0m'),
+                (e.SHOW_CONTROL, '^['),
+                ((), '[1ma'),
+                (e.SHOW_CONTROL, '^['),
+                ((), '[0m'),
+                (e.SHOW_CONTROL, '^['),
+                ((), '[1ma'),
+                (e.SHOW_CONTROL, '^['),
+                ((), '[0m'),
+            ])])
+
+    def test_view_decoration_cache(self):
+        e = snipe.editor.Editor(None)
+        e.insert('abc\ndef')
+        first = [(int(m), l.tagsets()) for (m, l) in e.view(0, 'forward')]
+        self.assertEqual(len(e.decorations), 2)
+        # the cached chunk isn't handed out, so mangling the result is safe
+        for _, chunk in e.view(0, 'forward'):
+            chunk[-1] = ((), '')
+        self.assertEqual(
+            [(int(m), l.tagsets()) for (m, l) in e.view(0, 'forward')], first)
+        self.assertEqual(len(e.decorations), 2)
+        e.search_term = 'e'
+        list(e.view(0, 'forward'))
+        self.assertEqual(len(e.decorations), 4)
+
     def test_view_explode_combining(self):
         e = snipe.editor.Editor(None)
         e.insert('aa\N{COMBINING DIAERESIS}\N{COMBINING CEDILLA}a')
@@ -441,6 +481,46 @@ class TestEditor(unittest.TestCase):
         w.find('abc', False)
         self.assertEqual(w.cursor.point, 0)
 
+    def test_insert_file(self):
+        e = snipe.editor.Editor(mocks.FE())
+        e.insert('[]')
+        e.move(-1)
+        e.INSERT_REDISPLAY = 0
+        with tempfile.TemporaryDirectory() as directory:
+            pathname = os.path.join(directory, 'file')
+            with open(pathname, 'w') as fp:
+                fp.write('x' * 100000)
+
+            @asyncio.coroutine
+            def read_filename(*args, **kw):
+                return pathname
+
+            e.read_filename = read_filename
+            asyncio.get_event_loop().run_until_complete(
+                asyncio.coroutine(e.insert_file)())
+        self.assertEqual(str(e.buf), '[' + 'x' * 100000 + ']')
+        self.assertEqual(e.cursor.point, 100001)
+        self.assertIn('redisplay', e.fe.called)
+
+        # if the cursor wanders off, the rest still goes in at the end of
+        # what's been inserted so far
+        e = snipe.editor.Editor(mocks.FE())
+        e.insert('[]')
+        e.move(-1)
+
+        @asyncio.coroutine
+        def read_file(filename, callback):
+            callback('ab')
+            e.cursor.point = 0
+            callback('cd')
+
+        e.read_filename = read_filename
+        with unittest.mock.patch('snipe.util.read_file', read_file):
+            asyncio.get_event_loop().run_until_complete(
+                asyncio.coroutine(e.insert_file)())
+        self.assertEqual(str(e.buf), '[abcd]')
+        self.assertEqual(e.cursor.point, 0)
+
 
 class TestBuffer(unittest.TestCase):
     def testRegister(self):
@@ -514,8 +594,11 @@ class TestBuffer(unittest.TestCase):
         TEXT = 'abcdef'
         m.insert(TEXT)
         self.assertEqual(b[:], TEXT)
-        b.undo(None)
+        b.undo()
         self.assertEqual(b[:], '')
+        b.redo()
+        self.assertEqual(b[:], TEXT)
+        self.assertEqual(b.undo_usage(), (1, 1))
 
 
 class TestView(unittest.TestCase):
@@ -37,6 +37,7 @@ Unit tests for various filter-related things
 import re
 import sys
 import unittest
+import unittest.mock
 
 import mocks
 
@@ -53,6 +54,8 @@ from snipe.filters import (
 class TestFilters(unittest.TestCase):
     def testLexer(self):
         lexer = Lexer()
+        # the token regexps all fit in one master regexp
+        self.assertEqual(len(lexer.lexer.lexre), 1)
         self.assertEqual(
             list(lexeme.type for lexeme in lexer.test(
                 '= == != < <= > >= 17')),
@@ -77,6 +80,14 @@ class TestFilters(unittest.TestCase):
             next(snipe.filters.lexer.test(r'"foo\\\"bar"')).value,
             'foo\\"bar')
 
+    def test_parsetab(self):
+        # if the grammar changed without a `make parsetab`, ply would
+        # quietly rebuild the tables from scratch instead of loading them
+        with unittest.mock.patch(
+                'ply.yacc.LRGeneratedTable', side_effect=AssertionError(
+                    'snipe/_filter_parsetab.py is stale')):
+            Parser()
+
     def testParser(self):
         snipe.filters.parser = Parser(debug=True)
         self.assertEqual(
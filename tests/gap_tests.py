@@ -157,24 +157,108 @@ class TestGapBuffer(unittest.TestCase):
         self.assertEqual(repr(g), '<GapBuffer size=0:%d 0-%d>' % (
             snipe.gap.GapBuffer.CHUNKSIZE, snipe.gap.GapBuffer.CHUNKSIZE))
 
+    def test_storage(self):
+        g = snipe.gap.GapBuffer('abc\N{LATIN SMALL LETTER E WITH ACUTE}')
+        self.assertEqual(g.buf.itemsize, 1)
+        m = g.mark(2)
+        g.replace(1, 0, '\N{GREEK SMALL LETTER ALPHA}')
+        self.assertEqual(g.buf.itemsize, 2)
+        self.assertEqual(g.text, 'a\N{GREEK SMALL LETTER ALPHA}bc\xe9')
+        self.assertEqual(m.point, 3)
+        g.replace(g.size, 0, '\N{PILE OF POO}')
+        self.assertEqual(g.buf.itemsize, 4)
+        g.replace(0, 0, 'x\ud800')
+        self.assertEqual(
+            g.text,
+            'x\ud800a\N{GREEK SMALL LETTER ALPHA}bc\xe9\N{PILE OF POO}')
+        self.assertEqual(g.textrange(7, 8), '\N{PILE OF POO}')
+        g.replace(0, g.size, 'ascii')
+        self.assertEqual(g.text, 'ascii')
+
+    def test_storage_surrogates(self):
+        # lone halves of a surrogate pair, inserted one at a time, mustn't
+        # merge into one character
+        g = snipe.gap.GapBuffer('ab\N{GREEK SMALL LETTER ALPHA}')
+        g.replace(2, 0, '\ud83d')
+        g.replace(3, 0, '\udca9')
+        self.assertEqual(g.buf.itemsize, 4)
+        self.assertEqual(g.size, 5)
+        self.assertEqual(g.text, 'ab\ud83d\udca9\N{GREEK SMALL LETTER ALPHA}')
+        self.assertEqual(g.textrange(4, 5), '\N{GREEK SMALL LETTER ALPHA}')
+
     def test_undo1(self):
         g = snipe.gap.UndoableGapBuffer()
-        self.assertEqual(g.undo(0), None)
+        self.assertEqual(g.undo(), None)
         g.replace(0, 0, 'foo')
         self.assertEqual(g.text, 'foo')
-        self.assertEqual(g.undo(0), (1, 0))
+        self.assertEqual(g.undo(), 0)
         self.assertEqual(g.text, '')
+        self.assertEqual(g.undo(), None)
 
     def test_undo2(self):
         g = snipe.gap.UndoableGapBuffer()
-        self.assertEqual(g.undo(0), None)
+        self.assertEqual(g.undo(), None)
         g.replace(0, 0, 'foo', True)
         self.assertEqual(g.text, 'foo')
+        g.undo_boundary()
         g.replace(3, 0, 'bar', True)
         self.assertEqual(g.text, 'foobar')
-        self.assertEqual(g.undo(0), (1, 0))
+        self.assertEqual(len(g.undolog), 1)
+        self.assertEqual(g.undo(), 0)
+        self.assertEqual(g.text, '')
+
+    def test_undo_units(self):
+        g = snipe.gap.UndoableGapBuffer()
+        g.replace(0, 0, 'foo')
+        g.replace(3, 0, 'bar')
+        g.undo_boundary()
+        g.replace(0, 3, 'baz')
+        self.assertEqual(g.text, 'bazbar')
+        self.assertEqual(g.undo(), 3)
+        self.assertEqual(g.text, 'foobar')
+        self.assertEqual(g.undo(), 0)
         self.assertEqual(g.text, '')
 
+    def test_redo(self):
+        g = snipe.gap.UndoableGapBuffer()
+        self.assertEqual(g.redo(), None)
+        g.replace(0, 0, 'foo')
+        g.undo_boundary()
+        g.replace(3, 0, 'bar')
+        g.undo()
+        g.undo()
+        self.assertEqual(g.text, '')
+        self.assertEqual(g.redo(), 3)
+        self.assertEqual(g.text, 'foo')
+        self.assertEqual(g.redo(), 6)
+        self.assertEqual(g.text, 'foobar')
+        self.assertEqual(g.redo(), None)
+        g.undo()
+        g.replace(0, 0, 'x')
+        self.assertEqual(g.redo(), None)
+
+    def test_undo_limit(self):
+        g = snipe.gap.UndoableGapBuffer('abc' * 10, undo_limit=10)
+        for i in range(10):
+            g.undo_boundary()
+            g.replace(0, 3, '')
+        self.assertLessEqual(g.undo_size, 10)
+        self.assertEqual(len(g.undolog), 2)
+        g.undo()
+        g.undo()
+        self.assertEqual(g.undo(), None)
+        self.assertEqual(g.text, 'abc' * 2)
+
+    def test_undo_compress(self):
+        g = snipe.gap.UndoableGapBuffer(undo_compress=16)
+        g.replace(0, 0, 'x' * 1000)
+        g.undo_boundary()
+        g.replace(0, 1000, '')
+        self.assertIsInstance(g.undolog[-1][0][2], bytes)
+        self.assertLess(g.undo_size, 100)
+        g.undo()
+        self.assertEqual(g.text, 'x' * 1000)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -32,8 +32,13 @@
 Unit tests for help system
 '''
 
+import os
 import sys
+import tempfile
 import unittest
+import unittest.mock as mock
+
+import mocks
 
 sys.path.append('..')
 sys.path.append('../lib')
@@ -182,6 +187,51 @@ class TestHelp(unittest.TestCase):
             (363, Chunk([((), '\n'), (('cursor', 'visible'), '')]))],
             [(int(mark), chunk) for (mark, chunk) in w.view(0)])
 
+    def test_scantitles(self):
+        self.assertEqual(
+            help.HelpBrowser.scantitles(
+                '=====\nTitle\n=====\n\nA\n-\nfoo\n\n'
+                'B\n---\nBa\n+++++\n::\n\n  C\n  ---\n\n'
+                'Bb\n++\n\nD\n---\n'),
+            ['Title', ['B', ['Ba'], ['Bb']], ['D']])
+        self.assertEqual(
+            help.HelpBrowser.scantitles(
+                '=====\nTitle\n=====\n\nSub\n---\n\nA\n+++\n'),
+            ['Title', ['A']])
+        self.assertEqual(
+            help.HelpBrowser.gettoclines('Title\n=====\n', 'page'),
+            ['| * `Title <page#Title>`_', ''])
+
+    def test_render_cache(self):
+        fe = mocks.FE()
+        fe.context.ensure_directory = lambda: None
+        with tempfile.TemporaryDirectory() as directory:
+            fe.context.directory = directory
+            help.HelpBrowser.pages.clear()
+            w = help.HelpBrowser(fe)
+            self.assertEqual(list(w.pages), [w.toc[0]])
+            self.assertEqual(
+                len(os.listdir(os.path.join(directory, 'helpcache'))), 1)
+            rendered = w.pages[w.toc[0]]
+
+            help.HelpBrowser.pages.clear()
+            with mock.patch(
+                    'docutils.core.publish_programmatically',
+                    side_effect=AssertionError('should have been cached')):
+                w = help.HelpBrowser(fe)
+            self.assertEqual(w.pages[w.toc[0]], rendered)
+
+            # a page rendered differently replaces its old entry, and
+            # anything that isn't a page gets cleared out
+            cache = os.path.join(directory, 'helpcache')
+            open(os.path.join(cache, 'stray'), 'w').close()
+            help.HelpBrowser.pages.clear()
+            with mock.patch('docutils.__version__', 'other'):
+                w = help.HelpBrowser(fe)
+            self.assertEqual(
+                os.listdir(cache), [help.HelpBrowser.cache_name(w.toc[0])])
+            help.HelpBrowser.pages.clear()
+
 
 PAGE = ([
     View(0, Chunk([((), ''), (('bold',), 'snipe'), ((), '\n')])),
@@ -32,8 +32,11 @@
 Unit tests for interactive function infrastructure
 '''
 
-import unittest
+import os
 import sys
+import tempfile
+import unittest
+import unittest.mock as mock
 
 sys.path.append('..')
 sys.path.append('../lib')
@@ -44,3 +47,20 @@ import snipe.interactive as interactive  # noqa: E402,F401
 class TestInteractive(unittest.TestCase):
     def test_null(self):
         pass
+
+
+class TestFileCompleter(unittest.TestCase):
+    def test_listdir(self):
+        with tempfile.TemporaryDirectory() as directory:
+            open(os.path.join(directory, 'file'), 'w').close()
+            os.mkdir(os.path.join(directory, 'dir'))
+            expected = ['dir' + os.path.sep, 'file']
+            self.assertEqual(
+                sorted(interactive.FileCompleter.listdir(directory)),
+                expected)
+            # and without scandir, as before 3.5
+            with mock.patch.dict(os.__dict__):
+                del os.scandir
+                self.assertEqual(
+                    sorted(interactive.FileCompleter.listdir(directory)),
+                    expected)
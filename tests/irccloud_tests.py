@@ -32,6 +32,9 @@
 Unit tests for irccloud backend
 '''
 
+import asyncio
+import json
+import logging
 import os
 import unittest
 import sys
@@ -284,5 +287,208 @@ class TestIRCCloudMessage(unittest.TestCase):
             ' 12 chars None noise>')
 
 
+class TestIRCCloudOrdering(unittest.TestCase):
+    def test(self):
+        i = irccloud.IRCCloud(context.Context())
+        i.buffers = {1: {'bid': 1, 'cid': 1, 'name': '#foo'}}
+        i.connections = {1: {'cid': 1, 'hostname': 'irc.example.com'}}
+        redisplays = []
+        i.redisplay = lambda m1, m2: redisplays.append((m1, m2))
+        loop = asyncio.get_event_loop()
+
+        def event(eid):
+            return {
+                'type': 'buffer_msg', 'eid': eid, 'bid': 1, 'cid': 1,
+                'from': 'bob', 'from_name': 'bob', 'from_host': 'example.com',
+                'msg': str(eid)}
+
+        for eid in (10, 30, 20, 40, 5):
+            loop.run_until_complete(i.process_message(i.messages, event(eid)))
+        self.assertEqual(
+            [m.data['eid'] for m in i.messages], [5, 10, 20, 30, 40])
+        self.assertEqual(i.destinations(), {
+            'irccloud; irc.example.com #foo',
+            'irccloud; irc.example.com bob'})
+        self.assertEqual(i.senders(), {'irccloud; irc.example.com bob'})
+
+        included = []
+        for eid in (35, 25, 45):
+            loop.run_until_complete(
+                i.process_message(included, event(eid), batch=True))
+        self.assertEqual([m.data['eid'] for m in included], [35, 25, 45])
+        included.sort()
+        i.merge(included)
+        self.assertEqual(
+            [m.data['eid'] for m in i.messages],
+            [5, 10, 20, 25, 30, 35, 40, 45])
+        self.assertEqual(redisplays, [(included[0], included[-1])])
+
+    def test_include(self):
+        i = irccloud.IRCCloud(context.Context())
+        i.session = 'session'
+        i.INCLUDE_CHUNK = 100
+        i.buffers = {1: {'bid': 1, 'cid': 1, 'name': '#foo'}}
+        i.connections = {1: {'cid': 1, 'hostname': 'irc.example.com'}}
+        redisplays = []
+        i.redisplay = lambda m1, m2: redisplays.append((m1, m2))
+        backlog = [{'type': 'makebuffer', 'bid': 2, 'cid': 1, 'name': '#bar'}]
+        backlog += [
+            {'type': 'buffer_msg', 'eid': eid, 'bid': 1 + eid % 2, 'cid': 1,
+             'msg': 'x' * eid}
+            for eid in (50, 10, 40, 20, 30)]
+        data = json.dumps(backlog).encode()
+
+        class Content:
+            @asyncio.coroutine
+            def read(self, n):
+                nonlocal data
+                chunk, data = data[:n], data[n:]
+                return chunk
+
+        class Response:
+            content = Content()
+            released = False
+
+            def release(self):
+                self.released = True
+
+        response = Response()
+
+        class Session:
+            @asyncio.coroutine
+            def get(self, url, **kw):
+                self.url = url
+                return response
+
+        i._clientsession = Session()
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(i.include('/chat/oob-loader'))
+        self.assertTrue(response.released)
+        self.assertEqual(
+            i._clientsession.url, irccloud.IRCCLOUD_API + '/chat/oob-loader')
+        self.assertEqual(i.buffers[2]['name'], '#bar')
+        self.assertEqual(
+            [m.data['eid'] for m in i.messages], [10, 20, 30, 40, 50])
+        self.assertEqual(redisplays, [(i.messages[0], i.messages[-1])])
+
+
+class TestIRCCloudSend(unittest.TestCase):
+    def test(self):
+        i = irccloud.IRCCloud(context.Context())
+        i.floodpause = .001
+        i.flood_burst = 2
+        i.buffers = {1: {'bid': 1, 'cid': 1, 'name': '#foo'}}
+        i.connections = {1: {'cid': 1, 'hostname': 'irc.example.com'}}
+        i.redisplay = lambda m1, m2: None
+        said = []
+        outcomes = []
+
+        @asyncio.coroutine
+        def say(cid, to, msg):
+            outcome = outcomes.pop(0) if outcomes else {'success': True}
+            if outcome is None:
+                return None  # not connected, say
+            said.append((cid, to, msg))
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        i.say = say
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(i.send('irc.example.com #foo', 'a\n\nb\nc'))
+        loop.run_until_complete(i.send('example bob', 'd'))
+        # the first burst goes straight out, the rest waits its turn
+        self.assertEqual(said, [(1, '#foo', 'a'), (1, '#foo', 'b')])
+        self.assertEqual(i.progress(), 'irccloud: 2 lines to send')
+        loop.run_until_complete(i.drainers[1])
+        self.assertEqual(said, [
+            (1, '#foo', 'a'), (1, '#foo', 'b'), (1, '#foo', 'c'),
+            (1, '*', '/msg bob d')])
+        self.assertIsNone(i.progress())
+
+        # if it couldn't be sent at all, it's kept and tried again
+        del said[:]
+        outcomes[:] = [{'success': True}, None, None]
+        loop.run_until_complete(i.send('example #foo', 'e\nf\ng'))
+        loop.run_until_complete(i.drainers[1])
+        self.assertEqual(
+            said, [(1, '#foo', 'e'), (1, '#foo', 'f'), (1, '#foo', 'g')])
+        self.assertFalse(any(m.error for m in i.messages))
+
+        # the server turning a line down doesn't stop the rest
+        del said[:]
+        outcomes[:] = [{'success': False, 'message': 'no'}]
+        loop.run_until_complete(i.send('example #foo', 'h\ni'))
+        with self.assertLogs(i.log.name, logging.WARNING):
+            loop.run_until_complete(i.drainers[1])
+        self.assertEqual(said, [(1, '#foo', 'h'), (1, '#foo', 'i')])
+        self.assertEqual(
+            i.messages[-1].body, 'could not send to #foo: h: no')
+
+        # but if there's no telling what became of a line, it isn't sent
+        # again, and neither is the rest
+        del said[:]
+        outcomes[:] = [{'success': True}, asyncio.TimeoutError()]
+        loop.run_until_complete(i.send('example #foo', 'j\nk\nl'))
+        with self.assertLogs(i.log.name, logging.WARNING):
+            loop.run_until_complete(i.drainers[1])
+        self.assertEqual(said, [(1, '#foo', 'j'), (1, '#foo', 'k')])
+        self.assertIsNone(i.progress())
+        self.assertTrue(i.messages[-1].error)
+        self.assertEqual(
+            i.messages[-1].body, 'could not send:\n#foo: k\n#foo: l')
+
+        # nor if we can't get it out after a while
+        del said[:]
+        i.SEND_RETRIES = 2
+        outcomes[:] = [None] * 3
+        loop.run_until_complete(i.send('example #foo', 'm'))
+        with self.assertLogs(i.log.name, logging.WARNING):
+            loop.run_until_complete(i.drainers[1])
+        self.assertEqual(said, [])
+        self.assertEqual(i.messages[-1].body, 'could not send:\n#foo: m')
+
+        # nor is what's left when we shut down, but it doesn't vanish
+        i.flood_burst = 1
+        i.floodpause = 60
+        i.buckets = {}
+        loop.run_until_complete(i.send('example #foo', 'n\no'))
+        loop.run_until_complete(asyncio.sleep(0))
+        with self.assertLogs(i.log.name, logging.WARNING):
+            loop.run_until_complete(i.shutdown())
+        self.assertEqual(said, [(1, '#foo', 'n')])
+        self.assertIsNone(i.progress())
+        self.assertEqual(i.messages[-1].body, 'could not send:\n#foo: o')
+
+    def test_say(self):
+        i = irccloud.IRCCloud(context.Context())
+        loop = asyncio.get_event_loop()
+
+        # not connected
+        self.assertIsNone(loop.run_until_complete(i.say(1, '#foo', 'a')))
+
+        class WebSocket:
+            closed = False
+            written = []
+
+            def write(self, data):
+                self.written.append(data)
+
+        i.websocket = WebSocket()
+        say = asyncio.Task(i.say(1, '#foo', 'b'))
+        loop.run_until_complete(asyncio.sleep(0))
+        (sent,) = i.websocket.written
+        self.assertEqual(
+            (sent['_method'], sent['cid'], sent['to'], sent['msg']),
+            ('say', 1, '#foo', 'b'))
+
+        # the answer comes back with the request's id, and isn't a message
+        reply = {'_reqid': sent['_reqid'], 'success': True}
+        loop.run_until_complete(i.incoming(reply))
+        self.assertIs(loop.run_until_complete(say), reply)
+        self.assertEqual(i.messages, [])
+        self.assertEqual(i.replies, {})
+
+
 if __name__ == '__main__':
     unittest.main()
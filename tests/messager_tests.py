@@ -32,12 +32,12 @@
 Unit tests for messager module
 '''
 
-import contextlib
+import asyncio
 import datetime
-import io
 import math
 import os
 import sys
+import tempfile
 import unittest
 import unittest.mock as mock
 
@@ -683,19 +683,14 @@ body: ""
         w = messager.Messager(mocks.FE())
         w.context.backends._messages[0].body = 'foo'
         w.context.backends._messages.append(mocks.Message())
-        fp = io.StringIO('')
-        w.read_filename = returning('/nope')
 
-        @contextlib.contextmanager
-        def mock_open(*args):
-            print(args)
-            yield fp
-
-        messager.open = mock_open
-        for _ in w.write_region():
-            pass
-        del messager.open
-        self.assertEqual(fp.getvalue(), 'foo')
+        with tempfile.TemporaryDirectory() as directory:
+            pathname = os.path.join(directory, 'file')
+            w.read_filename = returning(pathname)
+            asyncio.get_event_loop().run_until_complete(
+                asyncio.coroutine(w.write_region)())
+            with open(pathname) as fp:
+                self.assertEqual(fp.read(), 'foo')
 
     def test_set_stark(self):
         w = messager.Messager(mocks.FE())
@@ -38,6 +38,7 @@ import datetime
 import itertools
 import os
 import sys
+import tempfile
 import time
 import unittest
 
@@ -273,6 +274,30 @@ class TestBackend(unittest.TestCase):
         self.assertFalse(s.tasks)
         self.assertTrue(t.done())
 
+    def test_resume(self):
+        loop = asyncio.get_event_loop()
+        with tempfile.TemporaryDirectory() as directory:
+            context = mocks.Context()
+            context.directory = directory
+            context.ensure_directory = lambda: None
+            s = SyntheticBackend(context)
+            s.resume_set('foo', 1)  # not loaded, so not kept
+            self.assertIsNone(s.resume_task)
+            self.assertEqual(s.resume_load(), {})
+            s.resume_set('foo', 1)
+            self.assertIsNotNone(s.resume_task)
+            loop.run_until_complete(s.shutdown())
+            self.assertIsNone(s.resume_task)
+
+            t = SyntheticBackend(context)
+            self.assertEqual(t.resume_load(), {'foo': 1})
+            t.resume_set('foo', 1)  # unchanged
+            self.assertIsNone(t.resume_task)
+            t.RESUME_INTERVAL = 0
+            t.resume_set('foo', 2)
+            loop.run_until_complete(t.resume_task)
+            self.assertEqual(s.resume_load(), {'foo': 2})
+
     def test_redisplay(self):
         s = SyntheticBackend(mocks.Context())
         s.context.ui = mocks.FE()
@@ -324,6 +349,30 @@ class TestMerge(unittest.TestCase):
             [1, 2, 3, 4, 5, 6, 8])
 
 
+class TestOrdering(unittest.TestCase):
+    @staticmethod
+    def msgs(*times):
+        ms = [mocks.Message() for t in times]
+        for (m, t) in zip(ms, times):
+            m.time = t
+        return ms
+
+    def test(self):
+        old = self.msgs(10.0, 10.0, 11.0)
+        messages.order_after(old)
+        self.assertEqual([m.time for m in old], [10.0, 10.00001, 11.0])
+
+        new = self.msgs(11.0, 11.0, 12.0)
+        messages.order_after(new, old[-1])
+        self.assertEqual(
+            [m.time for m in new], [11.00001, 11.00002, 12.0])
+
+        older = self.msgs(9.0, 10.0, 10.0)
+        messages.order_before(older, old[0], nudge=.5)
+        self.assertEqual([m.time for m in older], [8.5, 9.0, 9.5])
+        self.assertEqual(old[0].time, 10.0)
+
+
 class TestAggregator(unittest.TestCase):
     def test(self):
         context = mocks.Context()
@@ -84,6 +84,9 @@ class Aggregator:
     def count(self):
         return len(self._messages)
 
+    def progress(self):
+        return ''
+
     def send(self, params, body):
         self._sent.append((params, body))
         return ()
@@ -32,15 +32,21 @@
 Unit tests for roost backend
 '''
 
+import asyncio
+import logging
 import os
-import unittest
+import stat
 import sys
+import tempfile
+import time
+import unittest
 
 import mocks
 
 sys.path.append('..')
 sys.path.append('../lib')
 
+import snipe._rooster as _rooster  # noqa: E402,F401
 import snipe.context as context    # noqa: E402,F401
 import snipe.messages as messages  # noqa: E402,F401
 import snipe.roost as roost        # noqa: E402,F401
@@ -183,5 +189,195 @@ class TestRoostMessage(unittest.TestCase):
             ' 3 chars>')
 
 
+class FakeRooster:
+    def __init__(self, n):
+        self.store = [
+            {
+                'id': i,
+                'message': 'message %d' % (i,),
+                'receiveTime': i * 1000.0,
+                'sender': 'tim@ATHENA.MIT.EDU',
+                'class': 'message',
+                'instance': 'personal',
+                'recipient': '',
+                'opcode': '',
+                'signature': '',
+                'time': i * 1000.0,
+                } for i in range(n)]
+        self.requests = []
+        self.principal = None
+
+    @asyncio.coroutine
+    def messages(self, offset, limit, inclusive=False):
+        self.requests.append((offset, limit))
+        if offset is None:
+            offset = len(self.store)
+        elif inclusive:
+            offset += 1
+        start = max(0, offset - limit)
+        return {
+            'messages': list(reversed(self.store[start:offset])),
+            'isDone': start == 0,
+            }
+
+
+class TestRoostBackfill(unittest.TestCase):
+    def test_backfill(self):
+        r = roost.Roost(context.Context())
+        r.r = FakeRooster(1000)
+        r.redisplay = lambda m1, m2: None
+        r.connected = True
+        loop = asyncio.get_event_loop()
+
+        loop.run_until_complete(
+            r.do_backfill(None, None, 500, 0, None))
+        self.assertFalse(r.loaded)
+        self.assertFalse(r.backfilling)
+        # the page size grows while the (fake) server is fast
+        self.assertEqual(
+            r.r.requests, [(None, 128), (872, 256), (616, 512)])
+        self.assertEqual(r.chunksize, 1024)
+        self.assertEqual(
+            [m.data['id'] for m in r.messages], list(range(104, 1000)))
+
+        loop.run_until_complete(
+            r.do_backfill(r.messages[0].data['id'], None, 0, 0, None))
+        self.assertTrue(r.loaded)
+        self.assertEqual(
+            [m.data['id'] for m in r.messages], list(range(1000)))
+        self.assertEqual(r.r.requests[3:], [(104, 1024)])
+
+    def test_backfill_disconnected(self):
+        r = roost.Roost(context.Context())
+        r.r = FakeRooster(1000)
+        r.redisplay = lambda m1, m2: None
+        r.connected = True
+        fetch = r.r.messages
+
+        @asyncio.coroutine
+        def disconnecting(offset, limit, inclusive=False):
+            r.connected = False
+            return (yield from fetch(offset, limit, inclusive))
+        r.r.messages = disconnecting
+
+        # what's already been asked for gets filed, but that's it
+        asyncio.get_event_loop().run_until_complete(
+            r.do_backfill(None, None, 0, 0, None))
+        self.assertEqual(r.r.requests, [(None, 128)])
+        self.assertEqual(
+            [m.data['id'] for m in r.messages], list(range(872, 1000)))
+        self.assertFalse(r.backfilling)
+
+    def test_resume(self):
+        r = roost.Roost(context.Context())
+        r.r = FakeRooster(1000)
+        r.redisplay = lambda m1, m2: None
+        r.connected = True
+        r.resume = {'id': 500}
+        loop = asyncio.get_event_loop()
+
+        # with nothing in memory, backfill works back from where the last
+        # session left off (inclusively), since the tail picks up after it
+        r.backfill(None, 0)
+        loop.run_until_complete(asyncio.gather(*r.tasks))
+        self.assertEqual(r.r.requests, [(500, 128)])
+        self.assertEqual(
+            [m.data['id'] for m in r.messages], list(range(373, 501)))
+
+        loop.run_until_complete(r.new_messages_batch([r.r.store[501]]))
+        self.assertEqual(r.resume, {'id': 501})
+        r.resume_task.cancel()
+
+    def test_add_messages(self):
+        r = roost.Roost(context.Context())
+        redisplays = []
+        r.redisplay = lambda m1, m2: redisplays.append((m1, m2))
+        ms = [messages.SnipeMessage(r, str(i), 1.0) for i in range(3)]
+        r.add_messages(ms)
+        self.assertEqual(redisplays, [(ms[0], ms[-1])])
+        self.assertEqual(r.messages, ms)
+        self.assertTrue(all(
+            m1.time < m2.time for (m1, m2) in zip(ms, ms[1:])))
+        r.add_messages([])
+        self.assertEqual(len(redisplays), 1)
+
+
+class TestRoostZephyrcreds(unittest.TestCase):
+    def test_kerberos(self):
+        k = _rooster.Kerberos()
+        fetched = []
+
+        def get_zephyr_creds():
+            fetched.append(None)
+            return {'endtime': (time.time() + k.SLACK + 10) * 1000}
+
+        k.get_zephyr_creds = get_zephyr_creds
+        loop = asyncio.get_event_loop()
+
+        creds = loop.run_until_complete(k.zephyr_creds())
+        self.assertIs(loop.run_until_complete(k.zephyr_creds()), creds)
+        self.assertEqual(len(fetched), 1)
+
+        # about to expire, so go get fresh ones
+        creds['endtime'] -= 20 * 1000
+        self.assertIsNot(loop.run_until_complete(k.zephyr_creds()), creds)
+        self.assertEqual(len(fetched), 2)
+
+    def test_renew(self):
+        r = roost.Roost(context.Context())
+        r.ZEPHYRCREDS_MIN = 0
+        endtimes = [1000, 1000, 2000]
+        sent = []
+
+        class FakeRooster:
+            @asyncio.coroutine
+            def credentials(self):
+                if not endtimes:
+                    raise asyncio.CancelledError
+                return {'endtime': endtimes.pop(0) * 1000}
+
+            @asyncio.coroutine
+            def renew_zephyrcreds(self, creds):
+                sent.append(creds['endtime'] / 1000)
+
+        r.r = FakeRooster()
+        asyncio.get_event_loop().run_until_complete(r.renew_zephyrcreds())
+        # only when there's something newer than what the server has
+        self.assertEqual(sent, [1000, 2000])
+
+
+class TestZcrypt(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as directory:
+            program = os.path.join(directory, 'zcrypt')
+            with open(program, 'w') as fp:
+                fp.write(
+                    '#!/bin/sh\n'
+                    'echo "$@" >> %s/log\n'
+                    'tr a-z A-Z\n'
+                    'echo "**END**"\n' % (directory,))
+            os.chmod(program, stat.S_IRWXU)
+
+            z = roost.Zcrypt(logging.getLogger('zcrypt'), 2, program)
+            loop = asyncio.get_event_loop()
+            results = loop.run_until_complete(asyncio.gather(*[
+                z.decrypt('class', 'message %d' % (i,)) for i in range(5)]))
+            self.assertEqual(
+                results, ['MESSAGE %d' % (i,) for i in range(5)])
+            self.assertEqual(
+                loop.run_until_complete(z.decrypt('class', 'message 3')),
+                'MESSAGE 3')
+            with open(os.path.join(directory, 'log')) as fp:
+                self.assertEqual(fp.read(), '-D -c class\n' * 5)
+
+            self.assertEqual(
+                loop.run_until_complete(z.encrypt('class', 'foo')),
+                'FOO**END**\n')
+
+            z.program = os.path.join(directory, 'nonexistent')
+            self.assertIsNone(
+                loop.run_until_complete(z.decrypt('class', 'bar')))
+
+
 if __name__ == '__main__':
     unittest.main()
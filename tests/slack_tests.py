@@ -32,7 +32,10 @@
 Unit tests for slack backend
 '''
 
+import asyncio
+import json
 import os
+import tempfile
 import unittest
 import sys
 
@@ -209,5 +212,291 @@ class TestSlackMessage(unittest.TestCase):
             '<SlackMessage 0.0 <SlackAddress slack.test ?, foo> 0 chars>')
 
 
+class TestSlackBackfill(unittest.TestCase):
+    def test_scheduling(self):
+        s = slack.Slack(context.Context(), slackname='test')
+        s.backfill_concurrency = 2
+        s.redisplay = lambda m1, m2: None
+        s.users = {'U1': {'id': 'U1', 'name': 'someone'}}
+        for (n, (type_, active)) in enumerate([
+                ('channel', '1.0'), ('im', '4.0'), ('group', None),
+                ('channel', '3.0'), ('channel', '2.0')]):
+            data = {'id': 'C%d' % (n,), 'name': 'c%d' % (n,), 'user': 'U1'}
+            if type_ == 'channel':
+                data['is_member'] = True
+            if active is not None:
+                data['latest'] = {'ts': active}
+            s.dests[data['id']] = slack.SlackDest(s, type_, data)
+        s.messages.append(slack.SlackMessage(s, {
+            'type': 'message', 'channel': 'C4', 'ts': '5.0'}))
+
+        calls = []
+        running = []
+
+        @asyncio.coroutine
+        def method(method, channel, **kw):
+            running.append(channel)
+            calls.append((channel, len(running), s.progress()))
+            yield from asyncio.sleep(0)
+            running.remove(channel)
+            return {'ok': True, 'messages': []}
+        s.method = method
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(s.do_backfill(
+            lambda m: m.data.get('channel') == 'C4', None))
+
+        # the one we're looking at, then by recency, then the unknown
+        self.assertEqual(
+            [c for (c, _, _) in calls], ['C4', 'C1', 'C3', 'C0', 'C2'])
+        self.assertLessEqual(max(n for (_, n, _) in calls), 2)
+        self.assertEqual(calls[0][2], 'slack.test backfill 0/5')
+        self.assertIsNone(s.progress())
+        self.assertFalse(s.backfilling)
+
+    def test_catch_up(self):
+        s = slack.Slack(context.Context(), slackname='test')
+        s.redisplay = lambda m1, m2: None
+        s.dests['C0'] = slack.SlackDest(
+            s, 'channel', {'id': 'C0', 'name': 'c0', 'is_member': True})
+        s.dests['C1'] = slack.SlackDest(
+            s, 'channel', {'id': 'C1', 'name': 'c1', 'is_member': False})
+        s.resume = {'C0': '10.0', 'C1': '10.0'}
+        pages = {
+            None: {'ok': True, 'has_more': True, 'messages': [
+                {'type': 'message', 'ts': ts} for ts in ('14.0', '13.0')]},
+            '13.0': {'ok': True, 'has_more': False, 'messages': [
+                {'type': 'message', 'ts': ts} for ts in ('12.0', '10.0')]},
+            }
+        calls = []
+
+        @asyncio.coroutine
+        def method(method, channel, oldest, latest=None, **kw):
+            calls.append((method, channel, oldest, latest))
+            return pages[latest]
+        s.method = method
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(s.catch_up())
+        self.assertEqual(calls, [
+            ('channels.history', 'C0', '10.0', None),
+            ('channels.history', 'C0', '10.0', '13.0'),
+            ])
+        self.assertEqual(
+            [m.data['ts'] for m in s.messages],
+            ['10.0', '12.0', '13.0', '14.0'])
+        self.assertEqual(s.dests['C0'].oldest, 10.0)
+        self.assertEqual(s.resume['C0'], '14.0')
+        s.resume_task.cancel()
+
+        # after a long absence, only catch up on the newest messages
+        del s.messages[:]
+        s.messages_by_ts.clear()
+        s.dests['C0'].oldest = None
+        s.CATCH_UP = 2
+        calls.clear()
+        loop.run_until_complete(s.catch_up())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([m.data['ts'] for m in s.messages], ['13.0', '14.0'])
+        self.assertEqual(s.dests['C0'].oldest, 13.0)
+        s.resume_task.cancel()
+
+    def test_ratelimit(self):
+        s = slack.Slack(context.Context(), slackname='test')
+        s.token = 'token'
+        s.url = 'https://example.com/api/'
+
+        class Response:
+            def __init__(self, status, result, headers={}):
+                self.status = status
+                self.result = result
+                self.headers = headers
+
+            def release(self):
+                pass
+
+            @asyncio.coroutine
+            def read(self):
+                return json.dumps(self.result).encode()
+
+        responses = [
+            Response(429, None, {'Retry-After': '0.01'}),
+            Response(200, {'ok': False, 'error': 'ratelimited'}),
+            Response(200, {'ok': True}),
+            ]
+        posted = []
+
+        class Session:
+            @asyncio.coroutine
+            def post(self, url, data):
+                posted.append(url)
+                return responses.pop(0)
+
+        s._clientsession = Session()
+        s.RATELIMIT_WAIT = .01
+        loop = asyncio.get_event_loop()
+        self.assertEqual(
+            loop.run_until_complete(s.method('foo.bar')), {'ok': True})
+        self.assertEqual(posted, ['https://example.com/api/foo.bar'] * 3)
+        self.assertIn('foo.bar', s.ratelimits)
+
+
+class TestSlackIndexes(unittest.TestCase):
+    def test(self):
+        s = slack.Slack(context.Context(), slackname='test')
+        s.users = {'U0': {'id': 'U0', 'name': 'alice'}}
+        s.dests = {
+            'U0': slack.SlackDest(s, 'user', s.users['U0']),
+            'D0': slack.SlackDest(s, 'im', {'id': 'D0', 'user': 'U0'}),
+            'C0': slack.SlackDest(s, 'channel', {'id': 'C0', 'name': 'foo'}),
+            }
+        s.reindex()
+        loop = asyncio.get_event_loop()
+
+        def process(m):
+            return loop.run_until_complete(s.process_message(s.messages, m))
+
+        self.assertIs(s.dests_by_name['alice'], s.dests['D0'])
+        self.assertIs(s.dests_by_name['foo'], s.dests['C0'])
+        self.assertIs(s.users_by_name['alice'], s.dests['U0'])
+        self.assertEqual(
+            s.destinations(), {'slack.test; alice', 'slack.test; #foo'})
+        self.assertEqual(s.senders(), {'slack.test; alice'})
+        self.assertEqual(s.displayname('D0'), '@alice')
+
+        process({
+            'type': 'user_change', 'user': {'id': 'U0', 'name': 'bob'}})
+        self.assertNotIn('alice', s.dests_by_name)
+        self.assertIs(s.dests_by_name['bob'], s.dests['D0'])
+        self.assertIs(s.users_by_name['bob'], s.dests['U0'])
+        self.assertEqual(s.displayname('D0'), '@bob')
+        self.assertEqual(s.senders(), {'slack.test; bob'})
+
+        process({'type': 'team_join', 'user': {'id': 'U1', 'name': 'carol'}})
+        self.assertIs(s.users_by_name['carol'], s.dests['U1'])
+        process({'type': 'im_created', 'channel': {'id': 'D1', 'user': 'U1'}})
+        self.assertIs(s.dests_by_name['carol'], s.dests['D1'])
+        self.assertIs(s.ims_by_user['U1'], s.dests['D1'])
+
+        process({'type': 'channel_created', 'channel': {
+            'id': 'C1', 'name': 'bar'}})
+        self.assertIn('slack.test; #bar', s.destinations())
+        process({'type': 'channel_rename', 'channel': {
+            'id': 'C1', 'name': 'baz'}})
+        self.assertNotIn('bar', s.dests_by_name)
+        self.assertIs(s.dests_by_name['baz'], s.dests['C1'])
+        self.assertIn('slack.test; #baz', s.destinations())
+        self.assertEqual(s.displayname('C1'), '#baz')
+        self.assertEqual(s.displayname('C9'), 'C9')
+
+
+class TestSlackMetadata(unittest.TestCase):
+    def test_cache(self):
+        s = slack.Slack(context.Context(), slackname='test')
+        s.JSON_THREAD_THRESHOLD = 10
+        rtm = {
+            'ok': True,
+            'url': 'wss://example.com/',
+            'self': {'id': 'U0'},
+            'users': [{'id': 'U0', 'name': 'alice'}],
+            'bots': [],
+            'ims': [{'id': 'D0', 'user': 'U0'}],
+            'groups': [],
+            'channels': [{'id': 'C0', 'name': 'foo', 'is_member': True}],
+            }
+        emoji = {'ok': True, 'emoji': {'foo': 'alias:bar'}}
+        calls = []
+
+        @asyncio.coroutine
+        def method_raw(method, **kw):
+            calls.append(method)
+            result = {'rtm.start': rtm, 'emoji.list': emoji}[method]
+            raw = json.dumps(result).encode()
+            return (yield from s.decode(raw)), raw
+        s.method_raw = method_raw
+
+        loop = asyncio.get_event_loop()
+        with tempfile.TemporaryDirectory() as directory:
+            s.context.directory = directory
+            self.assertFalse(loop.run_until_complete(s.metadata_load()))
+            self.assertTrue(loop.run_until_complete(s.metadata_refresh()))
+            self.assertEqual(calls, ['rtm.start', 'emoji.list'])
+            self.assertEqual(s.data, rtm)
+            self.assertIs(s.dests_by_name['foo'], s.dests['C0'])
+
+            t = slack.Slack(context.Context(), slackname='test')
+            t.context.directory = directory
+            self.assertTrue(loop.run_until_complete(t.metadata_load()))
+            self.assertEqual(t.emoji, emoji)
+            self.assertEqual(t.users, {'U0': {'id': 'U0', 'name': 'alice'}})
+            self.assertIs(t.dests_by_name['alice'], t.dests['D0'])
+
+            # refreshing keeps the destinations' state
+            t.dests['C0'].loaded = True
+            rtm['channels'][0]['name'] = 'bar'
+            t.method_raw = method_raw
+            self.assertTrue(loop.run_until_complete(t.metadata_refresh()))
+            self.assertTrue(t.dests['C0'].loaded)
+            self.assertEqual(t.displayname('C0'), '#bar')
+
+            # but what's gone, or been deactivated, isn't offered any more
+            rtm['channels'] = []
+            rtm['users'][0]['deleted'] = True
+            self.assertTrue(loop.run_until_complete(t.metadata_refresh()))
+            self.assertEqual(t.destinations(), set())
+            self.assertEqual(t.senders(), set())
+            self.assertEqual(t.dests_by_name, {})
+            self.assertEqual(t.users_by_name, {})
+            # (but old messages can still say what it was)
+            self.assertEqual(t.displayname('C0'), '#bar')
+
+            # and if it comes back, so does it
+            rtm['channels'] = [{'id': 'C0', 'name': 'bar', 'is_member': True}]
+            self.assertTrue(loop.run_until_complete(t.metadata_refresh()))
+            self.assertIs(t.dests_by_name['bar'], t.dests['C0'])
+            self.assertEqual(t.destinations(), {'slack.test; #bar'})
+
+
+class TestSlackEvents(unittest.TestCase):
+    def test_edits_and_reactions(self):
+        s = slack.Slack(context.Context(), slackname='test')
+        redisplays = []
+        s.redisplay = lambda m1, m2: redisplays.append((m1, m2))
+        loop = asyncio.get_event_loop()
+
+        def process(m):
+            return loop.run_until_complete(s.process_message(s.messages, m))
+
+        first = process({
+            'type': 'message', 'channel': 'C0', 'ts': '1.000001',
+            'text': 'foo'})
+        process({
+            'type': 'message', 'channel': 'C1', 'ts': '1.000001',
+            'text': 'bar'})
+        self.assertIs(s.messages_by_ts[('C0', '1.000001')], first)
+
+        self.assertIsNone(process({
+            'type': 'reaction_added', 'user': 'U0', 'reaction': 'wave',
+            'item': {'channel': 'C0', 'ts': '1.000001'}}))
+        self.assertEqual(
+            first.data['reactions'],
+            [{'name': 'wave', 'count': 1, 'users': ['U0']}])
+        self.assertEqual(redisplays, [(first, first)])
+
+        self.assertIsNone(process({
+            'type': 'message', 'subtype': 'message_changed', 'channel': 'C0',
+            'message': {
+                'type': 'message', 'ts': '1.000001', 'text': 'baz'}}))
+        self.assertEqual(first.data['text'], 'baz')
+        self.assertEqual(first.data['channel'], 'C0')
+        self.assertEqual(redisplays[-1], (first, first))
+
+        self.assertIsNone(process({
+            'type': 'reaction_removed', 'user': 'U0', 'reaction': 'wave',
+            'item': {'channel': 'C2', 'ts': '1.000001'}}))
+        self.assertEqual(len(redisplays), 2)
+        self.assertEqual(len(s.messages), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -44,6 +44,7 @@ sys.path.append('../lib')
 from snipe.chunks import Chunk  # noqa: E402
 import snipe.help as help       # noqa: E402
 import snipe.keymap as keymap   # noqa: E402
+import snipe.rst as rst         # noqa: E402
 import snipe.text as text       # noqa: E402
 import snipe.util as util       # noqa: E402
 
@@ -52,7 +53,7 @@ class TestRendering(unittest.TestCase):
     def test_RSTRenderer(self):
         pub = parse_rest(TEXT)
 
-        renderer = text.RSTRenderer()
+        renderer = rst.RSTRenderer()
         renderer.process(pub.writer.document)
 
         import logging
@@ -180,6 +181,22 @@ class TestMarkdownXHTMLChunk(unittest.TestCase):
             '<p>foo</p>\n<blockquote>\n<p>bar</p>\n</blockquote>\n\n'
             '<p>baz</p>')
 
+    def test_reuse(self):
+        # a nested conversion needs a second instance, but then they both
+        # get reused
+        for i in range(2):
+            self.assertEqual(
+                text.markdown_to_xhtml('~~~~.quote\n*bar*\n~~~~\n'),
+                '<blockquote>\n<p><em>bar</em></p>\n</blockquote>')
+            self.assertEqual(len(text._markdown.idle), 2)
+
+        chunk = text.markdown_to_chunk('*foo*')
+        self.assertEqual(chunk.tagsets(), [({'bold'}, 'foo'), ((), '\n')])
+        chunk.append(((), 'bar'))
+        self.assertEqual(
+            text.markdown_to_chunk('*foo*').tagsets(),
+            [({'bold'}, 'foo'), ((), '\n')])
+
 
 TEXT = '''
 =============
@@ -290,14 +307,14 @@ def parse_rest(text):
 
 
 def rest_flat(input):
-    renderer = text.RSTRenderer()
+    renderer = rst.RSTRenderer()
     renderer.process(parse_rest(input).writer.document)
 
     return renderer.flat()
 
 
 def rest_chunks(input):
-    renderer = text.RSTRenderer()
+    renderer = rst.RSTRenderer()
     renderer.process(parse_rest(input).writer.document)
 
     return renderer.output
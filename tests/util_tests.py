@@ -33,11 +33,16 @@ Unit tests for stuff in utils.py
 '''
 
 
+import aiohttp
+import asyncio
+import json
 import os
 import random
 import sys
 import tempfile
+import time
 import unittest
+import unittest.mock as mock
 
 sys.path.append('..')
 sys.path.append('../lib')
@@ -60,6 +65,133 @@ class TestSafeWrite(unittest.TestCase):
                 self.assertEqual(fp.read(), string)
 
 
+class TestFileIO(unittest.TestCase):
+    def test_read_write(self):
+        loop = asyncio.get_event_loop()
+        with tempfile.TemporaryDirectory() as directory:
+            pathname = os.path.join(directory, 'file')
+            strings = [str(i) + '\n' for i in range(1000)]
+            loop.run_until_complete(
+                snipe.util.write_file(pathname, iter(strings), chunksize=100))
+
+            with open(pathname) as fp:
+                self.assertEqual(fp.read(), ''.join(strings))
+
+            chunks = []
+            loop.run_until_complete(
+                snipe.util.read_file(pathname, chunks.append, chunksize=100))
+            self.assertEqual(''.join(chunks), ''.join(strings))
+            self.assertEqual(max(len(c) for c in chunks), 100)
+
+
+class TestConfigurable(unittest.TestCase):
+    def test_overrides(self):
+        # overrides for modules that haven't been imported yet wait for them
+        snipe.util.Configurable.set_overrides({'test.later': '5'})
+
+        class Later:
+            context = None
+            later = snipe.util.Configurable('test.later', 1, coerce=int)
+
+        self.assertEqual(Later().later, 5)
+        self.assertNotIn('test.later', snipe.util.Configurable.overrides)
+
+
+class TestJSONArrayDecoder(unittest.TestCase):
+    def test(self):
+        value = [{'a': 'ä☃', 'b': [1, 2.5, None]}, 12345, 'x', [], {}]
+        data = json.dumps(value, ensure_ascii=False, indent=1).encode()
+        for size in (1, 3, 7, len(data)):
+            decoder = snipe.util.JSONArrayDecoder()
+            result = []
+            for i in range(0, len(data), size):
+                result += decoder.feed(data[i:i + size])
+            result += decoder.feed(b'')
+            self.assertEqual(result, value)
+
+        decoder = snipe.util.JSONArrayDecoder()
+        self.assertEqual(decoder.feed(b' [ ] '), [])
+        self.assertEqual(decoder.feed(b''), [])
+
+        # numbers that could still be going on aren't done yet
+        for first, second, value in (
+                (b'[1.', b'5]', 1.5),
+                (b'[1e', b'3]', 1e3),
+                (b'[1.5e', b'-3]', 1.5e-3),
+                (b'[12', b'34]', 1234),
+                ):
+            decoder = snipe.util.JSONArrayDecoder()
+            self.assertEqual(decoder.feed(first), [])
+            self.assertEqual(decoder.feed(second), [value])
+            self.assertEqual(decoder.feed(b''), [])
+
+        decoder = snipe.util.JSONArrayDecoder()
+        self.assertEqual(decoder.feed(b'["a\\'), [])
+        self.assertEqual(decoder.feed(b'"b", {"c": "]'), ['a"b'])
+        self.assertEqual(decoder.feed(b'}"}]'), [{'c': ']}'}])
+        self.assertEqual(decoder.feed(b''), [])
+
+        for bad in (
+                b'{"a": 1}', b'[1 2]', b'[1,', b'[1] 2', b'[1,]', b'[1.]',
+                b'[nul]'):
+            decoder = snipe.util.JSONArrayDecoder()
+            with self.assertRaises(snipe.util.JSONDecodeError):
+                decoder.feed(bad)
+                decoder.feed(b'')
+
+
+class TestJSONDecode(unittest.TestCase):
+    def test(self):
+        loop = asyncio.get_event_loop()
+        value = {'a': ['ä☃', 1, 2.5, None, True]}
+        data = json.dumps(value).encode()
+        before = dict(snipe.util.json_stats)
+        self.assertEqual(
+            loop.run_until_complete(snipe.util.json_decode(data)), value)
+        self.assertEqual(
+            loop.run_until_complete(snipe.util.json_decode(
+                data.decode(), threshold=10)),
+            value)
+        self.assertEqual(
+            snipe.util.json_stats['loop'], before['loop'] + 1)
+        self.assertEqual(
+            snipe.util.json_stats['thread'], before['thread'] + 1)
+        with self.assertRaises(ValueError):
+            loop.run_until_complete(snipe.util.json_decode(b'[1 2]'))
+        self.assertIn(snipe.util.JSON_CODEC, snipe.util.json_report())
+
+    def test_stdlib(self):
+        # bytes are decoded first, for pythons whose json won't take them
+        with mock.patch('json.loads') as loads:
+            snipe.util._json_stdlib_loads('[1]'.encode())
+        loads.assert_called_once_with('[1]')
+        self.assertEqual(snipe.util._json_stdlib_loads(b'[1]'), [1])
+        with self.assertRaises(ValueError):
+            snipe.util._json_stdlib_loads(b'["\xff"]')
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test(self):
+        now = [0.0]
+        bucket = snipe.util.TokenBucket(2, 3, clock=lambda: now[0])
+        loop = asyncio.get_event_loop()
+        for i in range(3):
+            loop.run_until_complete(bucket.take())
+        self.assertEqual(bucket.tokens, 0)
+        now[0] = 1.0
+        bucket.refill()
+        self.assertEqual(bucket.tokens, 2)
+        now[0] = 10.0
+        bucket.refill()
+        self.assertEqual(bucket.tokens, 3)
+
+        bucket = snipe.util.TokenBucket(100, 1)
+        start = time.monotonic()
+        for i in range(3):
+            loop.run_until_complete(bucket.take())
+        self.assertGreaterEqual(time.monotonic() - start, .015)
+
+
 class TestGlyphwidth(unittest.TestCase):
     def test_glyphwidth(self):
         self.assertEqual(snipe.util.glyphwidth('fred'), 4)
@@ -153,5 +285,69 @@ class TestGetobj(unittest.TestCase):
         self.assertIs(snipe.util.getobj('util_tests.TestGetobj'), TestGetobj)
 
 
+class TestHTTPPool(unittest.TestCase):
+    def test(self):
+        pool = snipe.util.HTTPPool(per_host=2)
+        requests = []
+        release = asyncio.Event()
+
+        class Session:
+            closed = False
+
+            @asyncio.coroutine
+            def request(self, method, url, **kw):
+                requests.append((method, url, kw))
+                yield from release.wait()
+                if 'fail' in url:
+                    raise OSError('nope')
+                return 'response'
+
+        pool._session = Session()
+        client = snipe.util.HTTPClient(pool, {'A': '1'}, auth='secret')
+        loop = asyncio.get_event_loop()
+
+        @asyncio.coroutine
+        def run():
+            tasks = [
+                asyncio.Task(client.get(
+                    'https://a.example/%d' % i, headers={'B': '2'}))
+                for i in range(3)]
+            other = asyncio.Task(client.post('https://b.example/'))
+            yield from asyncio.sleep(0)
+            self.assertEqual(len(requests), 4)
+            self.assertEqual(pool.stats['a.example']['active'], 3)
+            release.set()
+            results = yield from asyncio.gather(*tasks + [other])
+            with self.assertRaises(OSError):
+                yield from client.get('https://b.example/fail')
+            return results
+
+        self.assertEqual(loop.run_until_complete(run()), ['response'] * 4)
+        self.assertEqual(
+            requests[0],
+            ('GET', 'https://a.example/0',
+             {'headers': {'A': '1', 'B': '2'}, 'auth': 'secret'}))
+        self.assertEqual(client.headers, {'A': '1'})
+        self.assertEqual(pool.stats['a.example']['requests'], 3)
+        self.assertEqual(pool.stats['a.example']['active'], 0)
+        self.assertEqual(pool.stats['b.example']['requests'], 2)
+        self.assertEqual(pool.stats['b.example']['errors'], 1)
+        self.assertIn('b.example', pool.report())
+
+    def test_session(self):
+        pool = snipe.util.HTTPPool(per_host=2)
+
+        @asyncio.coroutine
+        def run():
+            session = pool.session
+            # the connector, not us, limits connections per host
+            self.assertEqual(session.connector.limit_per_host, 2)
+            # and nothing's cookies get shared with anyone else
+            self.assertIsInstance(session.cookie_jar, aiohttp.DummyCookieJar)
+            yield from session.close()
+
+        asyncio.get_event_loop().run_until_complete(run())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -32,6 +32,8 @@
 Unit tests for zulip backend
 '''
 
+import asyncio
+import logging
 import os
 import unittest
 import sys
@@ -119,5 +121,172 @@ class TestZulipMessage(unittest.TestCase):
             '<ZulipMessage 0.0 <ZulipAddress zulip tim@alum.mit.edu> 3 chars>')
 
 
+class TestZulipEvents(unittest.TestCase):
+    def test(self):
+        z = zulip.Zulip(context.Context())
+        z.redisplay = lambda m1, m2: None
+        log = []
+
+        def message(id_):
+            return {
+                'id': id_, 'timestamp': 100.0, 'content': str(id_),
+                'type': 'private', 'sender_email': 'a@example.com',
+                'display_recipient': [{'email': 'b@example.com'}]}
+
+        def event(id_, mid):
+            return {'type': 'message', 'id': id_, 'message': message(mid)}
+
+        registrations = [
+            {'queue_id': 'q1', 'last_event_id': -1},
+            {'queue_id': 'q2', 'last_event_id': 7},
+            ]
+        polls = [
+            {'result': 'success', 'events': [event(0, 10), event(1, 11)]},
+            {'result': 'success', 'events': [event(2, 11), event(3, 12)]},
+            {'result': 'error', 'code': 'BAD_EVENT_QUEUE_ID'},
+            {'result': 'success', 'events': [event(8, 14)]},
+            ]
+
+        @asyncio.coroutine
+        def _post(path, **kw):
+            log.append(('post', path))
+            params = registrations.pop(0)
+            params.update({'realm_users': [], 'streams': []})
+            return params
+
+        @asyncio.coroutine
+        def _get(path, **kw):
+            if path == 'messages':
+                log.append(('get', path, kw['anchor']))
+                return {
+                    'result': 'success',
+                    'messages': [message(12), message(13)]}
+            log.append(('get', path, kw['queue_id'], kw['last_event_id']))
+            if not polls:
+                raise asyncio.CancelledError
+            return polls.pop(0)
+
+        ingest = z.ingest
+
+        @asyncio.coroutine
+        def wrapped(events):
+            log.append(('ingest', len(events)))
+            yield from asyncio.sleep(0)
+            yield from ingest(events)
+        z._post, z._get, z.ingest = _post, _get, wrapped
+
+        asyncio.get_event_loop().run_until_complete(z.connect())
+
+        self.assertEqual(log, [
+            ('post', 'register'),
+            ('get', 'events', 'q1', -1),
+            ('ingest', 2),
+            ('get', 'events', 'q1', 1),
+            ('ingest', 2),
+            ('get', 'events', 'q1', 3),
+            ('post', 'register'),
+            ('get', 'messages', 12),
+            ('get', 'events', 'q2', 7),
+            ('ingest', 1),
+            ('get', 'events', 'q2', 8),
+            ])
+        self.assertEqual(
+            [m.data['id'] for m in z.messages], [10, 11, 12, 13, 14])
+        self.assertTrue(all(
+            a.time < b.time for (a, b) in zip(z.messages, z.messages[1:])))
+
+    def test_errors(self):
+        z = zulip.Zulip(context.Context())
+        z.redisplay = lambda m1, m2: None
+        z.RETRY = 0
+        log = []
+        failures = {'register': [OSError('down')], 'events': [ValueError()]}
+
+        @asyncio.coroutine
+        def _post(path, **kw):
+            log.append(('post', path))
+            if failures['register']:
+                raise failures['register'].pop(0)
+            return {
+                'queue_id': 'q1', 'last_event_id': -1,
+                'realm_users': [], 'streams': []}
+
+        @asyncio.coroutine
+        def _get(path, **kw):
+            if path == 'messages':
+                return {'result': 'success', 'messages': []}
+            log.append(('get', path, kw['last_event_id']))
+            if failures['events']:
+                raise failures['events'].pop(0)
+            raise asyncio.CancelledError
+        z._post, z._get = _post, _get
+
+        # a network or decoding error doesn't end the loop
+        with self.assertLogs(z.log.name, logging.ERROR):
+            asyncio.get_event_loop().run_until_complete(z.connect())
+
+        self.assertEqual(log, [
+            ('post', 'register'),
+            ('post', 'register'),
+            ('get', 'events', -1),
+            ('get', 'events', -1),
+            ])
+
+    def test_resume(self):
+        z = zulip.Zulip(context.Context())
+        z.redisplay = lambda m1, m2: None
+        z.resume = {'id': 5}
+        z.CATCH_UP = 3
+        newest = [7]
+        requests = []
+
+        @asyncio.coroutine
+        def _get(path, **kw):
+            anchor = kw['anchor']
+            requests.append((anchor, kw['num_before'], kw['num_after']))
+            if anchor == z.NEWEST:
+                ids = range(newest[0] - kw['num_before'] + 1, newest[0] + 1)
+            else:
+                ids = range(
+                    anchor, min(anchor + kw['num_after'], newest[0]) + 1)
+            return {'result': 'success', 'messages': [
+                {'id': i, 'timestamp': 100.0, 'content': '',
+                 'type': 'private', 'sender_email': 'a@example.com',
+                 'display_recipient': [{'email': 'b@example.com'}]}
+                for i in ids]}
+        z._get = _get
+
+        # after a restart, fetch what's new since the last message we saw
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(z.catch_up())
+        self.assertEqual(requests, [(5, 0, 3)])
+        self.assertEqual([m.data['id'] for m in z.messages], [5, 6, 7])
+        self.assertEqual(z.resume, {'id': 7})
+        z.resume_task.cancel()
+
+        # all of it, however many pages, so there's no hole in the middle
+        newest[0] = 15
+        del requests[:]
+        loop.run_until_complete(z.catch_up())
+        self.assertEqual(requests, [(7, 0, 3), (10, 0, 3), (13, 0, 3)])
+        self.assertEqual(
+            [m.data['id'] for m in z.messages], list(range(5, 16)))
+        z.resume_task.cancel()
+
+        # but with nothing in memory, a long absence starts from the
+        # newest and leaves the rest to backfill
+        z = zulip.Zulip(context.Context())
+        z.redisplay = lambda m1, m2: None
+        z.resume = {'id': 5}
+        z.CATCH_UP = 3
+        z._get = _get
+        del requests[:]
+        loop.run_until_complete(z.catch_up())
+        self.assertEqual(requests, [(5, 0, 3), (z.NEWEST, 3, 0)])
+        self.assertEqual([m.data['id'] for m in z.messages], [13, 14, 15])
+        self.assertFalse(z.backfilling)
+        z.resume_task.cancel()
+
+
 if __name__ == '__main__':
     unittest.main()